@@ -0,0 +1,307 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from metrics import metrics
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+class QueueFullError(ValueError):
+    """Raised when the admission queue is at ADMISSION_MAX_QUEUE"""
+
+
+class AdmissionController:
+    """
+    Admission control and weighted fair queuing for WhatsApp video jobs
+
+    Webhooks add a ticket to a queue instead of starting a Celery task
+    directly. Tickets are dispatched to Celery only while fewer than
+    ADMISSION_MAX_RUNNING jobs run in total and fewer than
+    ADMISSION_PER_SENDER_RUNNING run for the ticket's sender, so the broker
+    never holds more work than the workers can take and one sender cannot
+    occupy every worker.
+
+    Among eligible tickets the one with the smallest virtual finish time
+    goes first (self-clocked fair queuing): a sender's tickets are spaced
+    1/weight apart on a virtual clock that starts at the tag of the last
+    dispatched ticket, so a newcomer is served next to, not behind, a sender
+    with a long backlog. State lives in SQLite so every web and Celery
+    process sees the same queue.
+
+    A dispatched job holds its slot on a lease of ADMISSION_LEASE seconds,
+    renewed by heartbeat() while its stages run. Slots of jobs whose worker
+    died are reclaimed once the lease runs out, by the next dispatch();
+    a periodic dispatch (Celery beat) makes sure that happens even when no
+    new jobs arrive and none finish.
+    """
+
+    def __init__(self, db_path: str = None, max_running: int = None, max_queue: int = None,
+                 per_sender_running: int = None):
+        self.db_path = db_path or Config.ADMISSION_DB
+        self.max_running = max_running or Config.ADMISSION_MAX_RUNNING
+        self.max_queue = max_queue or Config.ADMISSION_MAX_QUEUE
+        self.per_sender_running = per_sender_running or Config.ADMISSION_PER_SENDER_RUNNING
+        self.weights = self._parse_weights(Config.ADMISSION_SENDER_WEIGHTS)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(
+                'CREATE TABLE IF NOT EXISTS tickets ('
+                'id TEXT PRIMARY KEY, sender TEXT NOT NULL, payload TEXT, status TEXT NOT NULL, '
+                'finish_tag REAL NOT NULL, enqueued_at REAL NOT NULL, started_at REAL, lease_until REAL);'
+                'CREATE INDEX IF NOT EXISTS tickets_queue ON tickets (status, finish_tag);'
+                'CREATE TABLE IF NOT EXISTS senders (sender TEXT PRIMARY KEY, last_finish REAL NOT NULL);'
+                'CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value REAL NOT NULL);'
+                "INSERT OR IGNORE INTO state (name, value) VALUES "
+                "('virtual_time', 0), ('dispatched', 0), ('rejected', 0), ('total_wait', 0), ('max_wait', 0);"
+            )
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(tickets)')]
+            if 'lease_until' not in columns:
+                # Databases created before leases were renewed
+                conn.execute('ALTER TABLE tickets ADD COLUMN lease_until REAL')
+
+    def admit(self, sender: str, payload: str = None) -> str:
+        """
+        Add a job to the queue
+
+        Args:
+            sender (str): Sender's phone number
+            payload (str, optional): Data handed back on dispatch, e.g. the video URL
+
+        Returns:
+            str: Ticket ID
+
+        Raises:
+            QueueFullError: If ADMISSION_MAX_QUEUE jobs are already waiting
+        """
+        return self.admit_many(sender, [payload])[0]
+
+    def admit_many(self, sender: str, payloads: list) -> list:
+        """
+        Add several jobs from one sender to the queue, all or none
+
+        Args:
+            sender (str): Sender's phone number
+            payloads (list): Data handed back on dispatch, one item per job
+
+        Returns:
+            list: Ticket IDs in the order of payloads
+
+        Raises:
+            QueueFullError: If the jobs do not fit under ADMISSION_MAX_QUEUE
+        """
+        ticket_ids = [uuid.uuid4().hex for _ in payloads]
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            queued = conn.execute("SELECT COUNT(*) FROM tickets WHERE status = 'queued'").fetchone()[0]
+            if queued + len(payloads) > self.max_queue:
+                conn.execute("UPDATE state SET value = value + 1 WHERE name = 'rejected'")
+                conn.commit()
+                raise QueueFullError(f"Admission queue is full ({queued} jobs waiting)")
+
+            virtual_time = self._state(conn, 'virtual_time')
+            row = conn.execute('SELECT last_finish FROM senders WHERE sender = ?', (sender,)).fetchone()
+            finish_tag = max(virtual_time, row[0] if row else 0)
+            tickets = []
+            for ticket_id, payload in zip(ticket_ids, payloads):
+                finish_tag += 1 / self.weights.get(sender, 1)
+                tickets.append((ticket_id, sender, payload, finish_tag, now))
+            conn.execute(
+                'INSERT OR REPLACE INTO senders (sender, last_finish) VALUES (?, ?)',
+                (sender, finish_tag)
+            )
+            conn.executemany(
+                "INSERT INTO tickets (id, sender, payload, status, finish_tag, enqueued_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                tickets
+            )
+            conn.commit()
+        return ticket_ids
+
+    def dispatch(self, launch) -> int:
+        """
+        Start queued jobs while there is capacity
+
+        Args:
+            launch (callable): Called as launch(ticket_id, sender, payload) for
+                each dispatched job, e.g. to enqueue the Celery task
+
+        Returns:
+            int: Number of jobs dispatched
+        """
+        dispatched = 0
+        while True:
+            ticket = self._next_ticket()
+            if not ticket:
+                return dispatched
+            ticket_id, sender, payload = ticket
+            try:
+                launch(ticket_id, sender, payload)
+            except Exception as e:
+                logger.error(f"Failed to dispatch job {ticket_id}: {str(e)}")
+                self._requeue(ticket_id)
+                return dispatched
+            dispatched += 1
+
+    def renew(self, ticket_id: str) -> bool:
+        """
+        Extend a running job's lease by ADMISSION_LEASE seconds
+
+        Returns:
+            bool: False if the job no longer holds a slot (released or reclaimed)
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE tickets SET lease_until = ? WHERE id = ? AND status = 'running'",
+                (time.time() + Config.ADMISSION_LEASE, ticket_id)
+            )
+            return cursor.rowcount > 0
+
+    @contextmanager
+    def heartbeat(self, ticket_id: str = None):
+        """
+        Keep a running job's lease alive for the duration of the block
+
+        The lease is renewed on entry, every ADMISSION_HEARTBEAT_INTERVAL
+        seconds from a background thread, and on exit, so it also covers the
+        hand-over to the job's next stage.
+
+        Args:
+            ticket_id (str, optional): Ticket of the job; without one the
+                block runs unchanged
+        """
+        if not ticket_id:
+            yield
+            return
+
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(Config.ADMISSION_HEARTBEAT_INTERVAL):
+                try:
+                    if not self.renew(ticket_id):
+                        logger.warning(f"Job {ticket_id} lost its admission slot")
+                        return
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not renew the lease of job {ticket_id}: {str(e)}")
+
+        self.renew(ticket_id)
+        thread = threading.Thread(target=beat, name=f"admission-heartbeat-{ticket_id[:8]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            try:
+                self.renew(ticket_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew the lease of job {ticket_id}: {str(e)}")
+
+    def release(self, ticket_id: str):
+        """Mark a dispatched job as finished, freeing its slot"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM tickets WHERE id = ?', (ticket_id,))
+            # Senders whose tags fell behind the clock no longer affect scheduling
+            conn.execute(
+                "DELETE FROM senders WHERE last_finish <= (SELECT value FROM state WHERE name = 'virtual_time')"
+            )
+
+    def get_stats(self) -> dict:
+        """
+        Get queue depth and wait-time metrics
+
+        Returns:
+            dict: Queued and running jobs, senders waiting, dispatched and
+                rejected counts, mean and max wait before dispatch, and the
+                age of the oldest queued job (seconds)
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            queued, senders, oldest = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sender), MIN(enqueued_at) FROM tickets WHERE status = 'queued'"
+            ).fetchone()
+            running = conn.execute("SELECT COUNT(*) FROM tickets WHERE status = 'running'").fetchone()[0]
+            dispatched = self._state(conn, 'dispatched')
+            total_wait = self._state(conn, 'total_wait')
+            return {
+                'queued': queued,
+                'running': running,
+                'senders_waiting': senders,
+                'max_running': self.max_running,
+                'max_queue': self.max_queue,
+                'dispatched': int(dispatched),
+                'rejected': int(self._state(conn, 'rejected')),
+                'mean_wait': total_wait / dispatched if dispatched else 0,
+                'max_wait': self._state(conn, 'max_wait'),
+                'oldest_wait': now - oldest if oldest else 0
+            }
+
+    def _next_ticket(self):
+        """Claim the eligible ticket with the smallest finish tag, if there is capacity"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Jobs whose worker died without releasing them
+            expired = conn.execute(
+                "DELETE FROM tickets WHERE status = 'running' AND "
+                "COALESCE(lease_until, started_at + ?) < ?",
+                (Config.ADMISSION_LEASE, now)
+            ).rowcount
+            if expired:
+                logger.warning(f"Reclaimed the slots of {expired} job(s) whose lease expired")
+            running = conn.execute("SELECT COUNT(*) FROM tickets WHERE status = 'running'").fetchone()[0]
+            row = None
+            if running < self.max_running:
+                row = conn.execute(
+                    "SELECT id, sender, payload, finish_tag, enqueued_at FROM tickets t "
+                    "WHERE status = 'queued' AND ("
+                    "  SELECT COUNT(*) FROM tickets r WHERE r.sender = t.sender AND r.status = 'running'"
+                    ") < ? ORDER BY finish_tag, enqueued_at LIMIT 1",
+                    (self.per_sender_running,)
+                ).fetchone()
+            if row:
+                ticket_id, sender, payload, finish_tag, enqueued_at = row
+                wait = now - enqueued_at
+                conn.execute(
+                    "UPDATE tickets SET status = 'running', started_at = ?, lease_until = ? WHERE id = ?",
+                    (now, now + Config.ADMISSION_LEASE, ticket_id)
+                )
+                conn.execute(
+                    "UPDATE state SET value = MAX(value, ?) WHERE name = 'virtual_time'", (finish_tag,)
+                )
+                conn.execute("UPDATE state SET value = value + 1 WHERE name = 'dispatched'")
+                conn.execute("UPDATE state SET value = value + ? WHERE name = 'total_wait'", (wait,))
+                conn.execute("UPDATE state SET value = MAX(value, ?) WHERE name = 'max_wait'", (wait,))
+                logger.info(f"Dispatching job {ticket_id} for {sender} after {wait:.1f}s in queue")
+            conn.commit()
+        if row:
+            metrics.observe('queue_wait_seconds', wait, queue='admission')
+        return row[:3] if row else None
+
+    def _requeue(self, ticket_id: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE tickets SET status = 'queued', started_at = NULL, lease_until = NULL WHERE id = ?",
+                (ticket_id,)
+            )
+
+    @staticmethod
+    def _state(conn, name: str) -> float:
+        return conn.execute('SELECT value FROM state WHERE name = ?', (name,)).fetchone()[0]
+
+    @staticmethod
+    def _parse_weights(spec: str) -> dict:
+        """Parse 'number=weight,number=weight' into a dict"""
+        weights = {}
+        for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+            sender, _, weight = item.partition('=')
+            weights[sender.strip()] = float(weight)
+        return weights
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
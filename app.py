@@ -1,11 +1,30 @@
 import os
-from flask import Flask, request, render_template, jsonify
+import io
+import csv
+import hmac
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import Flask, Response, request, render_template, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from video_downloader import VideoDownloader
 from content_generator import ContentGenerator
 from youtube_api import YouTubeUploader
-from whatsapp_handler import WhatsAppHandler
-from logger import setup_logger
+from whatsapp_handler import WhatsAppHandler, extract_urls
+from upload_index import UploadIndex
+from streaming_upload import GrowingFile
+from upload_receiver import UploadReceiver, UnsupportedMediaTypeError
+from thumbnail_extractor import ThumbnailExtractor
+from upload_scheduler import UploadScheduler
+from job_store import JobStore, FINAL_STATUSES
+from webhook_dedupe import WebhookDeduplicator
+from admission import AdmissionController, QueueFullError
+from errors import TransientError
+from metrics import metrics
+from logger import setup_logger, log_context
 from config import Config
 
 # Initialize Flask app
@@ -16,9 +35,16 @@ Config.init_app(app)
 # Initialize components
 logger = setup_logger(__name__)
 video_downloader = VideoDownloader()
-content_generator = ContentGenerator()
+content_generator = ContentGenerator(video_downloader.session)
 youtube_uploader = YouTubeUploader()
 whatsapp_handler = WhatsAppHandler()
+upload_index = UploadIndex()
+upload_scheduler = UploadScheduler()
+job_store = JobStore()
+webhook_deduplicator = WebhookDeduplicator()
+admission = AdmissionController()
+upload_receiver = UploadReceiver()
+thumbnail_extractor = ThumbnailExtractor()
 
 @app.route('/')
 def index():
@@ -35,16 +61,51 @@ def webhook():
             return jsonify({'status': 'error', 'message': 'Invalid message data'}), 400
 
         from_number = message_data['from_number']
-        message = message_data['message']
+        message_sid = message_data['message_sid']
         
-        # Process the video URL
-        process_video.delay(from_number, message)
+        # Twilio retries slow webhooks; answer duplicates without queueing again
+        if not webhook_deduplicator.claim(message_sid, from_number, None):
+            return jsonify({'status': 'duplicate'}), 200
+        urls = [
+            url for url in message_data['urls']
+            if webhook_deduplicator.claim(None, from_number, url)
+        ]
+        if not urls:
+            if message_data['urls']:
+                return jsonify({'status': 'duplicate'}), 200
+            whatsapp_handler.send_message(
+                from_number,
+                "🤔 I couldn't find a video in your message. Please attach a video or send a link to one."
+            )
+            return jsonify({'status': 'ignored'}), 200
+        
+        # Queue the video URLs; each starts once a worker is free and it is the sender's turn
+        try:
+            admit_batch(from_number, urls, notify=from_number)
+        except Exception as e:
+            webhook_deduplicator.release(message_sid, from_number, None)
+            for url in urls:
+                webhook_deduplicator.release(None, from_number, url)
+            if not isinstance(e, QueueFullError):
+                raise
+            logger.warning(f"Refusing jobs from {from_number}: {str(e)}")
+            whatsapp_handler.send_message(
+                from_number,
+                "⏳ We're busy processing other videos right now. Please send your link again in a few minutes."
+            )
+            return jsonify({'status': 'busy'}), 200
         
         # Send acknowledgment message
-        whatsapp_handler.send_message(
-            from_number,
-            "🎥 Got your video link! Starting the upload process..."
-        )
+        if len(urls) == 1:
+            whatsapp_handler.send_message(
+                from_number,
+                "🎥 Got your video! Starting the upload process..."
+            )
+        else:
+            whatsapp_handler.send_message(
+                from_number,
+                f"🎥 Got {len(urls)} videos! I'll send a summary once they're all done."
+            )
         
         return jsonify({'status': 'success'}), 200
 
@@ -52,6 +113,16 @@ def webhook():
         logger.error(f"Webhook error: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Pipeline metrics of every web and Celery process in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """Queue depth and wait times of WhatsApp jobs, for sizing the worker pool"""
+    return jsonify(admission.get_stats())
+
 @app.route('/chat/send', methods=['POST'])
 def chat_send():
     """Handle messages from the web chat interface"""
@@ -62,10 +133,11 @@ def chat_send():
         if not message:
             return jsonify({'status': 'error', 'message': 'Message is required'}), 400
 
-        # Process the video URL
-        result = process_video_sync(message)
+        # Queue the video URL; progress is streamed from /jobs/<job_id>/events
+        job_id = job_store.create()
+        process_chat_job.delay(job_id, message)
         
-        return jsonify(result), 200
+        return jsonify({'status': 'queued', 'job_id': job_id}), 202
 
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
@@ -74,104 +146,810 @@ def chat_send():
             'message': f"Error processing request: {str(e)}"
         }), 500
 
-def process_video_sync(url: str) -> dict:
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """
+    Publish a local video file
+    
+    Accepts the file as the raw request body (name in the X-Filename
+    header or ?filename=) or as the first file of a multipart form. The
+    body is streamed to UPLOAD_FOLDER without Werkzeug parsing the form;
+    progress is streamed from /jobs/<job_id>/events like chat jobs.
+    """
+    try:
+        if request.content_length and request.content_length > Config.MAX_CONTENT_LENGTH:
+            return jsonify({'status': 'error', 'message': 'File is too large'}), 413
+        
+        video_path, content_hash, name = upload_receiver.receive(
+            request.stream,
+            request.content_type,
+            filename=request.headers.get('X-Filename') or request.args.get('filename')
+        )
+        name = secure_filename(name or '') or os.path.basename(video_path)
+        job_id = job_store.create(url=f"upload:{name}")
+        try:
+            process_upload_job.delay(job_id, video_path, content_hash, name)
+        except Exception:
+            video_downloader.cleanup(video_path)
+            raise
+        return jsonify({'status': 'queued', 'job_id': job_id}), 202
+    
+    except UnsupportedMediaTypeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'status': 'error', 'message': 'File is too large'}), 413
+    except Exception as e:
+        logger.error(f"Upload error: {str(e)}")
+        return jsonify({'status': 'error', 'message': f"Error processing request: {str(e)}"}), 500
+
+@app.route('/jobs/batch', methods=['POST'])
+def jobs_batch():
+    """
+    Queue many video links at once
+    
+    Accepts JSON {"urls": [...], "notify": "+15550001111"} or a CSV file
+    upload in the "file" form field (every link in any column is used, with
+    an optional "notify" form field). Jobs go through the same admission
+    queue as WhatsApp messages; the optional notify number gets a single
+    summary when the batch is done. Anyone can reach this endpoint, so a
+    notify number must be in BATCH_NOTIFY_ALLOWLIST or the request must
+    carry BATCH_API_KEY in the X-API-Key header.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload:
+            urls = []
+            for row in csv.reader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig')):
+                for cell in row:
+                    urls.extend(extract_urls(cell))
+            notify = request.form.get('notify')
+        else:
+            data = request.get_json(silent=True) or {}
+            urls = data.get('urls')
+            notify = data.get('notify')
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                return jsonify({'status': 'error', 'message': 'urls must be a list of links'}), 400
+            if notify is not None and not isinstance(notify, str):
+                return jsonify({'status': 'error', 'message': 'notify must be a phone number'}), 400
+        
+        if notify and not notify_allowed(notify, request.headers.get('X-API-Key')):
+            return jsonify({
+                'status': 'error',
+                'message': 'Notifying this number requires a valid X-API-Key'
+            }), 403
+        
+        urls = list(dict.fromkeys(url.strip() for url in urls if url.strip()))
+        if not urls:
+            return jsonify({'status': 'error', 'message': 'No video links provided'}), 400
+        if len(urls) > Config.BATCH_MAX_URLS:
+            return jsonify({
+                'status': 'error',
+                'message': f"A batch can hold at most {Config.BATCH_MAX_URLS} links"
+            }), 400
+        
+        batch_id, job_ids = admit_batch(f"api:{request.remote_addr}", urls, notify=notify)
+        return jsonify({'status': 'queued', 'batch_id': batch_id, 'job_ids': job_ids}), 202
+    
+    except QueueFullError as e:
+        return jsonify({'status': 'busy', 'message': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Batch error: {str(e)}")
+        return jsonify({'status': 'error', 'message': f"Error processing request: {str(e)}"}), 500
+
+@app.route('/jobs/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Return the state of every job in a batch"""
+    batch = job_store.get_batch(batch_id)
+    if not batch:
+        return jsonify({'status': 'error', 'message': 'Unknown batch'}), 404
+    return jsonify(batch)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return the current state of a chat job"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a chat job's stage and progress as Server-Sent Events until it finishes"""
+    if not job_store.get(job_id):
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+
+    def stream():
+        version = None
+        last_sent = time.monotonic()
+        while True:
+            job = job_store.get(job_id)
+            if not job:
+                return
+            if job['version'] != version:
+                version = job['version']
+                last_sent = time.monotonic()
+                yield f"data: {json.dumps(job)}\n\n"
+                if job['status'] in FINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            time.sleep(Config.JOB_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def notify_allowed(notify: str, api_key: str = None) -> bool:
+    """
+    Check whether a batch request may send WhatsApp messages to a number
+    
+    Args:
+        notify (str): Number to notify
+        api_key (str, optional): X-API-Key sent with the request
+    """
+    if Config.BATCH_API_KEY and api_key and hmac.compare_digest(api_key, Config.BATCH_API_KEY):
+        return True
+    allowed = {number.strip() for number in Config.BATCH_NOTIFY_ALLOWLIST.split(',') if number.strip()}
+    return notify.strip() in allowed
+
+def admit_batch(sender: str, urls: list, notify: str = None) -> tuple:
+    """
+    Queue video links behind admission control as one batch
+    
+    Args:
+        sender (str): Admission key the jobs are scheduled under
+        urls (list): Video links
+        notify (str, optional): WhatsApp number for progress and the summary
+        
+    Returns:
+        tuple: (batch ID, list of job IDs)
+        
+    Raises:
+        QueueFullError: If the admission queue cannot take the whole batch
+    """
+    batch_id, job_ids = job_store.create_batch(urls, notify)
+    payloads = [
+        json.dumps({
+            'from_number': notify,
+            'url': url,
+            'job_id': job_id,
+            'batch_id': batch_id,
+            'batch_size': len(urls)
+        })
+        for url, job_id in zip(urls, job_ids)
+    ]
+    try:
+        admission.admit_many(sender, payloads)
+    except QueueFullError as e:
+        for job_id in job_ids:
+            job_store.finish(job_id, {'status': 'error', 'message': str(e)})
+        job_store.claim_batch_summary(batch_id)
+        raise
+    dispatch_jobs()
+    return batch_id, job_ids
+
+def dispatch_jobs():
+    """Start as many admitted jobs as there are free worker slots"""
+    admission.dispatch(
+        lambda ticket_id, sender, payload: process_video(ticket_id=ticket_id, **json.loads(payload))
+    )
+
+def byte_progress(progress_callback, stage: str):
+    """
+    Adapt a progress_callback(stage, percent) to the byte counts reported
+    by the download and upload loops
+    
+    Returns:
+        callable: report(done_bytes, total_bytes), or None without a callback
+    """
+    if not progress_callback:
+        return None
+
+    def report(done: int, total: int):
+        if total:
+            progress_callback(stage, min(100, int(done * 100 / total)))
+
+    return report
+
+def timed_download(url: str, progress_callback=None) -> str:
+    """
+    Download a video, recording the stage time and overall throughput by source type
+    
+    Files served from the download cache add no throughput sample: linking
+    a cached file says nothing about the source's speed. Cache hits are
+    counted by download_cache_events_total instead.
+    """
+    source = VideoDownloader.source_type(url)
+    started = time.monotonic()
+    with metrics.time_stage('download', source):
+        video_path = video_downloader.download_video(url, progress_callback=progress_callback)
+    elapsed = time.monotonic() - started
+    if elapsed > 0 and not video_downloader.from_cache(video_path):
+        metrics.observe(
+            'pipeline_download_throughput_bytes_per_second',
+            os.path.getsize(video_path) / elapsed,
+            source=source
+        )
+    return video_path
+
+def publish_thumbnail(thumbnail, video_id: str):
+    """
+    Set the thumbnail extracted during an upload on the uploaded video
+    
+    Called once the upload is over, with video_id None if it failed, so the
+    image is always removed. A missing or rejected thumbnail never fails
+    the job.
+    
+    Args:
+        thumbnail (Future): From ThumbnailExtractor.submit, or None
+        video_id (str): YouTube video ID, or None
+    """
+    if thumbnail is None:
+        return
+    try:
+        image_path = thumbnail.result()
+    except Exception as e:
+        logger.warning(f"Thumbnail extraction failed: {str(e)}")
+        return
+    if not image_path:
+        return
+    try:
+        if video_id:
+            upload_scheduler.submit(
+                YouTubeUploader.set_thumbnail,
+                video_id,
+                image_path,
+                cost=Config.YOUTUBE_THUMBNAIL_QUOTA_COST
+            ).result()
+    except Exception as e:
+        logger.warning(f"Could not set the thumbnail of {video_id}: {str(e)}")
+    finally:
+        video_downloader.cleanup(image_path)
+
+def publish_details(content: dict, video_path: str, url: str, video_id: str):
+    """
+    Correct the details of a video uploaded while it was still downloading
+    
+    The upload had to start with details generated without the container
+    headers; once the file is complete they are generated again, and the
+    video is updated if they differ. A failed update never fails the job.
+    
+    Args:
+        content (dict): Details the video was inserted with
+        video_path (str): Completely downloaded video
+        url (str): Link the video came from
+        video_id (str): YouTube video ID
+    """
+    details = content_generator.generate_content(video_path, source_url=url)
+    fields = ('title', 'description', 'tags')
+    if all(details[field] == content[field] for field in fields):
+        return
+    try:
+        upload_scheduler.submit(
+            YouTubeUploader.update_video_details,
+            video_id,
+            *(details[field] for field in fields),
+            cost=Config.YOUTUBE_UPDATE_QUOTA_COST
+        ).result()
+    except Exception as e:
+        logger.warning(f"Could not update the details of {video_id}: {str(e)}")
+
+def upload_while_downloading(url: str, progress_callback=None) -> tuple:
+    """
+    Download a video and upload it to YouTube at the same time
+    
+    The upload starts as soon as the first bytes are on disk and each chunk
+    waits for the downloader, so end-to-end time approaches the slower of
+    the two transfers instead of their sum. Falls back to uploading after
+    the download when the source does not announce its size. If the upload
+    fails, the download is cancelled and its file removed. The video is
+    inserted with details generated without the container headers, which
+    publish_details corrects once the file is complete.
+    
+    Args:
+        url (str): URL of the video
+        progress_callback (callable, optional): Called as
+            progress_callback(stage, percent) as the upload advances
+        
+    Returns:
+        tuple: (local path of the downloaded video, YouTube video ID)
+    """
+    source = GrowingFile()
+    # Run in a copy of this context so the download's log records keep the job fields
+    download = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(source.download, video_downloader, url),
+        daemon=True
+    )
+    download.start()
+    try:
+        video_path = source.wait_ready()
+        if source.total_size is None:
+            video_path = source.wait_finished()
+        
+        # Until the download finishes the container headers may not be on disk
+        content = content_generator.generate_content(
+            video_path, source_url=url, read_container=source.total_size is None
+        )
+        
+        thumbnail = video_id = None
+        try:
+            if source.total_size is None:
+                thumbnail = thumbnail_extractor.submit(video_path)
+                video_id = upload_scheduler.submit(
+                    YouTubeUploader.upload_video,
+                    video_path,
+                    content['title'],
+                    content['description'],
+                    content['tags'],
+                    progress_callback=byte_progress(progress_callback, 'uploading')
+                ).result()
+            else:
+                upload = upload_scheduler.submit(
+                    YouTubeUploader.upload_stream,
+                    source,
+                    content['title'],
+                    content['description'],
+                    content['tags'],
+                    progress_callback=byte_progress(progress_callback, 'uploading')
+                )
+                # A failed upload stops the download instead of letting it run to the end
+                upload.add_done_callback(lambda future: future.exception() and source.cancel())
+                try:
+                    # The upload waits for the download, so the file is complete before it is
+                    video_path = source.wait_finished()
+                except ValueError:
+                    if upload.done() and upload.exception():
+                        # Report why the upload failed rather than the cancelled download
+                        upload.result()
+                    raise
+                thumbnail = thumbnail_extractor.submit(video_path)
+                video_id = upload.result()
+                publish_details(content, video_path, url, video_id)
+        finally:
+            publish_thumbnail(thumbnail, video_id)
+    except BaseException:
+        # Nothing will upload the file any more: stop the download and remove what it wrote
+        source.cancel()
+        download.join()
+        if source.path:
+            video_downloader.cleanup(source.path)
+        raise
+    finally:
+        source.close()
+    
+    return video_path, video_id
+
+def process_video_sync(url: str, progress_callback=None) -> dict:
     """
     Process video synchronously (for web interface)
     Returns progress updates that can be displayed in the UI
+    
+    Args:
+        url (str): URL of the video
+        progress_callback (callable, optional): Called as
+            progress_callback(stage, percent) as the job advances; percent is
+            None for stages without byte-level progress
     """
+    report = progress_callback or (lambda stage, progress=None: None)
     try:
+        # Skip the whole pipeline if this link was uploaded before
+        video_id = upload_index.find_by_url(url)
+        if video_id:
+            logger.info(f"Video from {url} already uploaded as {video_id}")
+            return {
+                'status': 'success',
+                'message': 'This video was already uploaded.',
+                'video_url': youtube_uploader.get_upload_url(video_id)
+            }
+        
+        source = VideoDownloader.source_type(url)
+        if Config.STREAMING_UPLOAD_ENABLED:
+            logger.info(f"Downloading and uploading video from: {url}")
+            report('uploading')
+            with metrics.time_stage('stream_upload', source):
+                video_path, video_id = upload_while_downloading(url, progress_callback)
+            upload_index.record(url, video_downloader.content_hash(video_path), video_id)
+            video_downloader.cleanup(video_path)
+            return {
+                'status': 'success',
+                'message': 'Video uploaded successfully!',
+                'video_url': youtube_uploader.get_upload_url(video_id)
+            }
+        
         # Download video
         logger.info(f"Downloading video from: {url}")
-        video_path = video_downloader.download_video(url)
+        report('downloading')
+        download_progress = byte_progress(progress_callback, 'downloading')
+        video_path = timed_download(
+            url,
+            progress_callback=(
+                lambda path, available, total: download_progress(available, total)
+            ) if download_progress else None
+        )
+        
+        return publish_video(video_path, url, source, progress_callback)
+        
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+        return {
+            'status': 'error',
+            'message': f"Failed to process video: {str(e)}"
+        }
+
+def publish_video(video_path: str, url: str, source: str, progress_callback=None,
+                  content_hash: str = None, original_name: str = None) -> dict:
+    """
+    Generate content for a local video, upload it to YouTube and remove the file
+    
+    Args:
+        video_path (str): Downloaded or uploaded video file
+        url (str): Link the video came from, or a local upload name
+        source (str): Source type for metrics (see VideoDownloader.source_type)
+        progress_callback (callable, optional): See process_video_sync
+        content_hash (str, optional): Content hash if already known
+        original_name (str, optional): Client file name of an uploaded video
+        
+    Returns:
+        dict: status, message and video_url
+    """
+    report = progress_callback or (lambda stage, progress=None: None)
+    try:
+        # Skip the upload if the same content was uploaded from another link
+        content_hash = content_hash or video_downloader.content_hash(video_path)
+        video_id = upload_index.find_by_hash(content_hash)
+        if video_id:
+            logger.info(f"Content of {url} already uploaded as {video_id}")
+            upload_index.record(url, content_hash, video_id)
+            return {
+                'status': 'success',
+                'message': 'This video was already uploaded.',
+                'video_url': youtube_uploader.get_upload_url(video_id)
+            }
         
         # Generate content
         logger.info("Generating video content")
-        content = content_generator.generate_content(video_path)
+        report('generating')
+        with metrics.time_stage('generate', source):
+            content = content_generator.generate_content(
+                video_path,
+                source_url=None if original_name else url,
+                original_name=original_name
+            )
         
-        # Upload to YouTube
+        # Upload to YouTube, picking a thumbnail meanwhile
         logger.info("Uploading to YouTube")
-        video_id = youtube_uploader.upload_video(
-            video_path,
-            content['title'],
-            content['description'],
-            content['tags']
-        )
-        
-        # Clean up downloaded video
-        video_downloader.cleanup(video_path)
-        
-        # Get video URL
-        video_url = youtube_uploader.get_upload_url(video_id)
+        report('uploading')
+        thumbnail = thumbnail_extractor.submit(video_path)
+        video_id = None
+        try:
+            with metrics.time_stage('upload', source):
+                video_id = upload_scheduler.submit(
+                    YouTubeUploader.upload_video,
+                    video_path,
+                    content['title'],
+                    content['description'],
+                    content['tags'],
+                    progress_callback=byte_progress(progress_callback, 'uploading')
+                ).result()
+        finally:
+            publish_thumbnail(thumbnail, video_id)
+        upload_index.record(url, content_hash, video_id)
         
         return {
             'status': 'success',
             'message': 'Video uploaded successfully!',
-            'video_url': video_url
-        }
-        
-    except Exception as e:
-        logger.error(f"Error processing video: {str(e)}")
-        return {
-            'status': 'error',
-            'message': f"Failed to process video: {str(e)}"
+            'video_url': youtube_uploader.get_upload_url(video_id)
         }
+    finally:
+        # Clean up the local video
+        video_downloader.cleanup(video_path)
 
 # For asynchronous processing (WhatsApp messages)
-from celery import Celery
+from celery import Celery, Task, chain
+from celery.signals import worker_process_shutdown
 
-# Configure Celery
+# Configure Celery; CELERY_BROKER_URL=memory:// with CELERY_RESULT_BACKEND=cache+memory://
+# (or CELERY_TASK_ALWAYS_EAGER=true) runs without Redis, e.g. in tests
 celery = Celery(
     'youtube_uploader',
-    broker='redis://localhost:6379/0',
-    backend='redis://localhost:6379/0'
+    broker=Config.CELERY_BROKER_URL,
+    backend=Config.CELERY_RESULT_BACKEND
 )
+celery.conf.update(
+    task_always_eager=Config.CELERY_TASK_ALWAYS_EAGER,
+    # One queue per pipeline stage so each can get its own workers
+    task_routes={
+        'app.download_stage': {'queue': 'download'},
+        'app.generate_stage': {'queue': 'process'},
+        'app.upload_stage': {'queue': 'upload'},
+        'app.notify_stage': {'queue': 'notify'}
+    },
+    # Stages are long-running; do not let a worker reserve work it cannot start
+    worker_prefetch_multiplier=1,
+    # Run with `celery -A app.celery beat`; reclaims expired admission leases and starts queued jobs
+    beat_schedule={
+        'dispatch-admitted-jobs': {
+            'task': 'app.dispatch_admitted_jobs',
+            'schedule': Config.ADMISSION_DISPATCH_INTERVAL
+        }
+    }
+)
+
+@celery.task(name='app.dispatch_admitted_jobs')
+def dispatch_admitted_jobs():
+    """Periodic dispatch, so queued jobs start even when no webhook arrives and no job finishes"""
+    dispatch_jobs()
+
+@worker_process_shutdown.connect
+def close_outbox(**kwargs):
+    """Send queued WhatsApp messages before a prefork child exits (it skips atexit)"""
+    whatsapp_handler.outbox.close()
+
+@celery.task
+def process_upload_job(job_id: str, video_path: str, content_hash: str, name: str):
+    """Publish a video uploaded through /upload, recording progress in the job store"""
+    with log_context(job_id=job_id, stage='upload_file'):
+        job_store.update(job_id, status='running', stage='starting')
+        try:
+            result = publish_video(
+                video_path,
+                f"upload:{name}",
+                'upload',
+                progress_callback=job_store.progress_callback(job_id),
+                content_hash=content_hash,
+                original_name=name
+            )
+        except Exception as e:
+            logger.error(f"Error processing uploaded video: {str(e)}")
+            result = {'status': 'error', 'message': f"Failed to process video: {str(e)}"}
+        job_store.finish(job_id, result)
 
 @celery.task
-def process_video(from_number: str, url: str):
-    """Process video asynchronously and send WhatsApp updates"""
+def process_chat_job(job_id: str, url: str):
+    """Process a video queued from the web chat, recording progress in the job store"""
+    with log_context(job_id=job_id, stage='chat'):
+        job_store.update(job_id, status='running', stage='starting')
+        result = process_video_sync(url, progress_callback=job_store.progress_callback(job_id))
+        job_store.finish(job_id, result)
+
+def process_video(from_number: str, url: str, ticket_id: str = None, job_id: str = None,
+                  batch_id: str = None, batch_size: int = 1):
+    """
+    Process video asynchronously and send WhatsApp updates
+    
+    Runs download -> generate -> upload -> notify as a chain of tasks on
+    their own queues. Each stage receives the state dict returned by the
+    previous one; a stage that finds a finished video_id in it (a duplicate
+    upload) passes it through unchanged. Stages share files through
+    UPLOAD_FOLDER, so workers must share that directory.
+    
+    Args:
+        from_number (str): Sender's phone number, or None to send no messages
+        url (str): URL of the video
+        ticket_id (str, optional): Admission ticket to release when done
+        job_id (str, optional): Job store entry to record progress in
+        batch_id (str, optional): Batch to summarize once all its jobs finish
+        batch_size (int): Number of videos in the batch; WhatsApp progress
+            is only sent for single videos
+    """
+    state = {
+        'from_number': from_number,
+        'url': url,
+        'source': VideoDownloader.source_type(url),
+        'ticket_id': ticket_id,
+        'job_id': job_id,
+        'batch_id': batch_id,
+        'batch_size': batch_size,
+        'queued_at': time.time()
+    }
+    return chain(
+        download_stage.s(state),
+        generate_stage.s(),
+        upload_stage.s(),
+        notify_stage.s()
+    ).apply_async()
+
+@contextmanager
+def stage_progress(state: dict):
+    """
+    Provide the progress_callback(stage, percent) for a pipeline stage
+    
+    Progress goes to the job store, and to WhatsApp when the job is a
+    single video; batches only get the final summary. WhatsApp updates
+    held back by its rate limit are sent when the stage ends.
+    """
+    callbacks = []
+    if state.get('job_id'):
+        callbacks.append(job_store.progress_callback(state['job_id']))
+    if state.get('from_number') and state.get('batch_size', 1) == 1:
+        callbacks.append(whatsapp_handler.progress_callback(state['from_number']))
+
+    def report(stage: str, progress: int = None):
+        for callback in callbacks:
+            callback(stage, progress)
+
     try:
-        # Send starting message
-        whatsapp_handler.send_message(
-            from_number,
-            whatsapp_handler.format_progress_message("downloading")
+        yield report
+    finally:
+        for callback in callbacks:
+            if hasattr(callback, 'flush'):
+                callback.flush()
+
+def finish_pipeline(state: dict, result: dict):
+    """
+    Record a job's result, free its resources and notify the sender
+    
+    Args:
+        state (dict): Pipeline state
+        result (dict): status, message and (on success) video_url
+    """
+    if state.get('video_path'):
+        video_downloader.cleanup(state['video_path'])
+    if state.get('job_id'):
+        job_store.finish(state['job_id'], result)
+    if state.get('ticket_id'):
+        admission.release(state['ticket_id'])
+        dispatch_jobs()
+    
+    from_number = state.get('from_number')
+    batch_id = state.get('batch_id')
+    if batch_id:
+        # Only the last job of the batch to finish gets past this
+        if not job_store.claim_batch_summary(batch_id):
+            return
+        batch = job_store.get_batch(batch_id)
+        if batch['total'] > 1:
+            if from_number:
+                whatsapp_handler.send_batch_summary(from_number, batch['jobs'])
+            return
+    
+    if not from_number:
+        return
+    if result['status'] == 'success':
+        whatsapp_handler.send_video_complete_message(from_number, result['video_url'])
+    else:
+        whatsapp_handler.send_error_message(from_number, result['message'])
+
+class PipelineStage(Task):
+    """
+    A stage of the WhatsApp video pipeline
+    
+    Transient failures (see errors.TransientError) are retried with
+    backoff within the stage (downloads resume from their journal); any
+    other failure, or running out of retries, tells the sender and cleans
+    up the job.
+    """
+    autoretry_for = (TransientError,)
+    max_retries = Config.CELERY_STAGE_MAX_RETRIES
+    retry_backoff = Config.CELERY_STAGE_RETRY_BACKOFF
+    retry_jitter = True
+
+    def __call__(self, state: dict, *args, **kwargs):
+        # Time since the previous stage handed over, including any retry backoff
+        queue = celery.conf.task_routes[self.name]['queue']
+        metrics.observe('queue_wait_seconds', time.time() - state['queued_at'], queue=queue)
+        # Renew the job's admission lease while the stage runs, however long it takes
+        with self.log_context(state), admission.heartbeat(state.get('ticket_id')):
+            result = super().__call__(state, *args, **kwargs)
+        if isinstance(result, dict):
+            result['queued_at'] = time.time()
+        return result
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        with self.log_context(args[0]):
+            logger.error(f"Error in async processing ({self.name}): {str(exc)}")
+            finish_pipeline(args[0], {'status': 'error', 'message': str(exc)})
+
+    def log_context(self, state: dict):
+        """Tag the stage's log records with its job and stage name"""
+        return log_context(
+            job_id=state.get('job_id') or state.get('ticket_id'),
+            stage=self.name.rpartition('.')[2]
         )
+
+@celery.task(base=PipelineStage, name='app.download_stage')
+def download_stage(state: dict) -> dict:
+    """Download the video, or find an existing upload of it"""
+    url = state['url']
+    
+    # Skip the whole pipeline if this link was uploaded before
+    video_id = upload_index.find_by_url(url)
+    if video_id:
+        logger.info(f"Video from {url} already uploaded as {video_id}")
+        return {**state, 'video_id': video_id}
+    
+    if Config.STREAMING_UPLOAD_ENABLED:
+        # Upload overlaps the download, so both happen in this stage
+        with stage_progress(state) as report:
+            report("uploading")
+            with metrics.time_stage('stream_upload', state['source']):
+                video_path, video_id = upload_while_downloading(url, report)
+        upload_index.record(url, video_downloader.content_hash(video_path), video_id)
+        return {**state, 'video_path': video_path, 'video_id': video_id}
+    
+    with stage_progress(state) as report:
+        # Send starting message
+        report("downloading")
         
         # Download video
-        video_path = video_downloader.download_video(url)
-        
-        # Update progress
-        whatsapp_handler.send_message(
-            from_number,
-            whatsapp_handler.format_progress_message("generating content")
+        download_progress = byte_progress(report, "downloading")
+        video_path = timed_download(
+            url,
+            progress_callback=lambda path, available, total: download_progress(available, total)
         )
-        
-        # Generate content
-        content = content_generator.generate_content(video_path)
-        
-        # Update progress
-        whatsapp_handler.send_message(
-            from_number,
-            whatsapp_handler.format_progress_message("uploading")
-        )
-        
-        # Upload to YouTube
-        video_id = youtube_uploader.upload_video(
-            video_path,
-            content['title'],
-            content['description'],
-            content['tags']
-        )
-        
-        # Clean up downloaded video
-        video_downloader.cleanup(video_path)
-        
-        # Get video URL and send completion message
-        video_url = youtube_uploader.get_upload_url(video_id)
-        whatsapp_handler.send_video_complete_message(from_number, video_url)
-        
-    except Exception as e:
-        logger.error(f"Error in async processing: {str(e)}")
-        whatsapp_handler.send_error_message(from_number, str(e))
+    state = {**state, 'video_path': video_path}
+    
+    # Skip the upload if the same content was uploaded from another link
+    content_hash = video_downloader.content_hash(video_path)
+    video_id = upload_index.find_by_hash(content_hash)
+    if video_id:
+        logger.info(f"Content of {url} already uploaded as {video_id}")
+        upload_index.record(url, content_hash, video_id)
+        return {**state, 'video_id': video_id}
+    
+    return {**state, 'content_hash': content_hash}
+
+@celery.task(base=PipelineStage, name='app.generate_stage')
+def generate_stage(state: dict) -> dict:
+    """Generate the title, description and tags"""
+    if state.get('video_id'):
+        return state
+    
+    with stage_progress(state) as report:
+        report("generating content")
+    with metrics.time_stage('generate', state['source']):
+        content = content_generator.generate_content(state['video_path'], source_url=state['url'])
+    return {**state, 'content': content}
+
+@celery.task(base=PipelineStage, name='app.upload_stage')
+def upload_stage(state: dict) -> dict:
+    """Upload the video to YouTube"""
+    if state.get('video_id'):
+        return state
+    
+    # A retry after a successful insert must not upload (and pay for) the video again
+    video_id = upload_index.find_by_hash(state['content_hash'])
+    if video_id:
+        logger.info(f"Content of {state['url']} already uploaded as {video_id}")
+        upload_index.record(state['url'], state['content_hash'], video_id)
+        return {**state, 'video_id': video_id}
+    
+    content = state['content']
+    thumbnail = thumbnail_extractor.submit(state['video_path'])
+    video_id = None
+    try:
+        with stage_progress(state) as report, metrics.time_stage('upload', state['source']):
+            report("uploading")
+            video_id = upload_scheduler.submit(
+                YouTubeUploader.upload_video,
+                state['video_path'],
+                content['title'],
+                content['description'],
+                content['tags'],
+                progress_callback=byte_progress(report, "uploading")
+            ).result()
+        # Record the ID before anything else can fail, so a retry finds it
+        upload_index.record(state['url'], state['content_hash'], video_id)
+    finally:
+        publish_thumbnail(thumbnail, video_id)
+    return {**state, 'video_id': video_id}
+
+@celery.task(base=PipelineStage, name='app.notify_stage')
+def notify_stage(state: dict):
+    """Send the video link (or the batch summary) and clean up"""
+    with metrics.time_stage('notify', state['source']):
+        finish_pipeline(state, {
+            'status': 'success',
+            'message': 'Video uploaded successfully!',
+            'video_url': youtube_uploader.get_upload_url(state['video_id'])
+        })
 
 if __name__ == '__main__':
     # Ensure required directories exist
@@ -0,0 +1,154 @@
+"""
+Time-to-published of upload-while-downloading against download-then-upload
+
+A local HTTP server serves a video at a throttled rate and a fake YouTube
+resumable endpoint accepts it at another; the real VideoDownloader,
+GrowingFile, GrowingFileUpload and ResumableUploadEngine move the bytes.
+The overlapped path should take about as long as the slower transfer,
+the sequential one about their sum.
+
+    python benchmarks/streaming_upload.py --size-mb 96 --download-mbps 32 --upload-mbps 32
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+# Keep benchmark files and logs out of the repository
+_scratch = tempfile.mkdtemp(prefix='youtube-uploader-bench-')
+Config.UPLOAD_FOLDER = _scratch
+Config.LOG_FILE = os.path.join(_scratch, 'bench.log')
+Config.LOG_LEVEL = 'WARNING'
+Config.METRICS_DB = os.path.join(_scratch, 'metrics.db')
+Config.DOWNLOAD_CACHE_ENABLED = False
+
+import httplib2
+from googleapiclient.http import HttpRequest
+from video_downloader import VideoDownloader
+from streaming_upload import GrowingFile, GrowingFileUpload
+from upload_engine import AdaptiveMediaFileUpload, ResumableUploadEngine
+
+MB = 1024 * 1024
+SEND_SIZE = 256 * 1024
+
+
+def serve(payload: bytes, rate: float) -> ThreadingHTTPServer:
+    """Serve payload at rate bytes/second, without range support"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            started = time.monotonic()
+            for offset in range(0, len(payload), SEND_SIZE):
+                self.wfile.write(payload[offset:offset + SEND_SIZE])
+                delay = started + (offset + SEND_SIZE) / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ThrottledEndpoint:
+    """Resumable upload endpoint that accepts bytes at rate bytes/second"""
+
+    def __init__(self, size: int, rate: float):
+        self.size = size
+        self.rate = rate
+        self.received = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if method == 'POST':
+            return httplib2.Response({'status': '200', 'location': 'https://upload.invalid/session'}), b''
+        data = body.read() if hasattr(body, 'read') else body
+        time.sleep(len(data) / self.rate)
+        self.received += len(data)
+        if self.received == self.size:
+            return httplib2.Response({'status': '200'}), b'{"id": "benchmark"}'
+        return httplib2.Response({'status': '308', 'range': f"bytes=0-{self.received - 1}"}), b''
+
+
+def upload(media, size: int, rate: float):
+    request = HttpRequest(
+        ThrottledEndpoint(size, rate),
+        lambda response, content: json.loads(content),
+        'https://upload.invalid/start',
+        method='POST',
+        body='{}',
+        headers={'content-type': 'application/json'},
+        resumable=media
+    )
+    engine = ResumableUploadEngine(
+        Config.UPLOAD_MIN_CHUNK_SIZE,
+        Config.UPLOAD_MAX_CHUNK_SIZE,
+        Config.UPLOAD_TARGET_CHUNK_SECONDS,
+        Config.UPLOAD_MAX_RETRIES
+    )
+    return engine.run(request)
+
+
+def sequential(downloader: VideoDownloader, url: str, size: int, rate: float) -> str:
+    path = downloader.download_video(url)
+    media = AdaptiveMediaFileUpload(path, mimetype='video/mp4', chunksize=Config.UPLOAD_INITIAL_CHUNK_SIZE,
+                                    resumable=True)
+    upload(media, size, rate)
+    return path
+
+
+def overlapped(downloader: VideoDownloader, url: str, size: int, rate: float) -> str:
+    source = GrowingFile()
+    download = threading.Thread(target=source.download, args=(downloader, url))
+    download.start()
+    source.wait_ready()
+    media = GrowingFileUpload(source, 'video/mp4', chunksize=Config.UPLOAD_INITIAL_CHUNK_SIZE,
+                              min_chunk_size=Config.UPLOAD_MIN_CHUNK_SIZE)
+    upload(media, size, rate)
+    path = source.wait_finished()
+    download.join()
+    source.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=96)
+    parser.add_argument('--download-mbps', type=float, default=32, help='Source speed in MB/s')
+    parser.add_argument('--upload-mbps', type=float, default=32, help='Upload speed in MB/s')
+    parser.add_argument('--runs', type=int, default=2)
+    args = parser.parse_args()
+
+    size = args.size_mb * MB
+    payload = b'\x00\x00\x00\x18ftypmp42' + os.urandom(size - 12)
+    server = serve(payload, args.download_mbps * MB)
+    url = f"http://127.0.0.1:{server.server_port}/video.mp4"
+    downloader = VideoDownloader()
+
+    print(f"{args.size_mb}MB, download {args.download_mbps}MB/s, upload {args.upload_mbps}MB/s")
+    for run in range(args.runs):
+        for name, publish in (('sequential', sequential), ('overlapped', overlapped)):
+            started = time.monotonic()
+            path = publish(downloader, url, size, args.upload_mbps * MB)
+            print(f"  {name:<11} {time.monotonic() - started:6.2f}s")
+            downloader.cleanup(path)
+    server.shutdown()
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,23 +14,128 @@ class Config:
     MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1GB max file size
     ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
     
+    # Download Configuration
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB per network read
+    UPLOAD_RECEIVE_CHUNK_SIZE = int(os.getenv('UPLOAD_RECEIVE_CHUNK_SIZE', 1024 * 1024))  # 1MB per read of an /upload body
+    DOWNLOAD_BUFFER_SIZE = int(os.getenv('DOWNLOAD_BUFFER_SIZE', 4 * 1024 * 1024))  # 4MB write buffer
+    DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', 4))  # Parallel ranged connections per file
+    DOWNLOAD_MIN_SEGMENT_SIZE = int(os.getenv('DOWNLOAD_MIN_SEGMENT_SIZE', 16 * 1024 * 1024))  # 16MB
+    DOWNLOAD_JOURNAL_INTERVAL = int(os.getenv('DOWNLOAD_JOURNAL_INTERVAL', 64 * 1024 * 1024))  # Checkpoint every 64MB
+    DOWNLOAD_PARTIAL_MAX_AGE = int(os.getenv('DOWNLOAD_PARTIAL_MAX_AGE', 24 * 60 * 60))  # Seconds
+    DOWNLOAD_MIN_FREE_SPACE = int(os.getenv('DOWNLOAD_MIN_FREE_SPACE', 2 * 1024 * 1024 * 1024))  # 2GB
+    DOWNLOAD_PARTIAL_ACTIVE_AGE = int(os.getenv('DOWNLOAD_PARTIAL_ACTIVE_AGE', 10 * 60))  # Seconds since the last write
+    DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv('DOWNLOAD_CONNECT_TIMEOUT', 10))  # Seconds to establish a connection
+    DOWNLOAD_READ_TIMEOUT = float(os.getenv('DOWNLOAD_READ_TIMEOUT', 60))  # Seconds without receiving data
+    DOWNLOAD_POOL_HOSTS = int(os.getenv('DOWNLOAD_POOL_HOSTS', 10))  # Hosts with pooled connections
+    DOWNLOAD_POOL_SIZE = int(os.getenv('DOWNLOAD_POOL_SIZE', 16))  # Pooled connections per host
+    DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', 3))  # Retries of a failed request before reading the body
+    DOWNLOAD_RETRY_BACKOFF = float(os.getenv('DOWNLOAD_RETRY_BACKOFF', 0.5))  # Seconds, doubled per retry
+    SOURCE_TITLE_TIMEOUT = float(os.getenv('SOURCE_TITLE_TIMEOUT', 5))  # Seconds to wait for a source page title
+    
+    # YouTube Source Downloads (adaptive streams above 720p need ffmpeg to mux)
+    YOUTUBE_ADAPTIVE_ENABLED = os.getenv('YOUTUBE_ADAPTIVE_ENABLED', 'False').lower() == 'true'
+    FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')
+    THUMBNAIL_ENABLED = os.getenv('THUMBNAIL_ENABLED', 'True').lower() == 'true'  # Needs ffmpeg
+    THUMBNAIL_CANDIDATES = int(os.getenv('THUMBNAIL_CANDIDATES', 6))  # Keyframes compared per video
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))  # Extraction processes per web/Celery process
+    THUMBNAIL_TIMEOUT = int(os.getenv('THUMBNAIL_TIMEOUT', 60))  # Seconds per ffmpeg run
+    YOUTUBE_STREAM_CACHE_TTL = int(os.getenv('YOUTUBE_STREAM_CACHE_TTL', 60 * 60))  # Seconds, capped by URL expiry
+    
+    # Download Cache Configuration (must live on the same filesystem as UPLOAD_FOLDER for hardlinks)
+    DOWNLOAD_CACHE_ENABLED = os.getenv('DOWNLOAD_CACHE_ENABLED', 'True').lower() == 'true'
+    DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'cache'))
+    DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv('DOWNLOAD_CACHE_MAX_BYTES', 20 * 1024 * 1024 * 1024))  # 20GB
+    
+    # Duplicate Upload Detection
+    DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    UPLOAD_INDEX_DB = os.getenv('UPLOAD_INDEX_DB', os.path.join(DATA_DIR, 'uploads.db'))
+    
+    # Web Chat Jobs
+    JOB_DB = os.getenv('JOB_DB', os.path.join(DATA_DIR, 'jobs.db'))
+    JOB_RETENTION = int(os.getenv('JOB_RETENTION', 24 * 60 * 60))  # Seconds to keep finished jobs
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))  # Seconds between progress checks
+    
     # YouTube API Configuration
+    STREAMING_UPLOAD_ENABLED = os.getenv('STREAMING_UPLOAD_ENABLED', 'False').lower() == 'true'  # Upload while downloading
     YOUTUBE_CLIENT_SECRETS_FILE = os.getenv('YOUTUBE_CLIENT_SECRETS_FILE', 'client_secrets.json')
     YOUTUBE_CREDENTIALS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials')
     YOUTUBE_API_SCOPES = ['https://www.googleapis.com/auth/youtube.upload']
+    YOUTUBE_TOKEN_REFRESH_MARGIN = int(os.getenv('YOUTUBE_TOKEN_REFRESH_MARGIN', 300))  # Refresh this many seconds before expiry
+    
+    # YouTube Upload Engine (chunk sizes are rounded down to multiples of 256KB)
+    UPLOAD_INITIAL_CHUNK_SIZE = int(os.getenv('UPLOAD_INITIAL_CHUNK_SIZE', 8 * 1024 * 1024))
+    UPLOAD_MIN_CHUNK_SIZE = int(os.getenv('UPLOAD_MIN_CHUNK_SIZE', 256 * 1024))
+    UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE', 128 * 1024 * 1024))
+    UPLOAD_TARGET_CHUNK_SECONDS = float(os.getenv('UPLOAD_TARGET_CHUNK_SECONDS', 5))
+    UPLOAD_MAX_RETRIES = int(os.getenv('UPLOAD_MAX_RETRIES', 8))
+    UPLOAD_BACKOFF_BASE = float(os.getenv('UPLOAD_BACKOFF_BASE', 1))  # Seconds
+    UPLOAD_BACKOFF_MAX = float(os.getenv('UPLOAD_BACKOFF_MAX', 64))  # Seconds
+    
+    # YouTube Upload Scheduling
+    UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 3))  # Parallel uploads per process
+    YOUTUBE_DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', 10000))  # API units per day
+    YOUTUBE_QUOTA_TIMEZONE = os.getenv('YOUTUBE_QUOTA_TIMEZONE', 'America/Los_Angeles')  # The quota resets at midnight here
+    YOUTUBE_UPLOAD_QUOTA_COST = int(os.getenv('YOUTUBE_UPLOAD_QUOTA_COST', 1600))  # Units per videos.insert
+    YOUTUBE_THUMBNAIL_QUOTA_COST = int(os.getenv('YOUTUBE_THUMBNAIL_QUOTA_COST', 50))  # Units per thumbnails.set
+    YOUTUBE_UPDATE_QUOTA_COST = int(os.getenv('YOUTUBE_UPDATE_QUOTA_COST', 50))  # Units per videos.update
+    QUOTA_DB = os.getenv('QUOTA_DB', os.path.join(DATA_DIR, 'quota.db'))
+    YOUTUBE_STREAM_DB = os.getenv('YOUTUBE_STREAM_DB', os.path.join(DATA_DIR, 'youtube_streams.db'))
+    
+    # Metrics (aggregated across web and Celery processes)
+    METRICS_DB = os.getenv('METRICS_DB', os.path.join(DATA_DIR, 'metrics.db'))
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))  # Seconds between writes per process
+    METRICS_RETENTION = int(os.getenv('METRICS_RETENTION', 7 * 24 * 60 * 60))  # Seconds before an idle process's series are folded into the retired totals
     
     # WhatsApp (Twilio) Configuration
     TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
     TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
     TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+    TWILIO_TIMEOUT = float(os.getenv('TWILIO_TIMEOUT', 10))  # Seconds per API call
+    WHATSAPP_SENDER_THREADS = int(os.getenv('WHATSAPP_SENDER_THREADS', 4))
+    WHATSAPP_MIN_SEND_INTERVAL = float(os.getenv('WHATSAPP_MIN_SEND_INTERVAL', 1))  # Seconds between messages per recipient
+    WHATSAPP_MAX_RETRIES = int(os.getenv('WHATSAPP_MAX_RETRIES', 5))
+    WHATSAPP_BACKOFF_BASE = float(os.getenv('WHATSAPP_BACKOFF_BASE', 1))  # Seconds
+    WHATSAPP_BACKOFF_MAX = float(os.getenv('WHATSAPP_BACKOFF_MAX', 30))  # Seconds
+    WHATSAPP_DRAIN_TIMEOUT = float(os.getenv('WHATSAPP_DRAIN_TIMEOUT', 10))  # Seconds to send queued messages at shutdown
+    WHATSAPP_PROGRESS_INTERVAL = float(os.getenv('WHATSAPP_PROGRESS_INTERVAL', 15))  # Seconds between progress updates
+    WHATSAPP_PROGRESS_MIN_DELTA = int(os.getenv('WHATSAPP_PROGRESS_MIN_DELTA', 10))  # Percentage points between progress updates
+
+    # Webhook deduplication
+    WEBHOOK_IDEMPOTENCY_TTL = int(os.getenv('WEBHOOK_IDEMPOTENCY_TTL', 24 * 60 * 60))  # Seconds a MessageSid is remembered
+    WEBHOOK_DEDUPE_WINDOW = int(os.getenv('WEBHOOK_DEDUPE_WINDOW', 10 * 60))  # Seconds the same link from a sender is ignored
+    WEBHOOK_DEDUPE_SHARED = os.getenv('WEBHOOK_DEDUPE_SHARED', 'True').lower() == 'true'  # Share across web workers; only disable for a single worker
+    WEBHOOK_DEDUPE_DB = os.getenv('WEBHOOK_DEDUPE_DB', os.path.join(DATA_DIR, 'webhooks.db'))
+
+    # Celery (memory:// and cache+memory:// run without Redis)
+    CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+    CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+    CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False').lower() == 'true'  # Run tasks inline
+    CELERY_STAGE_MAX_RETRIES = int(os.getenv('CELERY_STAGE_MAX_RETRIES', 2))  # Retries per pipeline stage
+    CELERY_STAGE_RETRY_BACKOFF = int(os.getenv('CELERY_STAGE_RETRY_BACKOFF', 30))  # Seconds before the first retry
+
+    # WhatsApp Job Admission (size ADMISSION_MAX_RUNNING to the Celery worker pool)
+    ADMISSION_MAX_RUNNING = int(os.getenv('ADMISSION_MAX_RUNNING', 4))  # Jobs running at once
+    ADMISSION_PER_SENDER_RUNNING = int(os.getenv('ADMISSION_PER_SENDER_RUNNING', 1))  # Jobs running at once per sender
+    ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 100))  # Waiting jobs before new ones are refused
+    ADMISSION_SENDER_WEIGHTS = os.getenv('ADMISSION_SENDER_WEIGHTS', '')  # e.g. '+15550001111=2,+15550002222=0.5'
+    ADMISSION_LEASE = int(os.getenv('ADMISSION_LEASE', 15 * 60))  # Seconds without a heartbeat before a job's slot is reclaimed
+    ADMISSION_HEARTBEAT_INTERVAL = int(os.getenv('ADMISSION_HEARTBEAT_INTERVAL', 60))  # Seconds between lease renewals by a running stage
+    ADMISSION_DISPATCH_INTERVAL = int(os.getenv('ADMISSION_DISPATCH_INTERVAL', 30))  # Seconds between periodic dispatches (Celery beat)
+    ADMISSION_DB = os.getenv('ADMISSION_DB', os.path.join(DATA_DIR, 'admission.db'))
+    BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 100))  # Links per /jobs/batch request
+    BATCH_API_KEY = os.getenv('BATCH_API_KEY')  # X-API-Key that lets /jobs/batch callers notify any number
+    BATCH_NOTIFY_ALLOWLIST = os.getenv('BATCH_NOTIFY_ALLOWLIST', '')  # e.g. '+15550001111,+15550002222', notifiable without the key
     
     # Logging Configuration
     LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'app.log')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+    LOG_RATE_LIMIT_INTERVAL = float(os.getenv('LOG_RATE_LIMIT_INTERVAL', 5))  # Seconds between rate-limited progress lines
     
     @staticmethod
     def init_app(app):
         # Create necessary directories
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(Config.YOUTUBE_CREDENTIALS_DIR, exist_ok=True)
+        os.makedirs(Config.DATA_DIR, exist_ok=True)
         os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
\ No newline at end of file
@@ -1,12 +1,29 @@
 import os
 import re
+import html
 from datetime import datetime
+from gdrive_resolver import GoogleDriveResolver
+from video_downloader import VideoDownloader
+from video_metadata import read_metadata
 from logger import setup_logger
+from config import Config
 
 logger = setup_logger(__name__)
 
+YOUTUBE_OEMBED_URL = 'https://www.youtube.com/oembed'
+
+# A page's <title> is near the top; stop reading after this much
+MAX_TITLE_PAGE_SIZE = 256 * 1024
+
 class ContentGenerator:
-    def __init__(self):
+    def __init__(self, session=None):
+        """
+        Args:
+            session (requests.Session, optional): Pooled session to fetch
+                source page titles through, e.g. the downloader's; a
+                session of the same kind is created if omitted
+        """
+        self.session = session or VideoDownloader._create_session()
         self.default_tags = [
             'automated upload',
             'video content',
@@ -14,27 +31,41 @@ class ContentGenerator:
             'content creation'
         ]
 
-    def generate_content(self, video_path: str) -> dict:
+    def generate_content(self, video_path: str, source_url: str = None, original_name: str = None,
+                         read_container: bool = True) -> dict:
         """
         Generate title, description, and tags for a video
         
+        The title comes from the source page (YouTube and Google Drive
+        links), then the title embedded in the container, then the file
+        name. Recording date, duration, resolution and codecs read from the
+        container headers go into the description.
+        
         Args:
             video_path (str): Path to the video file
+            source_url (str, optional): Link the video was downloaded from
+            original_name (str, optional): File name the video was uploaded
+                with, used instead of the local file name
+            read_container (bool): False while the file is still being
+                downloaded, as its headers may not be on disk yet
             
         Returns:
             dict: Dictionary containing generated title, description, and tags
         """
         try:
             # Get base filename without extension
-            filename = os.path.splitext(os.path.basename(video_path))[0]
+            filename = os.path.splitext(os.path.basename(original_name or video_path))[0]
             
             # Clean up filename (remove random hex if it was generated by our downloader)
             clean_filename = self._clean_filename(filename)
             
+            metadata = read_metadata(video_path) if read_container else {}
+            page_title = self._source_title(source_url) if source_url else None
+            
             # Generate content
-            title = self._generate_title(clean_filename)
-            description = self._generate_description(clean_filename)
-            tags = self._generate_tags(clean_filename)
+            title = self._generate_title(clean_filename, page_title or metadata.get('title'), metadata)
+            description = self._generate_description(title, metadata)
+            tags = self._generate_tags(title, metadata)
             
             return {
                 'title': title,
@@ -52,7 +83,7 @@ class ContentGenerator:
         # Remove video_ prefix and random hex if present
         if filename.startswith('video_'):
             # Remove the video_ prefix and any following hex
-            clean_name = re.sub(r'^video_[0-9a-f]{16}', '', filename)
+            clean_name = re.sub(r'^video_[0-9a-f]{16}(_[0-9a-f]{8})?', '', filename)
         else:
             clean_name = filename
 
@@ -64,13 +95,18 @@ class ContentGenerator:
         
         return clean_name.strip()
 
-    def _generate_title(self, filename: str) -> str:
-        """Generate an engaging title based on the filename"""
-        if not filename or filename.isspace():
+    def _generate_title(self, filename: str, known_title: str = None, metadata: dict = None) -> str:
+        """Generate an engaging title from a page or embedded title, or else the filename"""
+        if known_title:
+            # Titles are used as written; YouTube rejects angle brackets
+            title = ' '.join(known_title.replace('<', '').replace('>', '').split())
+        elif filename and not filename.isspace():
+            # Capitalize words
+            title = ' '.join(word.capitalize() for word in filename.split())
+        elif metadata and metadata.get('created'):
+            title = f"Video from {metadata['created']:%B} {metadata['created'].day}, {metadata['created']:%Y}"
+        else:
             return "New Video Upload"
-            
-        # Capitalize words and limit length
-        title = ' '.join(word.capitalize() for word in filename.split())
         
         # Ensure title isn't too long (YouTube limit is 100 characters)
         if len(title) > 95:
@@ -78,17 +114,18 @@ class ContentGenerator:
             
         return title
 
-    def _generate_description(self, filename: str) -> str:
+    def _generate_description(self, title: str, metadata: dict = None) -> str:
         """Generate a detailed description"""
         current_date = datetime.now().strftime("%Y-%m-%d")
         
         description = [
-            f"🎥 {self._generate_title(filename)}",
+            f"🎥 {title}",
             "",
             "📝 About this video:",
             "This video was automatically uploaded using our YouTube Upload Agent.",
             "",
             "🔍 Details:",
+            *self._describe_metadata(metadata or {}),
             f"• Upload Date: {current_date}",
             "• Uploaded via: Automated YouTube Upload Agent",
             "",
@@ -106,16 +143,49 @@ class ContentGenerator:
         
         return '\n'.join(description)
 
-    def _generate_tags(self, filename: str) -> list:
-        """Generate relevant tags based on filename and defaults"""
+    def _describe_metadata(self, metadata: dict) -> list:
+        """Detail lines for what the container declares"""
+        lines = []
+        if metadata.get('created'):
+            lines.append(f"• Recorded: {metadata['created']:%Y-%m-%d}")
+        if metadata.get('duration'):
+            minutes, seconds = divmod(int(round(metadata['duration'])), 60)
+            hours, minutes = divmod(minutes, 60)
+            length = f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+            lines.append(f"• Duration: {length}")
+        if metadata.get('width') and metadata.get('height'):
+            resolution = f"{metadata['width']}x{metadata['height']}"
+            label = self._resolution_label(metadata)
+            lines.append(f"• Resolution: {resolution} ({label})" if label else f"• Resolution: {resolution}")
+        codecs = [codec for codec in (metadata.get('video_codec'), metadata.get('audio_codec')) if codec]
+        if codecs:
+            lines.append(f"• Codec: {' / '.join(codecs)}")
+        return lines
+
+    @staticmethod
+    def _resolution_label(metadata: dict) -> str:
+        """Name the resolution the way YouTube does, e.g. 1080p or 4K"""
+        lines = min(metadata.get('width') or 0, metadata.get('height') or 0)
+        if lines >= 2160:
+            return '4K'
+        for standard in (1440, 1080, 720, 480, 360):
+            if lines >= standard:
+                return f"{standard}p"
+        return None
+
+    def _generate_tags(self, title: str, metadata: dict = None) -> list:
+        """Generate relevant tags based on the title, resolution and defaults"""
         tags = set(self.default_tags)
         
-        # Add words from filename as tags
-        filename_words = filename.split()
-        for word in filename_words:
+        # Add words from the title as tags
+        for word in re.findall(r'\w+', title):
             if len(word) > 2:  # Only add words longer than 2 characters
                 tags.add(word.lower())
         
+        label = self._resolution_label(metadata or {})
+        if label:
+            tags.add(label.lower())
+        
         # Ensure we don't exceed YouTube's limit of 500 characters for all tags
         total_length = 0
         final_tags = []
@@ -129,6 +199,41 @@ class ContentGenerator:
         
         return final_tags
 
+    def _source_title(self, url: str) -> str:
+        """
+        Get the title of the page a link points to, if it has one
+        
+        YouTube titles come from its oEmbed endpoint and Google Drive ones
+        from the file's page; direct file links have no page. Both are fetched
+        through the pooled, retrying session. Failures only cost the title.
+        """
+        timeout = (Config.DOWNLOAD_CONNECT_TIMEOUT, Config.SOURCE_TITLE_TIMEOUT)
+        try:
+            source = VideoDownloader.source_type(url)
+            if source == 'youtube':
+                response = self.session.get(
+                    YOUTUBE_OEMBED_URL, params={'url': url, 'format': 'json'}, timeout=timeout
+                )
+                response.raise_for_status()
+                return response.json().get('title')
+            if source == 'gdrive':
+                file_id = GoogleDriveResolver.file_id(url)
+                with self.session.get(
+                    f"https://drive.google.com/file/d/{file_id}/view", stream=True, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    page = response.raw.read(MAX_TITLE_PAGE_SIZE, decode_content=True)
+                match = re.search(rb'<title>(.*?)</title>', page, re.S | re.I)
+                title = html.unescape(match.group(1).decode('utf-8', errors='replace')).strip() if match else ''
+                # File pages are titled "<name> - Google Drive"; sign-in and error pages are not
+                if title.endswith(' - Google Drive'):
+                    name = title[:-len(' - Google Drive')]
+                    stem, ext = os.path.splitext(name)
+                    return stem if ext[1:].lower() in Config.ALLOWED_VIDEO_EXTENSIONS else name
+        except Exception as e:
+            logger.warning(f"Could not get the page title of {url}: {str(e)}")
+        return None
+
     def _generate_hashtags(self, tags: list) -> str:
         """Generate hashtags from tags"""
         # Convert tags to hashtags (remove spaces, special chars)
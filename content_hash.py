@@ -0,0 +1,61 @@
+import hashlib
+
+# Content is hashed in fixed-size blocks so that byte ranges downloaded
+# out of order (or across a resume) can be hashed independently.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+def combine_block_digests(block_digests: list) -> str:
+    """
+    Combine per-block SHA-256 digests into the content hash of a file
+
+    Args:
+        block_digests (list): Raw digests of every block, in file order
+
+    Returns:
+        str: Hex content hash
+    """
+    digest = hashlib.sha256()
+    for block_digest in block_digests:
+        digest.update(block_digest)
+    return digest.hexdigest()
+
+def hash_file(path: str) -> str:
+    """Compute the content hash of a file on disk"""
+    hasher = ContentHasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class ContentHasher:
+    """
+    Incremental content hash for data arriving in order
+
+    Produces the same value as hash_file() and as combining the block
+    digests of a ranged download.
+    """
+
+    def __init__(self):
+        self.block_digests = []
+        self._block = hashlib.sha256()
+        self._block_length = 0
+
+    def update(self, data: bytes):
+        """Feed the next bytes of the file"""
+        view = memoryview(data)
+        while view:
+            take = min(len(view), BLOCK_SIZE - self._block_length)
+            self._block.update(view[:take])
+            self._block_length += take
+            view = view[take:]
+            if self._block_length == BLOCK_SIZE:
+                self.block_digests.append(self._block.digest())
+                self._block = hashlib.sha256()
+                self._block_length = 0
+
+    def hexdigest(self) -> str:
+        """Return the content hash of everything fed so far"""
+        block_digests = list(self.block_digests)
+        if self._block_length:
+            block_digests.append(self._block.digest())
+        return combine_block_digests(block_digests)
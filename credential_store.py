@@ -0,0 +1,133 @@
+import os
+import fcntl
+import pickle
+import datetime
+import threading
+from contextlib import contextmanager
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+class CredentialStore:
+    """
+    Process-wide owner of the YouTube OAuth credentials and API clients
+
+    Credentials are loaded once per process and refreshed shortly before
+    they expire. Refreshes are serialized across processes with a file lock
+    on the token file, and a process that waited on the lock picks up the
+    token another process just wrote instead of refreshing again. API
+    clients are built from the discovery document bundled with
+    googleapiclient (no network call) and cached per thread, since they are
+    not thread-safe.
+    """
+
+    def __init__(self):
+        self.token_file = os.path.join(Config.YOUTUBE_CREDENTIALS_DIR, 'token.pickle')
+        self.client_secrets_file = Config.YOUTUBE_CLIENT_SECRETS_FILE
+        self.scopes = Config.YOUTUBE_API_SCOPES
+        self.refresh_margin = datetime.timedelta(seconds=Config.YOUTUBE_TOKEN_REFRESH_MARGIN)
+        self.credentials = None
+        self._lock = threading.Lock()
+        self._clients = threading.local()
+
+    def get_credentials(self):
+        """
+        Return valid credentials, refreshing them if they expire soon
+
+        Returns:
+            google.oauth2.credentials.Credentials: Shared credentials object
+
+        Raises:
+            ValueError: If credentials cannot be loaded or refreshed
+        """
+        with self._lock:
+            if self.credentials and not self._expires_soon(self.credentials):
+                return self.credentials
+
+            try:
+                with self._file_lock():
+                    self._load_locked()
+                    if not self.credentials or self._expires_soon(self.credentials):
+                        self._refresh_locked()
+                return self.credentials
+            except Exception as e:
+                logger.error(f"Credential error: {str(e)}")
+                raise ValueError(f"Failed to obtain YouTube credentials: {str(e)}")
+
+    def get_client(self):
+        """
+        Return this thread's YouTube API client, building it on first use
+
+        Returns:
+            googleapiclient.discovery.Resource: YouTube Data API v3 client
+        """
+        credentials = self.get_credentials()
+        client = getattr(self._clients, 'youtube', None)
+        if client is None or self._clients.credentials is not credentials:
+            client = build(
+                'youtube', 'v3',
+                credentials=credentials,
+                static_discovery=True,
+                cache_discovery=False
+            )
+            self._clients.youtube = client
+            self._clients.credentials = credentials
+        return client
+
+    def _load_locked(self):
+        """Pick up a token written by this or another process"""
+        if not os.path.exists(self.token_file):
+            return
+
+        with open(self.token_file, 'rb') as token:
+            loaded = pickle.load(token)
+
+        if self.credentials is None:
+            self.credentials = loaded
+        elif loaded.expiry and (not self.credentials.expiry or loaded.expiry > self.credentials.expiry):
+            # Update in place so clients already holding the object see the new token
+            self.credentials.token = loaded.token
+            self.credentials.expiry = loaded.expiry
+
+    def _refresh_locked(self):
+        """Refresh or obtain credentials and persist them; caller holds the file lock"""
+        if self.credentials and self.credentials.refresh_token:
+            logger.info("Refreshing YouTube API credentials")
+            self.credentials.refresh(Request())
+        else:
+            logger.info("Getting new YouTube API credentials")
+            flow = InstalledAppFlow.from_client_secrets_file(
+                self.client_secrets_file, self.scopes)
+            self.credentials = flow.run_local_server(port=0)
+
+        tmp_file = f"{self.token_file}.tmp"
+        with open(tmp_file, 'wb') as token:
+            pickle.dump(self.credentials, token)
+        os.replace(tmp_file, self.token_file)
+
+    def _expires_soon(self, credentials) -> bool:
+        if not credentials.token:
+            return True
+        if not credentials.expiry:
+            return False
+        # google-auth stores expiry as naive UTC
+        now = datetime.datetime.utcnow()
+        return credentials.expiry - now < self.refresh_margin
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
+        with open(f"{self.token_file}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Shared by every YouTubeUploader in the process
+credential_store = CredentialStore()
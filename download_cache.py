@@ -0,0 +1,224 @@
+import os
+import time
+import errno
+import fcntl
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from content_hash import hash_file
+from gdrive_resolver import GoogleDriveResolver
+from metrics import metrics
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# get_stats() counter -> event label of download_cache_events_total
+CACHE_EVENTS = {'hits': 'hit', 'misses': 'miss', 'evictions': 'eviction'}
+
+# ioctl request number for FICLONE (copy-on-write clone on btrfs/xfs)
+FICLONE = 0x40049409
+
+class DownloadCache:
+    """
+    Content-addressed cache of downloaded videos
+
+    Files are stored once per content hash and looked up through a
+    canonical-URL index, so the same video shared under different URL forms
+    is only downloaded once. Total size is capped and the least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or Config.DOWNLOAD_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else Config.DOWNLOAD_CACHE_MAX_BYTES
+        self.db_path = os.path.join(self.cache_dir, 'index.db')
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'content_hash TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, '
+                'last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS urls ('
+                'canonical_url TEXT PRIMARY KEY, content_hash TEXT NOT NULL)'
+            )
+
+    def get(self, url: str, dest_dir: str):
+        """
+        Materialize a cached copy of a URL's content in dest_dir
+
+        Args:
+            url (str): Source URL of the video
+            dest_dir (str): Directory to place the linked file in
+
+        Returns:
+            tuple: (path to the linked file, content hash), or None on a cache miss
+        """
+        canonical = self.canonical_url(url)
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                'SELECT e.content_hash, e.path FROM urls u '
+                'JOIN entries e ON e.content_hash = u.content_hash '
+                'WHERE u.canonical_url = ?',
+                (canonical,)
+            ).fetchone()
+            if row and os.path.exists(row[1]):
+                conn.execute(
+                    'UPDATE entries SET last_access = ?, hits = hits + 1 WHERE content_hash = ?',
+                    (time.time(), row[0])
+                )
+
+        if not row or not os.path.exists(row[1]):
+            self._count('misses')
+            return None
+
+        ext = os.path.splitext(row[1])[1]
+        dest_path = os.path.join(dest_dir, f"video_{os.urandom(8).hex()}{ext}")
+        try:
+            self._link(row[1], dest_path)
+        except OSError as e:
+            # Evicted by another process between the lookup and the link
+            logger.warning(f"Cache entry for {canonical} vanished: {str(e)}")
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        logger.info(f"Download cache hit for {canonical}")
+        return dest_path, row[0]
+
+    def put(self, url: str, path: str, content_hash: str = None) -> str:
+        """
+        Add a downloaded file to the cache
+
+        The file is linked, not copied, into the cache directory; the caller
+        remains free to delete its own copy. Content that is already cached
+        keeps its existing file, even if this copy has another extension.
+
+        Args:
+            url (str): Source URL of the video
+            path (str): Path to the downloaded file
+            content_hash (str, optional): Content hash of the file, computed if omitted
+
+        Returns:
+            str: Content hash of the file
+        """
+        if content_hash is None:
+            content_hash = hash_file(path)
+        canonical = self.canonical_url(url)
+        size = os.path.getsize(path)
+        cache_path = self._cached_path(content_hash)
+        if cache_path is None:
+            cache_path = os.path.join(self.cache_dir, f"{content_hash}{os.path.splitext(path)[1]}")
+            if not os.path.exists(cache_path):
+                self._link(path, cache_path)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Another process may have cached the same content under another extension meanwhile
+            existing = self._cached_path(content_hash, conn)
+            if existing and existing != cache_path:
+                os.remove(cache_path)
+                cache_path = existing
+            conn.execute(
+                'INSERT INTO entries (content_hash, path, size, last_access) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(content_hash) DO UPDATE SET path = excluded.path, last_access = excluded.last_access',
+                (content_hash, cache_path, size, time.time())
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO urls (canonical_url, content_hash) VALUES (?, ?)',
+                (canonical, content_hash)
+            )
+
+        self._evict()
+        return content_hash
+
+    def get_stats(self) -> dict:
+        """Return hit, miss and eviction counters for this process"""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    @staticmethod
+    def canonical_url(url: str) -> str:
+        """
+        Reduce equivalent URL forms to a single cache key
+
+        Google Drive and YouTube links are keyed by their file or video ID;
+        other URLs are normalized (lowercase host, sorted query, no fragment).
+        """
+        parsed = urlparse(url.strip())
+        netloc = parsed.netloc.lower()
+        query = parse_qs(parsed.query)
+
+        if GoogleDriveResolver.is_drive_url(url):
+            try:
+                return f"gdrive:{GoogleDriveResolver.file_id(url)}"
+            except ValueError:
+                pass
+        elif 'youtube.com' in netloc and 'v' in query:
+            return f"youtube:{query['v'][0]}"
+        elif 'youtu.be' in netloc and parsed.path.strip('/'):
+            return f"youtube:{parsed.path.strip('/').split('/')[0]}"
+
+        sorted_query = urlencode(sorted(parse_qs(parsed.query, keep_blank_values=True).items()), doseq=True)
+        return urlunparse((parsed.scheme.lower(), netloc, parsed.path or '/', '', sorted_query, ''))
+
+    def _cached_path(self, content_hash: str, conn: sqlite3.Connection = None) -> str:
+        """Return the file a content hash is cached in, or None if it has no entry or the file is gone"""
+        if conn is None:
+            with closing(self._connect()) as conn:
+                return self._cached_path(content_hash, conn)
+        row = conn.execute('SELECT path FROM entries WHERE content_hash = ?', (content_hash,)).fetchone()
+        return row[0] if row and os.path.exists(row[0]) else None
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with closing(self._connect()) as conn, conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            for content_hash, path, size in conn.execute(
+                'SELECT content_hash, path, size FROM entries ORDER BY last_access'
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM entries WHERE content_hash = ?', (content_hash,))
+                conn.execute('DELETE FROM urls WHERE content_hash = ?', (content_hash,))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._count('evictions')
+                logger.info(f"Evicted {path} from download cache")
+
+    def _link(self, src: str, dst: str):
+        """Hardlink src to dst, falling back to a reflink and finally a copy"""
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise
+
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+        # get_stats() covers this process; /metrics sums every process
+        metrics.inc('download_cache_events_total', event=CACHE_EVENTS[name])
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
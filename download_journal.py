@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+from logger import setup_logger
+from content_hash import BLOCK_SIZE, combine_block_digests
+
+logger = setup_logger(__name__)
+
+class DownloadJournal:
+    """
+    Sidecar record of the byte ranges already written to a partial download
+
+    The journal stores the validators (size, ETag, Last-Modified) of the
+    response it was started from, so a retry only resumes when the remote
+    file is unchanged. Progress is tracked in whole content-hash blocks,
+    together with each block's digest, so the content hash of a resumed
+    download never needs a second pass over the file.
+    """
+
+    def __init__(self, journal_path: str, total_size: int, etag: str = None,
+                 last_modified: str = None, ext: str = None, completed: list = None,
+                 block_digests: dict = None):
+        self.journal_path = journal_path
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ext = ext
+        self.completed = [tuple(r) for r in (completed or [])]
+        self.block_digests = {int(k): v for k, v in (block_digests or {}).items()}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, journal_path: str):
+        """
+        Load a journal from disk
+
+        Args:
+            journal_path (str): Path to the journal file
+
+        Returns:
+            DownloadJournal: The journal, or None if missing or unreadable
+        """
+        try:
+            with open(journal_path, 'r') as f:
+                data = json.load(f)
+            return cls(
+                journal_path,
+                data['total_size'],
+                etag=data.get('etag'),
+                last_modified=data.get('last_modified'),
+                ext=data.get('ext'),
+                completed=data.get('completed'),
+                block_digests=data.get('block_digests')
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable download journal {journal_path}: {str(e)}")
+            return None
+
+    def matches(self, total_size: int, etag: str = None, last_modified: str = None) -> bool:
+        """Check whether the remote file is the one this journal was started from"""
+        if not (self.etag or self.last_modified):
+            return False
+        return (
+            self.total_size == total_size
+            and self.etag == etag
+            and self.last_modified == last_modified
+        )
+
+    @property
+    def validator(self) -> str:
+        """Value for an If-Range header, preferring the strong ETag"""
+        if self.etag and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+    def add_block(self, start: int, end: int, digest: bytes):
+        """
+        Record a fully written block; call save() to persist it
+
+        Args:
+            start (int): Offset of the block, a multiple of BLOCK_SIZE
+            end (int): Last byte of the block (inclusive)
+            digest (bytes): SHA-256 digest of the block's bytes
+        """
+        with self._lock:
+            self.block_digests[start // BLOCK_SIZE] = digest.hex()
+            merged = []
+            for r_start, r_end in sorted(self.completed + [(start, end)]):
+                if merged and r_start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+                else:
+                    merged.append((r_start, r_end))
+            self.completed = merged
+
+    def content_hash(self) -> str:
+        """Combine the recorded block digests into the content hash of the file"""
+        with self._lock:
+            block_count = -(-self.total_size // BLOCK_SIZE)
+            return combine_block_digests(
+                bytes.fromhex(self.block_digests[index]) for index in range(block_count)
+            )
+
+    def contiguous_bytes(self) -> int:
+        """Return how many bytes from the start of the file are on disk without gaps"""
+        with self._lock:
+            if self.completed and self.completed[0][0] == 0:
+                return self.completed[0][1] + 1
+            return 0
+
+    def missing_ranges(self) -> list:
+        """Return the inclusive (start, end) byte ranges not yet downloaded"""
+        with self._lock:
+            missing = []
+            offset = 0
+            for start, end in sorted(self.completed):
+                if start > offset:
+                    missing.append((offset, start - 1))
+                offset = max(offset, end + 1)
+            if offset < self.total_size:
+                missing.append((offset, self.total_size - 1))
+            return missing
+
+    def save(self):
+        """Atomically write the journal to disk"""
+        with self._lock:
+            self._save_locked()
+
+    def remove(self):
+        """Delete the journal file"""
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+    def _save_locked(self):
+        data = {
+            'total_size': self.total_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'ext': self.ext,
+            'completed': self.completed,
+            'block_digests': self.block_digests
+        }
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.journal_path)
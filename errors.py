@@ -0,0 +1,2 @@
+class TransientError(ValueError):
+    """Raised for failures that may succeed on retry: dropped connections, timeouts, 429/5xx and quota"""
@@ -0,0 +1,140 @@
+import re
+import html
+from urllib.parse import urlparse, parse_qs, urlencode, urljoin
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DRIVE_HOSTS = ('drive.google.com', 'docs.google.com', 'drive.usercontent.google.com')
+DOWNLOAD_URL = 'https://drive.google.com/uc'
+
+# Interstitial pages are a few KB; anything larger is not one
+MAX_PAGE_SIZE = 1024 * 1024
+
+class GoogleDriveResolver:
+    """
+    Turn a Google Drive share link into a response streaming the file itself
+
+    Drive serves small files directly from its download URL, but for files
+    it cannot virus-scan it answers with an HTML page holding a confirm
+    token. The resolver reads that page, follows the confirmation and
+    checks that what comes back is the file rather than another page, so
+    the downloader never writes HTML to disk as a video.
+    """
+
+    def __init__(self, session, timeout):
+        """
+        Args:
+            session (requests.Session): Session to fetch through; it keeps
+                the cookies Drive sets on the interstitial, and may be shared
+                by concurrent downloads
+            timeout (tuple): (connect, read) timeout in seconds
+        """
+        self.session = session
+        self.timeout = timeout
+
+    @staticmethod
+    def is_drive_url(url: str) -> bool:
+        """Check whether a URL points at Google Drive"""
+        return urlparse(url).netloc.lower() in DRIVE_HOSTS
+
+    @staticmethod
+    def file_id(url: str) -> str:
+        """
+        Extract the file ID from a Drive link
+
+        Handles /file/d/<id>/view, open?id=<id> and uc?id=<id> (with or
+        without export=download) forms.
+
+        Raises:
+            ValueError: If the URL holds no file ID
+        """
+        parsed = urlparse(url.strip())
+        match = re.search(r'/(?:file/)?d/([\w-]{10,})', parsed.path)
+        if match:
+            return match.group(1)
+        ids = parse_qs(parsed.query).get('id')
+        if ids and re.fullmatch(r'[\w-]{10,}', ids[0]):
+            return ids[0]
+        raise ValueError("Could not find a file ID in the Google Drive link")
+
+    def open(self, url: str):
+        """
+        Open a streaming response for the file behind a Drive link
+
+        Args:
+            url (str): Drive share or download link
+
+        Returns:
+            requests.Response: Response opened with stream=True whose body
+                is the file
+
+        Raises:
+            ValueError: If the file is not publicly downloadable
+        """
+        file_id = self.file_id(url)
+        response = self.session.get(
+            DOWNLOAD_URL,
+            params={'export': 'download', 'id': file_id},
+            stream=True,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        if not self._is_page(response):
+            return response
+
+        page = self._read_page(response)
+        confirm_url = self._confirm_url(page, file_id, response.cookies)
+        if not confirm_url:
+            raise ValueError(self._page_error(page))
+
+        logger.info(f"Confirming Google Drive download of {file_id}")
+        response = self.session.get(confirm_url, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        if self._is_page(response):
+            page = self._read_page(response)
+            raise ValueError(self._page_error(page))
+        return response
+
+    def _confirm_url(self, page: str, file_id: str, cookies) -> str:
+        """
+        Find where the interstitial's download button leads, or None
+
+        Args:
+            page (str): HTML of the interstitial
+            file_id (str): Drive file ID
+            cookies (RequestsCookieJar): Cookies set by the interstitial response
+        """
+        # Current pages: a form posting to drive.usercontent.google.com with hidden fields
+        form = re.search(r'<form[^>]*id="download-form"[^>]*action="([^"]+)"', page)
+        if form:
+            fields = dict(re.findall(r'<input[^>]*type="hidden"[^>]*name="([^"]+)"[^>]*value="([^"]*)"', page))
+            return f"{html.unescape(form.group(1))}?{urlencode(fields)}"
+
+        # Older pages: a link carrying the confirm token
+        link = re.search(r'href="(/uc\?export=download[^"]*confirm=[^"]+)"', page)
+        if link:
+            return urljoin(DOWNLOAD_URL, html.unescape(link.group(1)))
+
+        # Oldest: the token in a download_warning cookie; only this response's, as the
+        # session's jar also holds tokens for files other downloads are fetching
+        for cookie in cookies:
+            if cookie.name.startswith('download_warning'):
+                return f"{DOWNLOAD_URL}?{urlencode({'export': 'download', 'id': file_id, 'confirm': cookie.value})}"
+        return None
+
+    @staticmethod
+    def _is_page(response) -> bool:
+        return response.headers.get('Content-Type', '').split(';')[0].strip() == 'text/html'
+
+    @staticmethod
+    def _read_page(response) -> str:
+        with response:
+            body = response.raw.read(MAX_PAGE_SIZE, decode_content=True)
+        return body.decode(response.encoding or 'utf-8', errors='replace')
+
+    @staticmethod
+    def _page_error(page: str) -> str:
+        if 'Too many users have viewed or downloaded this file' in page or 'quota' in page.lower():
+            return "Google Drive download quota for this file is exceeded, try again later"
+        return "Google Drive returned a web page instead of the file; make sure it is shared with anyone who has the link"
@@ -0,0 +1,217 @@
+import os
+import time
+import uuid
+import sqlite3
+from contextlib import closing
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# Statuses after which a job no longer changes
+FINAL_STATUSES = ('success', 'error')
+
+class JobStore:
+    """
+    Shared state of video processing jobs
+
+    Jobs are written by Celery workers and read by whichever web worker
+    serves the client's progress stream, so the state lives in SQLite
+    rather than in process memory. Every update bumps a version number that
+    readers use to detect changes. Jobs submitted together (several links
+    in one message, or the batch API) belong to a batch, which is
+    summarized once when its last job finishes.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or Config.JOB_DB
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, progress INTEGER, '
+                'message TEXT, video_url TEXT, version INTEGER NOT NULL DEFAULT 0, '
+                'created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            # Columns added after the first release
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column in ('url', 'batch_id'):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS batches ('
+                'id TEXT PRIMARY KEY, notify TEXT, summarized INTEGER NOT NULL DEFAULT 0, '
+                'created_at REAL NOT NULL)'
+            )
+
+    def create(self, url: str = None) -> str:
+        """
+        Create a queued job and drop jobs older than JOB_RETENTION
+
+        Args:
+            url (str, optional): Video link the job processes
+
+        Returns:
+            str: The new job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            self._expire(conn, now)
+            conn.execute(
+                'INSERT INTO jobs (id, status, stage, url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', 'queued', url, now, now)
+            )
+        return job_id
+
+    def create_batch(self, urls: list, notify: str = None) -> tuple:
+        """
+        Create a batch with one queued job per URL
+
+        Args:
+            urls (list): Video links
+            notify (str, optional): WhatsApp number to send the summary to
+
+        Returns:
+            tuple: (batch ID, list of job IDs in the order of urls)
+        """
+        batch_id = uuid.uuid4().hex
+        job_ids = [uuid.uuid4().hex for _ in urls]
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            self._expire(conn, now)
+            conn.execute(
+                'INSERT INTO batches (id, notify, created_at) VALUES (?, ?, ?)',
+                (batch_id, notify, now)
+            )
+            conn.executemany(
+                'INSERT INTO jobs (id, status, stage, url, batch_id, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(job_id, 'queued', 'queued', url, batch_id, now, now) for job_id, url in zip(job_ids, urls)]
+            )
+        return batch_id, job_ids
+
+    def update(self, job_id: str, **fields):
+        """
+        Update a job's status, stage, progress, message or video_url
+
+        Args:
+            job_id (str): ID of the job
+            **fields: Columns to set
+        """
+        allowed = {'status', 'stage', 'progress', 'message', 'video_url'}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f'UPDATE jobs SET {assignments}, version = version + 1, updated_at = ? WHERE id = ?',
+                (*fields.values(), time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, result: dict):
+        """Record a result dict like the one returned by process_video_sync"""
+        self.update(
+            job_id,
+            status=result.get('status', 'error'),
+            stage='complete' if result.get('status') == 'success' else 'error',
+            progress=100 if result.get('status') == 'success' else None,
+            message=result.get('message'),
+            video_url=result.get('video_url')
+        )
+
+    def get(self, job_id: str) -> dict:
+        """
+        Get the current state of a job
+
+        Returns:
+            dict: Job fields, or None if the job does not exist
+        """
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                'SELECT id, status, stage, progress, message, video_url, version FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_batch(self, batch_id: str) -> dict:
+        """
+        Get a batch and the state of its jobs
+
+        Returns:
+            dict: Batch ID, notify number, job counts by status and the
+                jobs in submission order, or None if the batch does not exist
+        """
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            batch = conn.execute('SELECT id, notify FROM batches WHERE id = ?', (batch_id,)).fetchone()
+            if not batch:
+                return None
+            jobs = [dict(row) for row in conn.execute(
+                'SELECT id, url, status, stage, progress, message, video_url FROM jobs '
+                'WHERE batch_id = ? ORDER BY rowid',
+                (batch_id,)
+            )]
+
+        counts = {}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'id': batch['id'],
+            'notify': batch['notify'],
+            'total': len(jobs),
+            'counts': counts,
+            'finished': all(job['status'] in FINAL_STATUSES for job in jobs),
+            'jobs': jobs
+        }
+
+    def claim_batch_summary(self, batch_id: str) -> bool:
+        """
+        Claim the right to send a batch's summary
+
+        Returns:
+            bool: True for exactly one caller, once every job of the batch
+                has finished
+        """
+        placeholders = ', '.join('?' for _ in FINAL_STATUSES)
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                'UPDATE batches SET summarized = 1 WHERE id = ? AND summarized = 0 AND NOT EXISTS ('
+                f'SELECT 1 FROM jobs WHERE batch_id = ? AND status NOT IN ({placeholders}))',
+                (batch_id, batch_id, *FINAL_STATUSES)
+            )
+            return cursor.rowcount == 1
+
+    def progress_callback(self, job_id: str):
+        """
+        Build a progress_callback(stage, progress) for process_video_sync
+
+        Only writes when the stage or whole percentage changes, so byte-level
+        progress from the transfer loops costs at most ~100 writes per stage.
+        """
+        last = {}
+
+        def report(stage: str, progress: int = None):
+            state = (stage, progress)
+            if last.get('state') == state:
+                return
+            last['state'] = state
+            self.update(job_id, status='running', stage=stage, progress=progress)
+
+        return report
+
+    @staticmethod
+    def _expire(conn, now: float):
+        conn.execute('DELETE FROM jobs WHERE updated_at < ?', (now - Config.JOB_RETENTION,))
+        conn.execute(
+            'DELETE FROM batches WHERE created_at < ? AND NOT EXISTS ('
+            'SELECT 1 FROM jobs WHERE jobs.batch_id = batches.id)',
+            (now - Config.JOB_RETENTION,)
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
@@ -1,33 +1,162 @@
-import logging
 import os
-from logging.handlers import RotatingFileHandler
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from config import Config
 
-def setup_logger(name):
-    """Setup logger with file and console handlers"""
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.getLevelName(Config.LOG_LEVEL))
+# Fields bound to the current job, added to every record logged under them
+_context = contextvars.ContextVar('log_context', default={})
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    FIELDS = ('job_id', 'stage')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the bound job fields onto each record before it leaves the calling thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, value in _context.get().items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most one record per key every interval seconds
+
+    Only records logged with extra={'rate_limit': key} are limited, so
+    progress lines from hot loops can be thinned without touching other
+    logging. The next record let through for a key notes how many were
+    dropped in between.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._last = {}     # key -> (time let through, records dropped since)
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'rate_limit', None)
+        if key is None or self.interval <= 0:
+            return True
+        with self._lock:
+            last, dropped = self._last.get(key, (0, 0))
+            if record.created - last < self.interval:
+                self._last[key] = (last, dropped + 1)
+                return False
+            self._last[key] = (record.created, 0)
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages suppressed)"
+            record.args = None
+        return True
 
-    # Create formatters and add it to handlers
-    format_str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(format_str)
 
-    # Create a file handler
+def _configure():
+    """Create the process's queue handler and start the listener writing to file and console"""
+    global _queue_handler, _listener
+    if Config.LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
     file_handler = RotatingFileHandler(
         Config.LOG_FILE,
         maxBytes=10000000,  # 10MB
         backupCount=5
     )
-    file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-
-    # Create a console handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
     console_handler.setFormatter(formatter)
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    log_queue = queue.Queue(-1)
+    _queue_handler = QueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter())
+    _queue_handler.addFilter(RateLimitFilter(Config.LOG_RATE_LIMIT_INTERVAL))
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child():
+    # The listener thread does not survive fork; give the child its own queue and listener
+    global _queue_handler, _listener
+    if _queue_handler is None:
+        return
+    old_handler = _queue_handler
+    _configure()
+    for logger in logging.Logger.manager.loggerDict.values():
+        if isinstance(logger, logging.Logger) and old_handler in logger.handlers:
+            logger.removeHandler(old_handler)
+            logger.addHandler(_queue_handler)
+
+
+def _stop():
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logger(name):
+    """
+    Get a logger writing through the process's shared logging queue
+
+    Handlers are created once per process. Loggers only enqueue records;
+    a listener thread formats them and writes the log file and console,
+    so logging never blocks on I/O in upload or download loops.
+    """
+    with _lock:
+        if _queue_handler is None:
+            _configure()
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.getLevelName(Config.LOG_LEVEL))
+        if _queue_handler not in logger.handlers:
+            logger.addHandler(_queue_handler)
+        # Records are written once here, not again by handlers on the root logger (e.g. Celery's)
+        logger.propagate = False
+    return logger
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Bind fields such as job_id and stage to every record logged inside the block
+
+    Args:
+        **fields: Values to add; None values are ignored
+    """
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
 
-    return logger
\ No newline at end of file
+atexit.register(_stop)
+os.register_at_fork(after_in_child=_restart_in_child)
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+THROUGHPUT_BUCKETS = tuple(2 ** power * 1024 for power in range(6, 20, 2))  # 64KB/s .. 128MB/s
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'pipeline_stage_duration_seconds': (
+        'histogram', 'Time spent in each pipeline stage', DURATION_BUCKETS),
+    'pipeline_stage_failures_total': (
+        'counter', 'Pipeline stage attempts that raised', None),
+    'pipeline_download_throughput_bytes_per_second': (
+        'histogram', 'Average speed of whole source downloads', THROUGHPUT_BUCKETS),
+    'transfer_throughput_bytes_per_second': (
+        'histogram', 'Speed of individual download streams/ranges and upload chunks', THROUGHPUT_BUCKETS),
+    'transfer_bytes_total': (
+        'counter', 'Bytes moved by the download and upload loops', None),
+    'download_cache_events_total': (
+        'counter', 'Download cache hits, misses and evictions', None),
+    'queue_wait_seconds': (
+        'histogram', 'Time jobs wait before a worker starts them', DURATION_BUCKETS),
+}
+
+# Process column of the rows that keep the totals of processes gone idle
+RETIRED = 'retired'
+
+class Metrics:
+    """
+    Counters and histograms aggregated across processes
+
+    Observations only touch in-process dictionaries under a lock, so they
+    are cheap enough for per-chunk use. A daemon thread adds what this
+    process observed since its last flush to its rows in SQLite every
+    METRICS_FLUSH_INTERVAL seconds, and render() sums the rows of every
+    web and Celery process into the Prometheus text format. Rows of a
+    process idle for METRICS_RETENTION are folded into a retired row per
+    series rather than deleted, so counters never go down. A forked child
+    starts from zero so it does not count its parent's observations twice.
+    """
+
+    def __init__(self, db_path: str = None, flush_interval: float = None):
+        self.db_path = db_path or Config.METRICS_DB
+        self.flush_interval = flush_interval or Config.METRICS_FLUSH_INTERVAL
+        self._lock = threading.Lock()
+        self._pid = None
+        self._series = {}   # (name, labels) -> float, or [bucket counts..., sum, count], since the last flush
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS series ('
+                'process TEXT NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, '
+                'value TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (process, name, labels))'
+            )
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._ensure_process()
+            self._series[key] = self._series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a histogram observation"""
+        buckets = METRICS[name][2]
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._ensure_process()
+            data = self._series.get(key)
+            if data is None:
+                data = self._series[key] = [0] * (len(buckets) + 3)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def observe_transfer(self, direction: str, size: int, seconds: float):
+        """Record bytes moved by one transfer loop and its throughput"""
+        if size <= 0:
+            return
+        self.inc('transfer_bytes_total', size, direction=direction)
+        if seconds > 0:
+            self.observe('transfer_throughput_bytes_per_second', size / seconds, direction=direction)
+
+    @contextmanager
+    def time_stage(self, stage: str, source: str):
+        """Time a pipeline stage, counting it as failed if it raises"""
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.inc('pipeline_stage_failures_total', stage=stage, source=source)
+            raise
+        finally:
+            self.observe('pipeline_stage_duration_seconds', time.monotonic() - started,
+                         stage=stage, source=source)
+
+    def flush(self):
+        """Add what this process observed since the last flush to the shared store"""
+        with self._lock:
+            if self._pid != os.getpid() or not self._series:
+                return
+            pending, self._series = self._series, {}
+            process = self._process
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                self._add_rows(conn, process, pending)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not flush metrics: {str(e)}")
+            with self._lock:
+                for key, value in pending.items():
+                    current = self._series.get(key)
+                    self._series[key] = value if current is None else self._sum(current, value)
+
+    def render(self) -> str:
+        """
+        Render every process's metrics in the Prometheus text format
+
+        Returns:
+            str: Exposition text for a /metrics endpoint
+        """
+        self.flush()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            idle = conn.execute(
+                'SELECT process, name, labels, value FROM series WHERE process != ? AND updated_at < ?',
+                (RETIRED, time.time() - Config.METRICS_RETENTION)
+            ).fetchall()
+            if idle:
+                retired = {}
+                for _, name, labels, value in idle:
+                    current = retired.get((name, labels))
+                    value = json.loads(value)
+                    retired[(name, labels)] = value if current is None else self._sum(current, value)
+                self._add_rows(conn, RETIRED, retired)
+                conn.executemany(
+                    'DELETE FROM series WHERE process = ? AND name = ? AND labels = ?',
+                    [(process, name, labels) for process, name, labels, _ in idle]
+                )
+            rows = conn.execute('SELECT name, labels, value FROM series').fetchall()
+            conn.commit()
+
+        totals = {}
+        for name, labels, value in rows:
+            if name not in METRICS:
+                continue
+            value = json.loads(value)
+            current = totals.get((name, labels))
+            totals[(name, labels)] = value if current is None else self._sum(current, value)
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(totals.items()):
+                if series_name != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else repr(float(bound))
+                    lines.append(f"{name}_bucket{self._format_labels(labels, le=le)} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+    def _ensure_process(self):
+        # Caller holds the lock
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._process = f"{socket.gethostname()}:{self._pid}:{time.time():.0f}"
+        self._series = {}
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _add_rows(self, conn: sqlite3.Connection, process: str, series: dict):
+        """Add values to a process's rows; the caller holds a write transaction"""
+        now = time.time()
+        for (name, labels), value in series.items():
+            row = conn.execute(
+                'SELECT value FROM series WHERE process = ? AND name = ? AND labels = ?',
+                (process, name, labels)
+            ).fetchone()
+            if row:
+                value = self._sum(json.loads(row[0]), value)
+            conn.execute(
+                'INSERT OR REPLACE INTO series (process, name, labels, value, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (process, name, labels, json.dumps(value), now)
+            )
+
+    @staticmethod
+    def _sum(a, b):
+        """Add two counter values or two histograms' bucket counts, sum and count"""
+        if isinstance(a, list):
+            return [x + y for x, y in zip(a, b)]
+        return a + b
+
+    @staticmethod
+    def _labels(labels: dict) -> str:
+        return json.dumps(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(labels: str, **extra) -> str:
+        pairs = json.loads(labels) + sorted(extra.items())
+        if not pairs:
+            return ''
+        escaped = (
+            (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in pairs
+        )
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+
+# Shared by every module in the process
+metrics = Metrics()
@@ -0,0 +1,222 @@
+import time
+import heapq
+import random
+import threading
+from collections import deque
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from twilio.base.exceptions import TwilioRestException
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# WhatsApp messages sent through Twilio are limited to 1600 characters
+MAX_MESSAGE_LENGTH = 1600
+
+class OutboundMessageQueue:
+    """
+    Background sender for outbound messages
+
+    Messages are queued per recipient and delivered by a small pool of
+    worker threads, so callers never wait on the Twilio API. Each recipient
+    gets at most one message per WHATSAPP_MIN_SEND_INTERVAL; messages that
+    pile up for a recipient in the meantime are joined into a single
+    message. Rate-limit (429) and server (5xx) errors are retried with
+    exponential backoff, preserving the order of messages per recipient.
+    Messages queued with a replace_key supersede a still-queued message with
+    the same key, so only the latest state of e.g. a progress bar goes out.
+    The sender threads are daemons, so the owner must call close() before
+    the process exits or messages still queued are lost.
+    """
+
+    def __init__(self, deliver, workers: int = None, min_interval: float = None,
+                 max_retries: int = None):
+        """
+        Args:
+            deliver (callable): Called as deliver(to_number, body) on a worker
+                thread; raises on failure
+            workers (int, optional): Number of sender threads
+            min_interval (float, optional): Minimum seconds between messages
+                to the same recipient
+            max_retries (int, optional): Attempts before a message is dropped
+        """
+        self.deliver = deliver
+        self.workers = workers or Config.WHATSAPP_SENDER_THREADS
+        self.min_interval = min_interval if min_interval is not None else Config.WHATSAPP_MIN_SEND_INTERVAL
+        self.max_retries = max_retries if max_retries is not None else Config.WHATSAPP_MAX_RETRIES
+        self._pending = {}      # recipient -> deque of (replace_key, body)
+        self._attempts = {}     # recipient -> failed attempts for the head message
+        self._in_flight = {}    # recipient -> number of messages being delivered
+        self._next_allowed = {} # recipient -> earliest time of its next message
+        self._schedule = []     # heap of (ready_at, recipient), one entry per idle recipient
+        self._scheduled = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+    def put(self, to_number: str, body: str, replace_key: str = None) -> bool:
+        """
+        Queue a message for delivery and return immediately
+        
+        Args:
+            to_number (str): Recipient
+            body (str): Message text
+            replace_key (str, optional): Replace a queued, not yet sent
+                message to the same recipient with this key instead of
+                adding another one
+            
+        Returns:
+            bool: False if the queue is closed and the message was not queued
+        """
+        self._start_workers()
+        with self._condition:
+            if self._closed:
+                logger.warning(f"Outbound queue closed, not sending message to {to_number}")
+                return False
+            bodies = self._pending.setdefault(to_number, deque())
+            if replace_key is not None:
+                for index, (key, _) in enumerate(bodies):
+                    if key == replace_key:
+                        bodies[index] = (replace_key, body)
+                        return True
+            bodies.append((replace_key, body))
+            if to_number not in self._scheduled:
+                self._push(max(time.monotonic(), self._next_allowed.get(to_number, 0)), to_number)
+            return True
+
+    def pending(self) -> int:
+        """Return the number of queued or in-flight messages"""
+        with self._condition:
+            return sum(len(bodies) for bodies in self._pending.values()) + sum(self._in_flight.values())
+
+    def close(self, timeout: float = None) -> int:
+        """
+        Stop accepting messages and wait for the queued ones to be sent
+        
+        Recipients no longer wait out WHATSAPP_MIN_SEND_INTERVAL; failed
+        messages are still retried while time is left. Safe to call more
+        than once, e.g. from atexit and a worker shutdown signal.
+        
+        Args:
+            timeout (float, optional): Seconds to wait; defaults to
+                WHATSAPP_DRAIN_TIMEOUT
+            
+        Returns:
+            int: Number of messages still unsent when the wait ended
+        """
+        timeout = timeout if timeout is not None else Config.WHATSAPP_DRAIN_TIMEOUT
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._closed = True
+            if not self._pending:
+                return 0
+            now = time.monotonic()
+            self._schedule = [(min(ready_at, now), to_number) for ready_at, to_number in self._schedule]
+            heapq.heapify(self._schedule)
+            self._condition.notify_all()
+        
+        # Poll rather than wait on the condition, which would take wakeups meant for the senders
+        while time.monotonic() < deadline:
+            unsent = self.pending()
+            if not unsent:
+                return 0
+            time.sleep(0.05)
+        
+        unsent = self.pending()
+        if unsent:
+            logger.error(f"Dropping {unsent} unsent message(s) at shutdown")
+        return unsent
+
+    def _start_workers(self):
+        with self._condition:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"whatsapp-sender-{len(self._threads)}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _push(self, ready_at: float, to_number: str):
+        # Caller holds the condition
+        heapq.heappush(self._schedule, (ready_at, to_number))
+        self._scheduled.add(to_number)
+        self._condition.notify()
+
+    def _next_batch(self):
+        """Wait for a recipient whose rate limit has passed and take its queued messages"""
+        with self._condition:
+            while True:
+                if not self._schedule:
+                    self._condition.wait()
+                    continue
+                ready_at, to_number = self._schedule[0]
+                delay = ready_at - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._schedule)
+                bodies = self._pending.get(to_number)
+                batch = [bodies.popleft()]
+                while bodies and len(self._join(batch + [bodies[0]])) <= MAX_MESSAGE_LENGTH:
+                    batch.append(bodies.popleft())
+                # Stays in _scheduled while in flight so put() does not schedule it twice
+                self._in_flight[to_number] = len(batch)
+                return to_number, batch
+
+    def _work(self):
+        while True:
+            to_number, batch = self._next_batch()
+            try:
+                self.deliver(to_number, self._join(batch))
+                self._done(to_number)
+            except Exception as e:
+                self._failed(to_number, batch, e)
+
+    def _done(self, to_number: str):
+        with self._condition:
+            now = time.monotonic()
+            self._in_flight.pop(to_number, None)
+            self._attempts.pop(to_number, None)
+            self._next_allowed[to_number] = now + self.min_interval
+            if len(self._next_allowed) > 10000:
+                self._next_allowed = {
+                    number: allowed for number, allowed in self._next_allowed.items() if allowed > now
+                }
+            self._reschedule(to_number, now if self._closed else now + self.min_interval)
+
+    def _failed(self, to_number: str, batch: list, error: Exception):
+        with self._condition:
+            self._in_flight.pop(to_number, None)
+            attempts = self._attempts.get(to_number, 0) + 1
+            if self._is_retryable(error) and attempts <= self.max_retries:
+                self._attempts[to_number] = attempts
+                self._pending[to_number].extendleft(reversed(batch))
+                delay = min(Config.WHATSAPP_BACKOFF_MAX, Config.WHATSAPP_BACKOFF_BASE * 2 ** (attempts - 1))
+                delay = delay * (0.5 + random.random() / 2)
+                logger.warning(f"Message to {to_number} failed ({str(error)}), retrying in {delay:.1f}s")
+                self._reschedule(to_number, time.monotonic() + delay)
+            else:
+                self._attempts.pop(to_number, None)
+                logger.error(f"Dropping {len(batch)} message(s) to {to_number}: {str(error)}")
+                self._reschedule(to_number, time.monotonic() + self.min_interval)
+
+    def _reschedule(self, to_number: str, ready_at: float):
+        # Caller holds the condition
+        self._scheduled.discard(to_number)
+        if self._pending.get(to_number):
+            self._push(ready_at, to_number)
+        else:
+            self._pending.pop(to_number, None)
+
+    @staticmethod
+    def _join(batch: list) -> str:
+        return '\n\n'.join(body for _, body in batch)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, TwilioRestException):
+            return error.status == 429 or error.status >= 500
+        return isinstance(error, (RequestsConnectionError, Timeout))
@@ -0,0 +1,198 @@
+import os
+import threading
+from googleapiclient.http import MediaUpload
+from errors import TransientError
+from upload_engine import CHUNK_ALIGNMENT
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class GrowingFile:
+    """
+    Read side of a video file that is still being downloaded
+
+    The downloader reports the contiguous prefix it has written through
+    advance(); readers block in read() until the bytes they ask for are on
+    disk. The file on disk doubles as the spill buffer: when the upload keeps
+    up, reads are served from the page cache, and when it falls behind the
+    backlog simply stays on disk instead of in memory.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.total_size = None
+        self.error = None
+        self._available = 0
+        self._finished = False
+        self._fd = None
+        self._condition = threading.Condition()
+        self._cancelled = threading.Event()
+
+    def download(self, downloader, url: str):
+        """
+        Run a download into this file, typically on a background thread
+
+        Args:
+            downloader (VideoDownloader): Downloader to fetch the video with
+            url (str): URL of the video to download
+        """
+        try:
+            path = downloader.download_video(url, progress_callback=self.advance, cancel=self._cancelled)
+            self.finish(path)
+        except Exception as e:
+            self.fail(e)
+
+    def advance(self, path: str, available: int, total_size: int = None):
+        """Record that the first `available` bytes of path are on disk"""
+        with self._condition:
+            if self._fd is None:
+                # Keep the descriptor open so a later rename of the file is harmless
+                self._fd = os.open(path, os.O_RDONLY)
+                self.path = path
+            self._available = max(self._available, available)
+            if total_size is not None:
+                self.total_size = total_size
+            self._condition.notify_all()
+
+    def finish(self, path: str):
+        """Mark the download as complete; path is the final file location"""
+        size = os.path.getsize(path)
+        self.advance(path, size, size)
+        with self._condition:
+            self.path = path
+            self._finished = True
+            self._condition.notify_all()
+
+    def fail(self, error: Exception):
+        """Mark the download as failed, waking any waiting reader"""
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Ask a running download() to stop; it then fails with ValueError"""
+        self._cancelled.set()
+
+    def wait_ready(self) -> str:
+        """
+        Wait until the first bytes of the file are on disk
+
+        Returns:
+            str: Path of the file being downloaded
+
+        Raises:
+            ValueError: If the download failed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._fd is not None or self.error)
+            self._raise_if_failed()
+            return self.path
+
+    def wait_finished(self) -> str:
+        """
+        Wait until the download is complete
+
+        Returns:
+            str: Final path of the downloaded file
+
+        Raises:
+            ValueError: If the download failed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._finished or self.error)
+            self._raise_if_failed()
+            return self.path
+
+    def read(self, begin: int, length: int) -> bytes:
+        """
+        Read bytes once they have been downloaded
+
+        Returns fewer than length bytes only at the end of the file.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._readable(begin, length))
+            self._raise_if_failed()
+            fd = self._fd
+        return os.pread(fd, length, begin)
+
+    def close(self):
+        """Release the read descriptor"""
+        with self._condition:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def available(self) -> int:
+        """Number of bytes readable without waiting"""
+        with self._condition:
+            if self._finished and self.total_size is not None:
+                return self.total_size
+            return self._available
+
+    def _readable(self, begin: int, length: int) -> bool:
+        if self._finished or self.error:
+            return True
+        if self.total_size is not None:
+            return self._available >= min(begin + length, self.total_size)
+        return self._available >= begin + length
+
+    def _raise_if_failed(self):
+        if self.error:
+            error_type = TransientError if isinstance(self.error, TransientError) else ValueError
+            raise error_type(f"Download failed: {str(self.error)}")
+
+
+class GrowingFileUpload(MediaUpload):
+    """
+    Resumable media body that uploads a GrowingFile while it downloads
+
+    Each chunk request blocks until the downloader has written that chunk.
+    Chunks are capped at what is already on disk past the last one sent
+    (but not below min_chunk_size), so a chunk size grown from upload
+    throughput does not make the upload wait for most of the download.
+    Only use it when the source's total size is known: with an unknown size
+    a file ending exactly on a chunk boundary cannot be finalized.
+    """
+
+    def __init__(self, source: GrowingFile, mimetype: str, chunksize: int, min_chunk_size: int = None):
+        super(GrowingFileUpload, self).__init__()
+        self._source = source
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._min_chunk_size = min_chunk_size or CHUNK_ALIGNMENT
+        self._position = 0
+        self._read_length = None
+
+    def chunksize(self):
+        # HttpRequest.next_chunk sizes getbytes() with chunksize() and then takes a read
+        # shorter than chunksize() as the end of the file. Answer that second call with
+        # the length just read, or bytes downloaded in between would end the upload early
+        if self._read_length is not None:
+            length, self._read_length = self._read_length, None
+            return length
+        ahead = (self._source.available() - self._position) // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT
+        return max(min(self._min_chunk_size, self._chunksize), min(self._chunksize, ahead))
+
+    def set_chunksize(self, chunksize: int):
+        self._chunksize = chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._source.total_size
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        data = self._source.read(begin, length)
+        self._position = begin + len(data)
+        self._read_length = length
+        return data
+
+    def has_stream(self):
+        return False
+
+    def to_json(self):
+        raise NotImplementedError("GrowingFileUpload is not serializable.")
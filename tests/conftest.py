@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep test runs off the real services
+os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACtest')
+os.environ.setdefault('TWILIO_AUTH_TOKEN', 'test-token')
+os.environ.setdefault('TWILIO_PHONE_NUMBER', '+15550000000')
+os.environ.setdefault('CELERY_TASK_ALWAYS_EAGER', 'true')
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+os.environ.setdefault('CELERY_RESULT_BACKEND', 'cache+memory://')
+
+from config import Config
+
+# Files the app writes (uploads, cache, SQLite stores, credentials, log) go to a scratch
+# directory instead of the repository; set before any module builds its components
+_scratch = tempfile.mkdtemp(prefix='youtube-uploader-tests-')
+Config.UPLOAD_FOLDER = os.path.join(_scratch, 'uploads')
+Config.DOWNLOAD_CACHE_DIR = os.path.join(Config.UPLOAD_FOLDER, 'cache')
+Config.DATA_DIR = os.path.join(_scratch, 'data')
+Config.YOUTUBE_CREDENTIALS_DIR = os.path.join(_scratch, 'credentials')
+Config.LOG_FILE = os.path.join(_scratch, 'logs', 'app.log')
+for name in ('UPLOAD_INDEX_DB', 'JOB_DB', 'QUOTA_DB', 'YOUTUBE_STREAM_DB', 'METRICS_DB',
+             'WEBHOOK_DEDUPE_DB', 'ADMISSION_DB'):
+    setattr(Config, name, os.path.join(Config.DATA_DIR, os.path.basename(getattr(Config, name))))
@@ -0,0 +1,47 @@
+import time
+import pytest
+from admission import AdmissionController
+from config import Config
+
+
+@pytest.fixture
+def admission(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ADMISSION_LEASE', 0.5)
+    monkeypatch.setattr(Config, 'ADMISSION_HEARTBEAT_INTERVAL', 0.1)
+    return AdmissionController(db_path=str(tmp_path / 'admission.db'), max_running=1)
+
+
+def dispatched(admission):
+    launched = []
+    admission.dispatch(lambda ticket_id, sender, payload: launched.append(payload))
+    return launched
+
+
+def test_heartbeat_keeps_the_slot_of_a_running_job(admission):
+    first = admission.admit('+1', 'first')
+    admission.admit('+2', 'second')
+    assert dispatched(admission) == ['first']
+
+    with admission.heartbeat(first):
+        time.sleep(1)
+        assert dispatched(admission) == []
+    assert admission.get_stats()['running'] == 1
+
+
+def test_dispatch_reclaims_expired_leases(admission):
+    admission.admit('+1', 'first')
+    admission.admit('+2', 'second')
+    assert dispatched(admission) == ['first']
+
+    # The worker running "first" died: nothing renews its lease
+    time.sleep(0.6)
+    assert dispatched(admission) == ['second']
+    assert admission.get_stats()['running'] == 1
+
+
+def test_renew_fails_after_release(admission):
+    ticket_id = admission.admit('+1', 'only')
+    dispatched(admission)
+    assert admission.renew(ticket_id)
+    admission.release(ticket_id)
+    assert not admission.renew(ticket_id)
@@ -0,0 +1,107 @@
+import io
+import pytest
+from whatsapp_handler import extract_urls
+from job_store import JobStore
+from admission import AdmissionController
+from config import Config
+
+
+def test_extract_urls_from_mixed_text():
+    text = (
+        "Please upload https://youtu.be/abc123, and (https://example.com/clip.mp4).\n"
+        "Also http://Example.com/a?b=1&c=2! Same again: https://youtu.be/abc123 "
+        "but not ftp://example.com/x or www.example.com"
+    )
+    assert extract_urls(text) == [
+        'https://youtu.be/abc123',
+        'https://example.com/clip.mp4',
+        'http://Example.com/a?b=1&c=2'
+    ]
+
+
+@pytest.mark.parametrize('text', [None, '', 'no links here', 'ftp://example.com/video.mp4'])
+def test_extract_urls_without_links(text):
+    assert extract_urls(text) == []
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'job_store', JobStore(db_path=str(tmp_path / 'jobs.db')))
+    monkeypatch.setattr(app_module, 'admission', AdmissionController(
+        db_path=str(tmp_path / 'admission.db'), max_running=1, max_queue=5
+    ))
+    # Jobs are only queued; nothing is downloaded
+    monkeypatch.setattr(app_module, 'dispatch_jobs', lambda: None)
+    monkeypatch.setattr(Config, 'BATCH_API_KEY', 'secret')
+    monkeypatch.setattr(Config, 'BATCH_NOTIFY_ALLOWLIST', '+15550001111')
+    test_client = app_module.app.test_client()
+    test_client.job_store = app_module.job_store
+    return test_client
+
+
+def test_batch_returns_a_job_per_link(client):
+    urls = ['https://youtu.be/one', 'https://youtu.be/two', ' https://youtu.be/one ', '']
+    response = client.post('/jobs/batch', json={'urls': urls})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status'] == 'queued'
+    assert len(body['job_ids']) == 2 and len(set(body['job_ids'])) == 2
+
+    batch = client.get(f"/jobs/batch/{body['batch_id']}").get_json()
+    assert [job['id'] for job in batch['jobs']] == body['job_ids']
+    assert [job['url'] for job in batch['jobs']] == ['https://youtu.be/one', 'https://youtu.be/two']
+    for job_id in body['job_ids']:
+        assert client.get(f"/jobs/{job_id}").status_code == 200
+
+
+def test_batch_from_a_csv_file(client):
+    csv_data = b'name,link\nfirst,https://youtu.be/one\nsecond,"see https://youtu.be/two."\n'
+    response = client.post('/jobs/batch', data={'file': (io.BytesIO(csv_data), 'links.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    batch = client.job_store.get_batch(response.get_json()['batch_id'])
+    assert [job['url'] for job in batch['jobs']] == ['https://youtu.be/one', 'https://youtu.be/two']
+
+
+@pytest.mark.parametrize('payload, message', [
+    ({'urls': []}, 'No video links provided'),
+    ({'urls': ['  ', '']}, 'No video links provided'),
+    ({}, 'urls must be a list of links'),
+    ({'urls': 'https://youtu.be/one'}, 'urls must be a list of links'),
+    ({'urls': ['https://youtu.be/one', 7]}, 'urls must be a list of links'),
+    ({'urls': ['https://youtu.be/one'], 'notify': 15550001111}, 'notify must be a phone number'),
+])
+def test_batch_rejects_empty_and_invalid_input(client, payload, message):
+    response = client.post('/jobs/batch', json=payload)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+
+
+def test_batch_rejects_a_csv_without_links(client):
+    response = client.post('/jobs/batch', data={'file': (io.BytesIO(b'name\nnothing here\n'), 'links.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_batch_rejects_too_many_links(client, monkeypatch):
+    monkeypatch.setattr(Config, 'BATCH_MAX_URLS', 2)
+    urls = [f"https://youtu.be/{n}" for n in range(3)]
+    assert client.post('/jobs/batch', json={'urls': urls}).status_code == 400
+
+
+def test_batch_notify_needs_the_allowlist_or_the_key(client):
+    urls = ['https://youtu.be/one']
+    assert client.post('/jobs/batch', json={'urls': urls, 'notify': '+15559999999'}).status_code == 403
+    assert client.post('/jobs/batch', json={'urls': urls, 'notify': '+15559999999'},
+                       headers={'X-API-Key': 'wrong'}).status_code == 403
+    assert client.post('/jobs/batch', json={'urls': urls, 'notify': '+15559999999'},
+                       headers={'X-API-Key': 'secret'}).status_code == 202
+    assert client.post('/jobs/batch', json={'urls': urls, 'notify': '+15550001111'}).status_code == 202
+
+
+def test_batch_over_the_queue_limit_is_busy(client):
+    urls = [f"https://youtu.be/{n}" for n in range(6)]
+    response = client.post('/jobs/batch', json={'urls': urls})
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'busy'
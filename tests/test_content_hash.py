@@ -0,0 +1,84 @@
+import os
+import hashlib
+import pytest
+from content_hash import BLOCK_SIZE, ContentHasher, hash_file
+from download_journal import DownloadJournal
+
+
+@pytest.fixture
+def data():
+    # Two full blocks and a partial one
+    return os.urandom(2 * BLOCK_SIZE + 12345)
+
+
+@pytest.mark.parametrize('piece', [1000, BLOCK_SIZE - 1, BLOCK_SIZE, 3 * BLOCK_SIZE])
+def test_incremental_hash_matches_hash_file(tmp_path, data, piece):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(data)
+    hasher = ContentHasher()
+    for offset in range(0, len(data), piece):
+        hasher.update(data[offset:offset + piece])
+    assert hasher.hexdigest() == hash_file(str(path))
+
+
+def test_hash_is_not_a_plain_sha256(tmp_path, data):
+    # Block-wise, so ranges hashed out of order combine to the same value
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(data)
+    assert hash_file(str(path)) != hashlib.sha256(data).hexdigest()
+
+
+def journal_with_blocks(path, data, blocks):
+    journal = DownloadJournal(str(path), len(data), etag='"v1"', ext='mp4')
+    for index in blocks:
+        start = index * BLOCK_SIZE
+        end = min(start + BLOCK_SIZE, len(data)) - 1
+        journal.add_block(start, end, hashlib.sha256(data[start:end + 1]).digest())
+    return journal
+
+
+def test_journal_round_trip(tmp_path, data):
+    path = tmp_path / 'video.part.json'
+    journal_with_blocks(path, data, [0, 2]).save()
+
+    loaded = DownloadJournal.load(str(path))
+    assert (loaded.total_size, loaded.etag, loaded.ext) == (len(data), '"v1"', 'mp4')
+    assert loaded.completed == [(0, BLOCK_SIZE - 1), (2 * BLOCK_SIZE, len(data) - 1)]
+    assert loaded.validator == '"v1"'
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_resumed_journal_knows_the_missing_ranges_and_content_hash(tmp_path, data):
+    path = tmp_path / 'video.part.json'
+    journal_with_blocks(path, data, [2]).save()
+
+    journal = DownloadJournal.load(str(path))
+    assert journal.contiguous_bytes() == 0
+    assert journal.missing_ranges() == [(0, 2 * BLOCK_SIZE - 1)]
+
+    # Blocks written out of order after the resume
+    for index in (1, 0):
+        start = index * BLOCK_SIZE
+        journal.add_block(start, start + BLOCK_SIZE - 1, hashlib.sha256(data[start:start + BLOCK_SIZE]).digest())
+    assert journal.missing_ranges() == []
+    assert journal.contiguous_bytes() == len(data)
+
+    file_path = tmp_path / 'video.mp4'
+    file_path.write_bytes(data)
+    assert journal.content_hash() == hash_file(str(file_path))
+
+
+def test_journal_only_matches_the_same_remote_file(tmp_path):
+    journal = DownloadJournal(str(tmp_path / 'video.part.json'), 100, etag='"v1"')
+    assert journal.matches(100, '"v1"')
+    assert not journal.matches(100, '"v2"')
+    assert not journal.matches(101, '"v1"')
+    # Without a validator a changed file cannot be detected, so never resume
+    assert not DownloadJournal(str(tmp_path / 'other.part.json'), 100).matches(100)
+
+
+def test_unreadable_journal_is_ignored(tmp_path):
+    path = tmp_path / 'video.part.json'
+    assert DownloadJournal.load(str(path)) is None
+    path.write_text('{"total_size": ')
+    assert DownloadJournal.load(str(path)) is None
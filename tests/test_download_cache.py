@@ -0,0 +1,83 @@
+import os
+import pytest
+from download_cache import DownloadCache
+from metrics import metrics
+
+URL = 'https://example.com/videos/clip.mp4'
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DownloadCache(cache_dir=str(tmp_path / 'cache'), max_bytes=10)
+
+
+def cache_events():
+    events = {}
+    for line in metrics.render().splitlines():
+        if line.startswith('download_cache_events_total{'):
+            series, value = line.rsplit(' ', 1)
+            events[series] = float(value)
+    return events
+
+
+def test_counts_hits_misses_and_evictions(cache, tmp_path):
+    before = cache_events()
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'12345678')
+
+    assert cache.get(URL, str(tmp_path)) is None
+    cache.put(URL, str(video))
+    path, _ = cache.get(URL, str(tmp_path))
+    assert open(path, 'rb').read() == b'12345678'
+
+    other = tmp_path / 'other.mp4'
+    other.write_bytes(b'abcdefgh')
+    cache.put('https://example.com/other.mp4', str(other))
+
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'evictions': 1}
+    after = cache_events()
+    for event in ('hit', 'miss', 'eviction'):
+        key = f'download_cache_events_total{{event="{event}"}}'
+        assert after.get(key, 0) - before.get(key, 0) == 1
+
+
+def test_cache_hits_add_no_download_throughput(monkeypatch, tmp_path):
+    import app as app_module
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'\0' * 1024)
+    observed = []
+    monkeypatch.setattr(app_module.video_downloader, 'download_video', lambda url, progress_callback=None: str(video))
+    monkeypatch.setattr(app_module.metrics, 'observe', lambda name, value, **labels: observed.append(name))
+
+    monkeypatch.setattr(app_module.video_downloader, '_cached_paths', {str(video)})
+    app_module.timed_download(URL)
+    assert 'pipeline_download_throughput_bytes_per_second' not in observed
+
+    monkeypatch.setattr(app_module.video_downloader, '_cached_paths', set())
+    app_module.timed_download(URL)
+    assert 'pipeline_download_throughput_bytes_per_second' in observed
+
+
+def cached_files(cache):
+    return sorted(name for name in os.listdir(cache.cache_dir) if not name.startswith('index.db'))
+
+
+def test_same_content_with_another_extension_reuses_the_cached_file(tmp_path):
+    cache = DownloadCache(cache_dir=str(tmp_path / 'cache'), max_bytes=1024)
+    mp4 = tmp_path / 'video.mp4'
+    mp4.write_bytes(b'12345678')
+    mkv = tmp_path / 'video.mkv'
+    mkv.write_bytes(b'12345678')
+
+    content_hash = cache.put(URL, str(mp4))
+    assert cache.put('https://example.com/same.mkv', str(mkv)) == content_hash
+    assert cached_files(cache) == [f"{content_hash}.mp4"]
+    path, _ = cache.get('https://example.com/same.mkv', str(tmp_path))
+    assert path.endswith('.mp4')
+
+    # A cached file that has gone missing is replaced by the new copy
+    os.remove(os.path.join(cache.cache_dir, f"{content_hash}.mp4"))
+    cache.put(URL, str(mkv))
+    assert cached_files(cache) == [f"{content_hash}.mkv"]
+    path, _ = cache.get(URL, str(tmp_path))
+    assert open(path, 'rb').read() == b'12345678'
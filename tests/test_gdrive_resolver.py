@@ -0,0 +1,172 @@
+import io
+import http.client
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+from gdrive_resolver import GoogleDriveResolver
+
+VIDEO = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 64
+
+FILE_IDS = {
+    'direct': '1DirectFile0000000000',
+    'cookie': '1CookieFile0000000000',
+    'link': '1LinkConfirm000000000',
+    'form': '1VirusScanForm0000000',
+    'private': '1PrivateFile000000000',
+    'quota': '1QuotaExceeded0000000'
+}
+
+
+class RawHeaders:
+    """The parts of http.client.HTTPResponse that requests and urllib3 use besides the body"""
+
+    def __init__(self, headers):
+        self.msg = http.client.HTTPMessage()
+        for name, value in headers.items():
+            self.msg[name] = value
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeDrive(HTTPAdapter):
+    """
+    Local stand-in for Google Drive's download endpoints
+
+    Serves drive.google.com/uc and drive.usercontent.google.com/download the
+    way Drive does for each kind of file: small files directly, large ones
+    behind a download_warning cookie, a confirm link, or the virus-scan form.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests.append((url.netloc, url.path, query))
+        file_id = query.get('id')
+
+        if url.netloc == 'drive.usercontent.google.com' and url.path == '/download':
+            if file_id == FILE_IDS['form'] and query.get('confirm') == 't' and query.get('uuid') == 'abc-123':
+                return self._file(request)
+        elif url.netloc == 'drive.google.com' and url.path == '/uc':
+            if file_id == FILE_IDS['direct']:
+                return self._file(request)
+            if file_id == FILE_IDS['cookie']:
+                if query.get('confirm') == 'cookietoken':
+                    return self._file(request)
+                return self._page(request, '<html><body>Google Drive can\'t scan this file.</body></html>', {
+                    'Set-Cookie': f'download_warning_13058876669334088843_{file_id}=cookietoken; '
+                                  'Domain=.drive.google.com; Path=/uc'
+                })
+            if file_id == FILE_IDS['link']:
+                if query.get('confirm') == 'linktoken':
+                    return self._file(request)
+                return self._page(request, (
+                    '<html><body><a id="uc-download-link" '
+                    f'href="/uc?export=download&amp;confirm=linktoken&amp;id={file_id}">Download anyway</a>'
+                    '</body></html>'
+                ))
+            if file_id == FILE_IDS['form']:
+                return self._page(request, (
+                    '<html><body><p>Google Drive can\'t scan this file for viruses.</p>'
+                    '<form id="download-form" action="https://drive.usercontent.google.com/download" method="get">'
+                    '<input type="submit" id="uc-download-link" value="Download anyway"/>'
+                    f'<input type="hidden" name="id" value="{file_id}">'
+                    '<input type="hidden" name="export" value="download">'
+                    '<input type="hidden" name="confirm" value="t">'
+                    '<input type="hidden" name="uuid" value="abc-123">'
+                    '</form></body></html>'
+                ))
+            if file_id == FILE_IDS['quota']:
+                return self._page(request, (
+                    '<html><body>Too many users have viewed or downloaded this file recently.</body></html>'
+                ))
+        return self._page(request, '<html><body>Sign in to continue to Google Drive</body></html>')
+
+    def _file(self, request):
+        return self._respond(request, VIDEO, {'Content-Type': 'video/mp4', 'Content-Length': str(len(VIDEO))})
+
+    def _page(self, request, body, headers=None):
+        return self._respond(request, body.encode(), {'Content-Type': 'text/html; charset=utf-8', **(headers or {})})
+
+    def _respond(self, request, body, headers):
+        raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers=headers,
+            status=200,
+            preload_content=False,
+            decode_content=False,
+            # requests reads Set-Cookie through the underlying http.client response
+            original_response=RawHeaders(headers)
+        )
+        return self.build_response(request, raw)
+
+
+@pytest.fixture
+def drive():
+    return FakeDrive()
+
+
+@pytest.fixture
+def resolver(drive):
+    session = requests.Session()
+    session.mount('https://drive.google.com', drive)
+    session.mount('https://drive.usercontent.google.com', drive)
+    return GoogleDriveResolver(session, timeout=(5, 5))
+
+
+def download(resolver, url):
+    with resolver.open(url) as response:
+        return response.content
+
+
+@pytest.mark.parametrize('url', [
+    f"https://drive.google.com/file/d/{FILE_IDS['direct']}/view?usp=sharing",
+    f"https://drive.google.com/open?id={FILE_IDS['direct']}",
+    f"https://drive.google.com/uc?id={FILE_IDS['direct']}",
+    f"https://drive.google.com/uc?export=download&id={FILE_IDS['direct']}",
+    f"https://docs.google.com/file/d/{FILE_IDS['direct']}/edit"
+])
+def test_link_forms_download_the_file(resolver, url):
+    assert download(resolver, url) == VIDEO
+
+
+def test_file_id_rejects_links_without_an_id():
+    with pytest.raises(ValueError):
+        GoogleDriveResolver.file_id('https://drive.google.com/drive/my-drive')
+
+
+def test_confirm_link_page(resolver):
+    assert download(resolver, f"https://drive.google.com/file/d/{FILE_IDS['link']}/view") == VIDEO
+
+
+def test_virus_scan_form(resolver, drive):
+    assert download(resolver, f"https://drive.google.com/uc?id={FILE_IDS['form']}") == VIDEO
+    assert drive.requests[-1][0] == 'drive.usercontent.google.com'
+
+
+def test_download_warning_cookie(resolver):
+    assert download(resolver, f"https://drive.google.com/open?id={FILE_IDS['cookie']}") == VIDEO
+
+
+def test_cookie_of_another_download_is_not_used(resolver, drive):
+    # An earlier download leaves its download_warning cookie in the shared session
+    download(resolver, f"https://drive.google.com/open?id={FILE_IDS['cookie']}")
+    assert any(cookie.name.startswith('download_warning') for cookie in resolver.session.cookies)
+
+    with pytest.raises(ValueError, match='shared with anyone'):
+        resolver.open(f"https://drive.google.com/open?id={FILE_IDS['private']}")
+    assert not any('confirm' in query for _, _, query in drive.requests if query.get('id') == FILE_IDS['private'])
+
+
+def test_quota_page(resolver):
+    with pytest.raises(ValueError, match='quota'):
+        resolver.open(f"https://drive.google.com/uc?id={FILE_IDS['quota']}")
@@ -0,0 +1,84 @@
+import sqlite3
+import pytest
+from metrics import Metrics, RETIRED
+from config import Config
+
+
+@pytest.fixture
+def registry(tmp_path):
+    # Flushed by render() only
+    return Metrics(db_path=str(tmp_path / 'metrics.db'), flush_interval=3600)
+
+
+def samples(registry):
+    values = {}
+    for line in registry.render().splitlines():
+        if not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            values[series] = float(value)
+    return values
+
+
+def processes(registry):
+    with sqlite3.connect(registry.db_path) as conn:
+        return {row[0] for row in conn.execute('SELECT process FROM series')}
+
+
+def test_counters_and_histograms_add_up(registry):
+    registry.inc('download_cache_events_total', event='hit')
+    registry.inc('download_cache_events_total', 2, event='hit')
+    registry.observe('queue_wait_seconds', 0.3)
+    registry.observe('queue_wait_seconds', 45)
+    values = samples(registry)
+    assert values['download_cache_events_total{event="hit"}'] == 3
+    assert values['queue_wait_seconds_bucket{le="0.5"}'] == 1
+    assert values['queue_wait_seconds_bucket{le="+Inf"}'] == 2
+    assert values['queue_wait_seconds_sum'] == 45.3
+    assert values['queue_wait_seconds_count'] == 2
+
+    # Each flush adds only what was observed since the last one
+    registry.inc('download_cache_events_total', event='hit')
+    assert samples(registry)['download_cache_events_total{event="hit"}'] == 4
+    assert samples(registry)['download_cache_events_total{event="hit"}'] == 4
+
+
+def test_processes_are_summed(registry):
+    other = Metrics(db_path=registry.db_path, flush_interval=3600)
+    other._ensure_process()
+    other._process = 'other-host:1:0'
+    registry.inc('transfer_bytes_total', 100, direction='upload')
+    other.inc('transfer_bytes_total', 50, direction='upload')
+    other.flush()
+    assert samples(registry)['transfer_bytes_total{direction="upload"}'] == 150
+
+
+def test_idle_processes_never_lower_the_totals(registry, monkeypatch):
+    registry.inc('pipeline_stage_failures_total', stage='download', source='youtube')
+    registry.observe('queue_wait_seconds', 2)
+    before = samples(registry)
+
+    # Every process is idle past the retention: its rows are folded, not dropped
+    monkeypatch.setattr(Config, 'METRICS_RETENTION', -1)
+    assert samples(registry) == before
+    assert processes(registry) == {RETIRED}
+
+    # The same process observing again is not counted twice
+    registry.inc('pipeline_stage_failures_total', stage='download', source='youtube')
+    after = samples(registry)
+    assert after['pipeline_stage_failures_total{source="youtube",stage="download"}'] == 2
+    assert after['queue_wait_seconds_count'] == 1
+    assert processes(registry) == {RETIRED}
+
+    monkeypatch.setattr(Config, 'METRICS_RETENTION', 3600)
+    registry.inc('pipeline_stage_failures_total', stage='download', source='youtube')
+    assert samples(registry)['pipeline_stage_failures_total{source="youtube",stage="download"}'] == 3
+    assert len(processes(registry)) == 2
+
+
+def test_failed_flushes_are_retried(registry, monkeypatch):
+    registry.inc('transfer_bytes_total', 10, direction='download')
+    monkeypatch.setattr(registry, '_connect', lambda: sqlite3.connect('/nonexistent/metrics.db'))
+    registry.flush()
+    registry.inc('transfer_bytes_total', 5, direction='download')
+    monkeypatch.undo()
+    assert samples(registry)['transfer_bytes_total{direction="download"}'] == 15
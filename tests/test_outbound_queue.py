@@ -0,0 +1,190 @@
+import time
+import threading
+import pytest
+from twilio.base.exceptions import TwilioRestException
+from outbound_queue import OutboundMessageQueue
+from whatsapp_handler import WhatsAppHandler
+from config import Config
+
+
+class FakeTwilio:
+    """Stand-in for the Twilio REST client that records messages and can fail on demand"""
+
+    def __init__(self, failures=()):
+        self.sent = []              # (monotonic time, to, body)
+        self.failures = list(failures)
+        self.attempts = 0
+        self.lock = threading.Lock()
+        self.messages = self
+
+    def create(self, body, from_, to):
+        with self.lock:
+            self.attempts += 1
+            if self.failures:
+                status = self.failures.pop(0)
+                raise TwilioRestException(status, '/Messages.json', f"HTTP {status}")
+            self.sent.append((time.monotonic(), to, body))
+            return type('Message', (), {'sid': f"SM{len(self.sent)}"})()
+
+    def deliver(self, to_number, body):
+        self.create(body=body, from_='whatsapp:+15550000000', to=to_number)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(Config, 'WHATSAPP_BACKOFF_BASE', 0.01)
+    monkeypatch.setattr(Config, 'WHATSAPP_BACKOFF_MAX', 0.05)
+
+
+def test_rate_limit_spaces_messages_per_recipient():
+    twilio = FakeTwilio()
+    outbox = OutboundMessageQueue(twilio.deliver, workers=2, min_interval=0.2)
+    outbox.put('whatsapp:+1', 'one')
+    assert wait_for(lambda: len(twilio.sent) == 1)
+    outbox.put('whatsapp:+1', 'two')
+    outbox.put('whatsapp:+2', 'other recipient')
+    assert wait_for(lambda: len(twilio.sent) == 3)
+
+    times = {body: sent_at for sent_at, _, body in twilio.sent}
+    assert times['two'] - times['one'] >= 0.19
+    # Other recipients are not held back
+    assert times['other recipient'] < times['two']
+
+
+def test_messages_queued_during_the_interval_are_joined():
+    twilio = FakeTwilio()
+    outbox = OutboundMessageQueue(twilio.deliver, workers=1, min_interval=0.2)
+    outbox.put('whatsapp:+1', 'first')
+    assert wait_for(lambda: len(twilio.sent) == 1)
+    outbox.put('whatsapp:+1', 'second')
+    outbox.put('whatsapp:+1', 'third')
+    assert wait_for(lambda: len(twilio.sent) == 2)
+    assert twilio.sent[1][2] == 'second\n\nthird'
+
+
+def test_replace_key_supersedes_queued_message():
+    twilio = FakeTwilio()
+    outbox = OutboundMessageQueue(twilio.deliver, workers=1, min_interval=0.2)
+    outbox.put('whatsapp:+1', 'started')
+    assert wait_for(lambda: len(twilio.sent) == 1)
+    outbox.put('whatsapp:+1', 'progress 10%', replace_key='progress')
+    outbox.put('whatsapp:+1', 'progress 50%', replace_key='progress')
+    outbox.put('whatsapp:+1', 'progress 90%', replace_key='progress')
+    assert wait_for(lambda: len(twilio.sent) == 2)
+    assert twilio.sent[1][2] == 'progress 90%'
+    assert outbox.pending() == 0
+
+
+def test_rate_limited_and_server_errors_are_retried_in_order():
+    twilio = FakeTwilio(failures=[429, 503])
+    outbox = OutboundMessageQueue(twilio.deliver, workers=2, min_interval=0, max_retries=3)
+    outbox.put('whatsapp:+1', 'a')
+    outbox.put('whatsapp:+1', 'b')
+    assert wait_for(lambda: outbox.pending() == 0)
+    assert twilio.attempts >= 3
+    assert '\n\n'.join(body for _, _, body in twilio.sent) == 'a\n\nb'
+
+
+def test_client_errors_are_not_retried():
+    twilio = FakeTwilio(failures=[400])
+    outbox = OutboundMessageQueue(twilio.deliver, workers=1, min_interval=0, max_retries=3)
+    outbox.put('whatsapp:+1', 'bad number')
+    assert wait_for(lambda: outbox.pending() == 0)
+    time.sleep(0.1)
+    assert twilio.attempts == 1
+    assert twilio.sent == []
+
+
+def test_close_sends_queued_messages_without_waiting_for_the_interval():
+    twilio = FakeTwilio()
+    outbox = OutboundMessageQueue(twilio.deliver, workers=1, min_interval=60)
+    outbox.put('whatsapp:+1', 'first')
+    assert wait_for(lambda: len(twilio.sent) == 1)
+    outbox.put('whatsapp:+1', 'done', replace_key='final')
+
+    started = time.monotonic()
+    assert outbox.close(timeout=5) == 0
+    assert time.monotonic() - started < 1
+    assert [body for _, _, body in twilio.sent] == ['first', 'done']
+    assert outbox.put('whatsapp:+1', 'too late') is False
+
+
+def test_close_gives_up_after_timeout():
+    release = threading.Event()
+    outbox = OutboundMessageQueue(lambda to, body: release.wait(), workers=1, min_interval=0)
+    outbox.put('whatsapp:+1', 'stuck')
+    assert outbox.close(timeout=0.1) == 1
+    release.set()
+
+
+def test_send_message_delivers_through_twilio(monkeypatch):
+    twilio = FakeTwilio()
+    monkeypatch.setattr(WhatsAppHandler, 'client', property(lambda self: twilio))
+    handler = WhatsAppHandler()
+    assert handler.send_message('+15551234567', 'hello') is True
+    assert handler.outbox.close(timeout=5) == 0
+    assert [(to, body) for _, to, body in twilio.sent] == [('whatsapp:+15551234567', 'hello')]
+    assert handler.send_message('+15551234567', 'after shutdown') is False
+
+
+@pytest.fixture
+def progress_handler(monkeypatch):
+    monkeypatch.setattr(Config, 'WHATSAPP_PROGRESS_INTERVAL', 0.3)
+    monkeypatch.setattr(Config, 'WHATSAPP_PROGRESS_MIN_DELTA', 10)
+    handler = WhatsAppHandler()
+    handler.sent = []
+    monkeypatch.setattr(handler, 'send_message', lambda to, message, replace_key=None: handler.sent.append(message))
+    return handler
+
+
+def test_held_back_progress_is_sent_when_the_interval_is_over(progress_handler):
+    report = progress_handler.progress_callback('+15551234567')
+    report('uploading', 10)
+    for progress in (30, 40, 55):
+        report('uploading', progress)
+    assert len(progress_handler.sent) == 1
+
+    # Only the latest held update goes out, once the interval is over
+    assert wait_for(lambda: len(progress_handler.sent) == 2)
+    assert progress_handler.sent[1] == progress_handler.format_progress_message('uploading', 55)
+    time.sleep(0.4)
+    assert len(progress_handler.sent) == 2
+
+
+def test_flush_sends_the_latest_held_progress(progress_handler):
+    report = progress_handler.progress_callback('+15551234567')
+    report('downloading', 90)
+    # Too small a step and too soon: held back, not dropped
+    report('downloading', 95)
+    report('downloading', 99)
+    report.flush()
+    assert progress_handler.sent == [
+        progress_handler.format_progress_message('downloading', 90),
+        progress_handler.format_progress_message('downloading', 99)
+    ]
+    # Nothing left for the timer or a second flush to send
+    report.flush()
+    time.sleep(0.4)
+    assert len(progress_handler.sent) == 2
+
+
+def test_a_new_stage_replaces_held_progress(progress_handler):
+    report = progress_handler.progress_callback('+15551234567')
+    report('downloading', 50)
+    report('downloading', 70)
+    report('uploading')
+    report.flush()
+    time.sleep(0.4)
+    assert progress_handler.sent == [
+        progress_handler.format_progress_message('downloading', 50),
+        progress_handler.format_progress_message('uploading')
+    ]
@@ -0,0 +1,116 @@
+import threading
+from streaming_upload import GrowingFile, GrowingFileUpload
+
+KB = 1024
+MB = 1024 * 1024
+
+
+def growing_file(tmp_path, available, total_size):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'\0' * available)
+    source = GrowingFile()
+    source.advance(str(path), available, total_size)
+    return source
+
+
+def test_chunks_are_capped_at_the_downloaded_bytes(tmp_path):
+    source = growing_file(tmp_path, 3 * MB + 100, 64 * MB)
+    media = GrowingFileUpload(source, 'video/mp4', chunksize=32 * MB, min_chunk_size=256 * KB)
+    assert media.chunksize() == 3 * MB
+
+    media.getbytes(0, 3 * MB)
+    # The end-of-file check right after a read sees the length that was read
+    assert media.chunksize() == 3 * MB
+    # Nothing new on disk yet: wait for one minimum chunk rather than the full 32MB
+    assert media.chunksize() == 256 * KB
+
+
+def test_chunks_are_not_capped_once_the_download_finished(tmp_path):
+    source = growing_file(tmp_path, 10 * MB, 10 * MB)
+    source.finish(source.path)
+    media = GrowingFileUpload(source, 'video/mp4', chunksize=4 * MB, min_chunk_size=256 * KB)
+    media.getbytes(0, 4 * MB)
+    media.chunksize()
+    assert media.chunksize() == 4 * MB
+
+
+def test_read_waits_for_the_downloader(tmp_path):
+    source = growing_file(tmp_path, 1 * MB, 2 * MB)
+    result = []
+    reader = threading.Thread(target=lambda: result.append(source.read(MB, MB)))
+    reader.start()
+    reader.join(0.1)
+    assert reader.is_alive()
+
+    with open(source.path, 'ab') as f:
+        f.write(b'\1' * MB)
+    source.advance(source.path, 2 * MB)
+    reader.join(1)
+    assert result == [b'\1' * MB]
+
+
+class BurstyDownload(GrowingFile):
+    """GrowingFile whose downloader writes another `step` bytes while each chunk is read"""
+
+    def __init__(self, path, total_size, step):
+        super().__init__()
+        self.step = step
+        self.advance(path, 256 * KB, total_size)
+
+    def read(self, begin, length):
+        data = super().read(begin, length)
+        self.advance(self.path, min(self.total_size, self._available + self.step))
+        return data
+
+
+def test_upload_completes_when_the_download_grows_between_chunksize_calls(tmp_path, monkeypatch):
+    from googleapiclient.http import HttpRequest
+    import upload_engine
+    from upload_engine import ResumableUploadEngine
+    from test_upload_engine import FakeClock, FakeResumableEndpoint, UPLOAD_URL
+
+    clock = FakeClock()
+    monkeypatch.setattr(upload_engine.time, 'monotonic', clock.monotonic)
+    data = bytes(range(256)) * (32 * MB // 256)
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(data)
+    source = BurstyDownload(str(path), len(data), step=4 * MB)
+
+    endpoint = FakeResumableEndpoint(clock, bandwidth=4 * MB)
+    request = HttpRequest(
+        endpoint,
+        lambda response, content: content,
+        UPLOAD_URL,
+        method='POST',
+        body='{}',
+        headers={'content-type': 'application/json'},
+        resumable=GrowingFileUpload(source, 'video/mp4', chunksize=8 * MB, min_chunk_size=256 * KB)
+    )
+    ResumableUploadEngine(256 * KB, 16 * MB, 1, 3).run(request)
+
+    assert bytes(endpoint.received) == data
+
+
+def test_details_are_corrected_from_the_finished_file(tmp_path, monkeypatch):
+    import app as app_module
+    from concurrent.futures import Future
+    content = {'title': 'Clip', 'description': 'partial', 'tags': ['a'], 'hashtags': ''}
+    updates = []
+
+    def submit(func, *args, cost=None):
+        updates.append((func.__name__, args, cost))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    monkeypatch.setattr(app_module.upload_scheduler, 'submit', submit)
+    monkeypatch.setattr(app_module.content_generator, 'generate_content',
+                        lambda path, source_url=None: {**content, 'description': 'complete'})
+    app_module.publish_details(content, str(tmp_path / 'video.mp4'), 'https://example.com/v.mp4', 'video-1')
+    assert updates == [('update_video_details', ('video-1', 'Clip', 'complete', ['a']),
+                        app_module.Config.YOUTUBE_UPDATE_QUOTA_COST)]
+
+    updates.clear()
+    monkeypatch.setattr(app_module.content_generator, 'generate_content', lambda path, source_url=None: content)
+    app_module.publish_details(content, str(tmp_path / 'video.mp4'), 'https://example.com/v.mp4', 'video-1')
+    assert updates == []
@@ -0,0 +1,94 @@
+import os
+import sys
+import numpy as np
+import pytest
+from thumbnail_extractor import SCORE_HEIGHT, SCORE_WIDTH, extract_thumbnail, score_frames
+from test_video_metadata import mp4
+
+# Stands in for ffmpeg: prints the candidate's prepared score frame and writes a JPEG naming it
+FAKE_FFMPEG = f"""#!{sys.executable}
+import os, sys
+candidate_path = sys.argv[-1]
+index = candidate_path.rsplit('.', 2)[1]
+with open(os.path.join(os.environ['FAKE_FRAMES'], index + '.raw'), 'rb') as f:
+    sys.stdout.buffer.write(f.read())
+with open(candidate_path, 'wb') as f:
+    f.write(('frame ' + index).encode())
+"""
+
+
+def blank(level=128):
+    return np.full((SCORE_HEIGHT, SCORE_WIDTH), level, dtype=np.uint8)
+
+
+def textured(seed=0, low=48, high=208):
+    rng = np.random.default_rng(seed)
+    return rng.integers(low, high, size=(SCORE_HEIGHT, SCORE_WIDTH), dtype=np.uint8)
+
+
+def test_blank_frames_score_below_textured_ones():
+    scores = score_frames(np.stack([blank(), textured(), blank(0), blank(255)]))
+    assert scores[1] > scores[0]
+    assert scores[2] == scores[3] == 0
+
+
+def test_flat_frames_are_penalised():
+    # A faint gradient is sharp enough to score but too flat for a thumbnail
+    gradient = np.tile(np.linspace(120, 136, SCORE_WIDTH, dtype=np.uint8), (SCORE_HEIGHT, 1))
+    gradient[::2] += 4
+    scores = score_frames(np.stack([gradient, textured()]))
+    assert 0 < scores[0] < scores[1] / 10
+
+
+def test_badly_exposed_frames_score_lower():
+    scores = score_frames(np.stack([textured(low=0, high=40), textured()]))
+    assert scores[0] < scores[1]
+
+
+def test_scores_are_deterministic():
+    frames = np.stack([textured(seed) for seed in range(5)] + [blank()])
+    scores = score_frames(frames)
+    assert np.array_equal(scores, score_frames(frames.copy()))
+    # Each frame is scored on its own, so the order of candidates does not matter
+    order = [3, 5, 0, 4, 1, 2]
+    assert np.array_equal(score_frames(frames[order]), scores[order])
+    # Equal scores pick the earliest candidate
+    assert int(np.argmax(score_frames(np.stack([textured(7), textured(7)])))) == 0
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    frames_dir = tmp_path / 'frames'
+    frames_dir.mkdir()
+    monkeypatch.setenv('FAKE_FRAMES', str(frames_dir))
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG)
+    path.chmod(0o755)
+
+    def prepare(frames):
+        for index, frame in enumerate(frames):
+            (frames_dir / f"{index}.raw").write_bytes(frame.tobytes())
+        return str(path)
+    return prepare
+
+
+def test_extract_thumbnail_keeps_the_best_candidate(tmp_path, ffmpeg):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(mp4())
+    ffmpeg_path = ffmpeg([blank(), textured(low=0, high=40), textured(), blank(0)])
+    output = tmp_path / 'video.thumb.jpg'
+
+    for _ in range(3):
+        assert extract_thumbnail(str(video), str(output), ffmpeg_path, candidates=4, timeout=10) == str(output)
+        assert output.read_bytes() == b'frame 2'
+        assert sorted(os.listdir(tmp_path)) == ['ffmpeg', 'frames', 'video.mp4', 'video.thumb.jpg']
+
+
+def test_extract_thumbnail_without_frames(tmp_path, ffmpeg):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(mp4())
+    # The decoder produced a short frame for every candidate
+    ffmpeg_path = ffmpeg([blank()[:10]] * 2)
+    output = tmp_path / 'video.thumb.jpg'
+    assert extract_thumbnail(str(video), str(output), ffmpeg_path, candidates=2, timeout=10) is None
+    assert not output.exists()
@@ -0,0 +1,200 @@
+import re
+import json
+import threading
+import pytest
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+import upload_engine
+from upload_engine import AdaptiveMediaFileUpload, ResumableUploadEngine, CHUNK_ALIGNMENT
+from config import Config
+
+KB = 1024
+MB = 1024 * 1024
+UPLOAD_URL = 'https://www.googleapis.com/upload/youtube/v3/videos?uploadType=resumable&part=snippet'
+SESSION_URL = 'https://www.googleapis.com/upload/youtube/v3/videos?upload_id=session-1'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeResumableEndpoint:
+    """
+    Stand-in for YouTube's resumable upload endpoint, used as the http object
+
+    Keeps the bytes it has received and answers chunk PUTs with 308 and a
+    Range header until the whole file is in. Each chunk advances the fake
+    clock as if it went over a link of `bandwidth` bytes per second.
+    Failures can be scripted per chunk: ('status', 503) answers with that
+    status without storing anything, ('partial', n) stores only the first
+    n bytes of the chunk.
+    """
+
+    def __init__(self, clock, bandwidth, failures=None):
+        self.clock = clock
+        self.bandwidth = bandwidth
+        self.failures = dict(failures or {})
+        self.received = bytearray()
+        self.chunks = []            # (start, length) of every chunk PUT
+        self.status_queries = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        if method == 'POST':
+            assert uri == UPLOAD_URL
+            return httplib2.Response({'status': '200', 'location': SESSION_URL}), b''
+
+        assert uri == SESSION_URL and method == 'PUT'
+        content_range = headers.get('content-range', '')
+        if content_range.startswith('bytes */'):
+            self.status_queries += 1
+            return self._incomplete()
+
+        data = body.read() if hasattr(body, 'read') else (body or b'')
+        start, end, total = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range).groups()
+        start = int(start)
+        assert start == len(self.received), "chunk does not continue where the server is"
+        assert len(data) == int(end) - start + 1
+        self.chunks.append((start, len(data)))
+        self.clock.now += len(data) / self.bandwidth
+
+        failure = self.failures.pop(len(self.chunks), None)
+        if failure and failure[0] == 'status':
+            return httplib2.Response({'status': str(failure[1])}), b'{"error": "backend error"}'
+        if failure and failure[0] == 'partial':
+            data = data[:failure[1]]
+
+        self.received += data
+        if total != '*' and len(self.received) == int(total):
+            return httplib2.Response({'status': '200'}), json.dumps({'id': 'video-1'}).encode()
+        return self._incomplete()
+
+    def _incomplete(self):
+        headers = {'status': '308'}
+        if self.received:
+            headers['range'] = f"bytes=0-{len(self.received) - 1}"
+        return httplib2.Response(headers), b''
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(upload_engine.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(upload_engine.time, 'sleep', lambda seconds: None)
+    return clock
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(bytes(range(256)) * (10 * MB // 256 + 1000))
+    return path
+
+
+def upload(endpoint, video, engine, chunksize=256 * KB, progress=None):
+    media = AdaptiveMediaFileUpload(str(video), mimetype='video/mp4', chunksize=chunksize, resumable=True)
+    request = HttpRequest(
+        endpoint,
+        lambda response, content: json.loads(content),
+        UPLOAD_URL,
+        method='POST',
+        body=json.dumps({'snippet': {'title': 'test'}}),
+        headers={'content-type': 'application/json'},
+        resumable=media
+    )
+    return engine.run(request, progress_callback=progress)
+
+
+def engine(**kwargs):
+    settings = {'min_chunk_size': 256 * KB, 'max_chunk_size': 8 * MB, 'target_chunk_seconds': 1,
+                'max_retries': 3}
+    settings.update(kwargs)
+    return ResumableUploadEngine(**settings)
+
+
+def test_uploads_every_byte_and_reports_progress(clock, video):
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB)
+    progress = []
+    response = upload(endpoint, video, engine(), progress=lambda sent, total: progress.append((sent, total)))
+
+    assert response == {'id': 'video-1'}
+    assert bytes(endpoint.received) == video.read_bytes()
+    assert progress == sorted(progress)
+    assert all(total == video.stat().st_size for _, total in progress)
+
+
+def test_chunk_size_follows_throughput(clock, video):
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB)
+    upload(endpoint, video, engine())
+
+    sizes = [length for _, length in endpoint.chunks]
+    assert sizes[0] == 256 * KB
+    # About one second of transfer per chunk, aligned to 256KB
+    assert sizes[1:3] == [2 * MB, 2 * MB]
+    assert all(size % CHUNK_ALIGNMENT == 0 for size in sizes[:-1])
+
+
+def test_chunk_size_stays_within_limits(clock, video):
+    fast = FakeResumableEndpoint(clock, bandwidth=100 * MB)
+    upload(fast, video, engine(max_chunk_size=4 * MB))
+    assert max(length for _, length in fast.chunks) == 4 * MB
+
+    slow = FakeResumableEndpoint(clock, bandwidth=64 * KB)
+    upload(slow, video, engine(min_chunk_size=512 * KB), chunksize=512 * KB)
+    assert min(length for _, length in slow.chunks[:-1]) == 512 * KB
+
+
+def test_resumes_from_the_range_the_server_reports(clock, video):
+    # The server keeps only 100KB of the second chunk and says so in its 308
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB, failures={2: ('partial', 100 * KB)})
+    upload(endpoint, video, engine())
+
+    assert endpoint.chunks[2][0] == endpoint.chunks[1][0] + 100 * KB
+    assert bytes(endpoint.received) == video.read_bytes()
+
+
+@pytest.mark.parametrize('status', [500, 503, 429])
+def test_retries_transient_errors_after_asking_for_the_offset(clock, video, status):
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB, failures={2: ('status', status), 3: ('status', status)})
+    response = upload(endpoint, video, engine())
+
+    assert response == {'id': 'video-1'}
+    assert endpoint.status_queries == 2
+    assert bytes(endpoint.received) == video.read_bytes()
+
+
+def test_gives_up_after_max_retries(clock, video):
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB, failures={n: ('status', 503) for n in range(2, 10)})
+    with pytest.raises(HttpError) as error:
+        upload(endpoint, video, engine(max_retries=2))
+    assert error.value.resp.status == 503
+
+
+def test_does_not_retry_client_errors(clock, video):
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB, failures={1: ('status', 400)})
+    with pytest.raises(HttpError):
+        upload(endpoint, video, engine())
+    assert len(endpoint.chunks) == 1
+
+
+def test_backoff_grows_exponentially(clock, video, monkeypatch):
+    delays = []
+    caller = threading.current_thread()
+
+    def sleep(seconds):
+        # time.sleep is patched process-wide; ignore other tests' background threads
+        if threading.current_thread() is caller:
+            delays.append(seconds)
+
+    monkeypatch.setattr(upload_engine.time, 'sleep', sleep)
+    monkeypatch.setattr(upload_engine.random, 'random', lambda: 1.0)
+    monkeypatch.setattr(Config, 'UPLOAD_BACKOFF_BASE', 1)
+    monkeypatch.setattr(Config, 'UPLOAD_BACKOFF_MAX', 3)
+    endpoint = FakeResumableEndpoint(clock, bandwidth=2 * MB, failures={n: ('status', 503) for n in range(2, 5)})
+    upload(endpoint, video, engine())
+    assert delays == [1, 2, 3]
@@ -0,0 +1,64 @@
+import io
+import os
+import pytest
+from upload_receiver import UploadReceiver, UnsupportedMediaTypeError
+
+MP4 = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom' + b'\0' * 8192
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    return UploadReceiver(upload_folder=str(tmp_path), chunk_size=1024)
+
+
+def multipart(filename, data, boundary='xyz'):
+    return (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"video\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    )
+
+
+def test_receives_a_raw_body(receiver):
+    path, content_hash, name = receiver.receive(io.BytesIO(MP4), 'video/mp4', filename='clip.mp4')
+    assert path.endswith('.mp4') and name == 'clip.mp4' and content_hash
+    with open(path, 'rb') as f:
+        assert f.read() == MP4
+
+
+def test_receives_the_file_part_of_a_form(receiver):
+    path, _, name = receiver.receive(io.BytesIO(multipart('clip.mp4', MP4)), 'multipart/form-data; boundary=xyz')
+    assert name == 'clip.mp4'
+    with open(path, 'rb') as f:
+        assert f.read() == MP4
+
+
+def test_rejects_other_types_as_unsupported(receiver, tmp_path):
+    with pytest.raises(UnsupportedMediaTypeError):
+        receiver.receive(io.BytesIO(b'%PDF-1.4\n' + b'x' * 4096), 'application/pdf')
+    with pytest.raises(UnsupportedMediaTypeError):
+        receiver.receive(io.BytesIO(MP4), 'video/mp4', filename='clip.exe')
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('body, content_type', [
+    (b'', 'video/mp4'),
+    (b'--xyz--\r\n', 'multipart/form-data; boundary=xyz'),
+    (multipart('clip.mp4', MP4), 'multipart/form-data'),
+])
+def test_malformed_requests_are_not_type_errors(receiver, body, content_type):
+    with pytest.raises(ValueError) as error:
+        receiver.receive(io.BytesIO(body), content_type)
+    assert not isinstance(error.value, UnsupportedMediaTypeError)
+
+
+def test_upload_endpoint_status_codes(monkeypatch, receiver):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'upload_receiver', receiver)
+    monkeypatch.setattr(app_module.process_upload_job, 'delay', lambda *args: None)
+    client = app_module.app.test_client()
+
+    assert client.post('/upload', data=b'', content_type='video/mp4').status_code == 400
+    assert client.post('/upload', data=b'x', content_type='multipart/form-data').status_code == 400
+    assert client.post('/upload', data=b'%PDF-1.4\n' + b'x' * 4096, content_type='application/pdf').status_code == 415
+    response = client.post('/upload?filename=clip.mp4', data=MP4, content_type='video/mp4')
+    assert response.status_code == 202
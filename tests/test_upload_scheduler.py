@@ -0,0 +1,79 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import pytest
+import upload_scheduler
+from upload_scheduler import QuotaBucket
+
+PACIFIC = ZoneInfo('America/Los_Angeles')
+
+
+class FakeTime:
+    """Stand-in for the time module with a wall clock set by the test"""
+
+    def __init__(self, when: datetime):
+        self.now = when.timestamp()
+        self.monotonic = time.monotonic
+        self.sleep = time.sleep
+
+    def time(self):
+        return self.now
+
+    def set(self, when: datetime):
+        self.now = when.timestamp()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime(datetime(2026, 6, 1, 9, 0, tzinfo=PACIFIC))
+    monkeypatch.setattr(upload_scheduler, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def bucket(tmp_path, clock):
+    return QuotaBucket(db_path=str(tmp_path / 'quota.db'), capacity=3200, timezone='America/Los_Angeles')
+
+
+def test_quota_resets_at_midnight_pacific_not_gradually(bucket, clock):
+    assert bucket.try_acquire(1600) == 0
+    assert bucket.try_acquire(1600) == 0
+    # 15 hours until midnight in Los Angeles
+    assert bucket.try_acquire(1600) == 15 * 60 * 60
+
+    # Nothing comes back during the day
+    clock.set(datetime(2026, 6, 1, 23, 59, tzinfo=PACIFIC))
+    assert bucket.available() == 0
+    assert bucket.try_acquire(50) == 60
+
+    # Midnight UTC is still the same quota day
+    clock.set(datetime(2026, 6, 2, 0, 30, tzinfo=ZoneInfo('UTC')))
+    assert bucket.available() == 0
+
+    clock.set(datetime(2026, 6, 2, 0, 0, 1, tzinfo=PACIFIC))
+    assert bucket.available() == 3200
+    assert bucket.try_acquire(1600) == 0
+
+
+def test_drained_bucket_stays_empty_until_the_reset(bucket, clock):
+    bucket.drain()
+    clock.set(datetime(2026, 6, 1, 20, 0, tzinfo=PACIFIC))
+    assert bucket.try_acquire(1) == 4 * 60 * 60
+    clock.set(datetime(2026, 6, 2, 8, 0, tzinfo=PACIFIC))
+    assert bucket.available() == 3200
+
+
+def test_processes_share_the_bucket(bucket):
+    other = QuotaBucket(db_path=bucket.db_path, capacity=3200, timezone='America/Los_Angeles')
+    assert bucket.try_acquire(1600) == 0
+    assert other.try_acquire(1600) == 0
+    assert bucket.try_acquire(1600) > 0 and other.try_acquire(1600) > 0
+
+
+def test_reset_time_follows_daylight_saving(bucket, clock):
+    # The clocks go forward on 8 March 2026: that quota day is 23 hours long
+    clock.set(datetime(2026, 3, 8, 0, 0, tzinfo=PACIFIC))
+    assert bucket.seconds_until_reset() == 23 * 60 * 60
+    # And back on 1 November: 25 hours
+    clock.set(datetime(2026, 11, 1, 0, 0, tzinfo=PACIFIC))
+    assert bucket.seconds_until_reset() == 25 * 60 * 60
@@ -0,0 +1,265 @@
+import os
+import time
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from video_downloader import VideoDownloader
+from content_hash import BLOCK_SIZE, hash_file
+from config import Config
+
+KB = 1024
+MB = 1024 * 1024
+MP4_HEAD = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    downloader = VideoDownloader()
+    downloader.upload_folder = str(tmp_path)
+    downloader.cache = None
+    return downloader
+
+
+class FakeStreamResponse:
+    """Streamed response producing `size` bytes in fresh chunks, like requests does"""
+
+    def __init__(self, size: int, chunk: int):
+        self.size = size
+        self.chunk = chunk
+        self.headers = {'Content-Length': str(size)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        template = MP4_HEAD + bytes(range(256)) * (self.chunk // 256)
+        template = template[:self.chunk]
+        for _ in range(self.size // self.chunk):
+            yield bytes(memoryview(template))
+
+
+def test_streaming_a_large_download_keeps_memory_bounded(downloader):
+    size = 1024 * MB
+    reports = []
+    tracemalloc.start()
+    try:
+        path = downloader._stream_to_file(
+            FakeStreamResponse(size, MB), 'video_large', lambda path, done, total: reports.append(done)
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert os.path.getsize(path) == size
+    # About one chunk plus the write buffer, whatever the size of the file
+    assert peak < downloader.chunk_size + downloader.buffer_size + 4 * MB
+    # Progress (and a flush) once per write buffer, not per chunk
+    assert len(reports) == size // downloader.buffer_size + 1
+    assert reports[-1] == size
+
+
+class RangeServer:
+    """
+    Local HTTP server for one file, with byte-range support
+
+    Records the Range header of every request. truncate maps a range start
+    to a byte count: the first request for that range sends only that many
+    bytes of its body and drops the connection. missing maps a path to the
+    seconds to wait before answering it with 404, and throttle slows every
+    body down to one MB per that many seconds.
+    """
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.ranges = []
+        self.truncate = {}
+        self.missing = {}
+        self.throttle = 0
+        self.served = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path in server.missing:
+                    time.sleep(server.missing[self.path])
+                    self.send_error(404)
+                    return
+                header = self.headers.get('Range')
+                server.ranges.append(header)
+                start, end = 0, len(server.payload) - 1
+                if header:
+                    first, last = header[len('bytes='):].split('-')
+                    start, end = int(first), int(last or end)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{len(server.payload)}")
+                else:
+                    self.send_response(200)
+                body = server.payload[start:end + 1]
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                cut = server.truncate.pop(start, None) if header else None
+                if cut is not None:
+                    self.wfile.write(body[:cut])
+                    self.close_connection = True
+                    return
+                try:
+                    step = MB if server.throttle else len(body)
+                    for offset in range(0, len(body), step):
+                        self.wfile.write(body[offset:offset + step])
+                        server.served += len(body[offset:offset + step])
+                        time.sleep(server.throttle)
+                except ConnectionError:
+                    # The client stops reading the initial response after the first segment
+                    self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.url = f"{self.base_url}/video.mp4"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def payload():
+    return MP4_HEAD + os.urandom(20 * MB - len(MP4_HEAD))
+
+
+@pytest.fixture
+def server(payload):
+    server = RangeServer(payload)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def ranged_downloader(downloader):
+    downloader.connections = 4
+    downloader.min_segment_size = BLOCK_SIZE
+    return downloader
+
+
+def test_split_range_makes_block_aligned_segments_covering_the_range(ranged_downloader):
+    segments = ranged_downloader._split_range(0, 20 * MB - 1)
+    assert segments == [(0, 8 * MB - 1), (8 * MB, 16 * MB - 1), (16 * MB, 20 * MB - 1)]
+
+    # A resumed range starts on a block boundary and is split the same way
+    segments = ranged_downloader._split_range(BLOCK_SIZE, 64 * MB - 1)
+    assert len(segments) == ranged_downloader.connections
+    assert segments[0][0] == BLOCK_SIZE and segments[-1][1] == 64 * MB - 1
+    assert all(start % BLOCK_SIZE == 0 for start, _ in segments)
+    assert all(a_end + 1 == b_start for (_, a_end), (b_start, _) in zip(segments, segments[1:]))
+
+    # Too short to be worth another connection
+    assert ranged_downloader._split_range(0, BLOCK_SIZE - 1) == [(0, BLOCK_SIZE - 1)]
+
+
+def test_ranged_download_fetches_segments_in_parallel(ranged_downloader, server, payload):
+    path = ranged_downloader.download_video(server.url)
+
+    assert open(path, 'rb').read() == payload
+    # The first segment comes from the initial response, the others over their own connections
+    assert set(filter(None, server.ranges)) == {f"bytes={8 * MB}-{16 * MB - 1}", f"bytes={16 * MB}-{20 * MB - 1}"}
+    assert ranged_downloader.content_hash(path) == hash_file(path)
+    assert not [name for name in os.listdir(ranged_downloader.upload_folder) if '.part' in name]
+
+
+def test_short_segment_is_resumed_from_its_last_complete_block(ranged_downloader, server, payload):
+    # The middle segment stops 1MB into its second block
+    server.truncate[8 * MB] = BLOCK_SIZE + MB
+    with pytest.raises(ValueError):
+        ranged_downloader.download_video(server.url)
+    partials = [name for name in os.listdir(ranged_downloader.upload_folder) if name.endswith('.part')]
+    assert len(partials) == 1
+
+    server.ranges.clear()
+    path = ranged_downloader.download_video(server.url)
+
+    # Only the block that was cut short is fetched again
+    assert server.ranges == [None, f"bytes={12 * MB}-{16 * MB - 1}"]
+    assert open(path, 'rb').read() == payload
+    assert ranged_downloader.content_hash(path) == hash_file(path)
+
+
+def make_partial(folder, name: str, age: float):
+    path = os.path.join(folder, f"{name}.part")
+    with open(path, 'wb') as f:
+        f.write(b'\0' * KB)
+    with open(f"{path}.json", 'w') as f:
+        f.write('{}')
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_cleanup_removes_only_idle_stale_partials(downloader):
+    folder = downloader.upload_folder
+    stale = make_partial(folder, 'video_aaaaaaaaaaaaaaaa', Config.DOWNLOAD_PARTIAL_MAX_AGE + 60)
+    recent = make_partial(folder, 'video_bbbbbbbbbbbbbbbb', 60)
+    locked = make_partial(folder, 'video_cccccccccccccccc', Config.DOWNLOAD_PARTIAL_MAX_AGE + 60)
+    orphan = os.path.join(folder, 'video_dddddddddddddddd.part.json')
+    open(orphan, 'w').close()
+
+    with downloader._url_lock('video_cccccccccccccccc') as held:
+        assert held
+        downloader.cleanup_stale_partials()
+
+    assert not os.path.exists(stale) and not os.path.exists(f"{stale}.json")
+    assert not os.path.exists(orphan)
+    assert os.path.exists(recent) and os.path.exists(f"{recent}.json")
+    assert os.path.exists(locked) and os.path.exists(f"{locked}.json")
+
+
+def test_failed_youtube_stream_stops_its_sibling(ranged_downloader, server, payload, monkeypatch):
+    # The audio stream fails while the 20MB video stream is still coming in
+    server.throttle = 0.1
+    server.missing['/audio.m4a'] = 0.3
+    streams = {
+        'video': {'url': server.url, 'description': 'video', 'subtype': 'mp4'},
+        'audio': {'url': f"{server.base_url}/audio.m4a", 'description': 'audio', 'subtype': 'mp4'}
+    }
+    monkeypatch.setattr(ranged_downloader.youtube_streams, 'resolve', lambda url, adaptive, refresh: streams)
+
+    started = time.monotonic()
+    with pytest.raises(requests.HTTPError) as error:
+        ranged_downloader._download_youtube_streams('https://youtu.be/x', 'video_eeeeeeeeeeeeeeee', adaptive=True)
+    elapsed = time.monotonic() - started
+
+    # The audio stream's own error, raised as soon as the video stream noticed
+    assert error.value.response.status_code == 404
+    assert elapsed < 1.5
+    assert server.served < len(payload)
+    # The video stream's partial file and journal are gone
+    assert os.listdir(ranged_downloader.upload_folder) == []
+
+
+def test_caller_cancel_stops_both_youtube_streams(ranged_downloader, server, monkeypatch):
+    server.throttle = 0.1
+    streams = {
+        'video': {'url': server.url, 'description': 'video', 'subtype': 'mp4'},
+        'audio': {'url': server.url, 'description': 'audio', 'subtype': 'mp4'}
+    }
+    monkeypatch.setattr(ranged_downloader.youtube_streams, 'resolve', lambda url, adaptive, refresh: streams)
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+
+    with pytest.raises(ValueError, match='cancelled'):
+        ranged_downloader._download_youtube_streams(
+            'https://youtu.be/x', 'video_ffffffffffffffff', adaptive=True, cancel=cancel
+        )
+    assert os.listdir(ranged_downloader.upload_folder) == []
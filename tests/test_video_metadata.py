@@ -0,0 +1,126 @@
+import random
+import struct
+from datetime import datetime, timezone
+import pytest
+from video_metadata import read_metadata
+
+CREATED = datetime(2024, 5, 17, 12, 30, tzinfo=timezone.utc)
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+
+
+def box(box_type, *children):
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def mvhd(created, timescale, duration):
+    return full_box(b'mvhd', struct.pack('>IIII', created, created, timescale, duration) + b'\0' * 80)
+
+
+def track(handler, codec, width=0, height=0):
+    tkhd = full_box(b'tkhd', b'\0' * 72 + struct.pack('>II', width << 16, height << 16))
+    hdlr = full_box(b'hdlr', b'\0' * 4 + handler + b'\0' * 13)
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + box(codec, b'\0' * 8))
+    return box(b'trak', tkhd, box(b'mdia', hdlr, box(b'minf', box(b'stbl', stsd))))
+
+
+def mp4(title='Beach day'):
+    created = int((CREATED - MP4_EPOCH).total_seconds())
+    ilst = box(b'ilst', box(b'\xa9nam', full_box(b'data', b'\0' * 4 + title.encode())))
+    moov = box(
+        b'moov',
+        mvhd(created, 1000, 93500),
+        track(b'vide', b'avc1', 1920, 1080),
+        track(b'soun', b'mp4a'),
+        box(b'udta', full_box(b'meta', full_box(b'hdlr', b'\0' * 4 + b'mdir' + b'\0' * 13) + ilst))
+    )
+    return box(b'ftyp', b'isom\0\0\0\0isomavc1') + moov + box(b'mdat', b'\0' * 4096)
+
+
+@pytest.fixture
+def video(tmp_path):
+    def write(data, name='video.mp4'):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_reads_the_moov_headers(video):
+    assert read_metadata(video(mp4())) == {
+        'created': CREATED,
+        'duration': 93.5,
+        'width': 1920,
+        'height': 1080,
+        'video_codec': 'H.264',
+        'audio_codec': 'AAC',
+        'title': 'Beach day'
+    }
+
+
+def test_moov_after_mdat_is_found(video):
+    data = mp4()
+    ftyp_size = struct.unpack_from('>I', data)[0]
+    moov_size = struct.unpack_from('>I', data, ftyp_size)[0]
+    ftyp, moov, mdat = data[:ftyp_size], data[ftyp_size:ftyp_size + moov_size], data[ftyp_size + moov_size:]
+    assert read_metadata(video(ftyp + mdat + moov))['duration'] == 93.5
+
+
+def test_large_mdat_is_stepped_over(video):
+    # A 64-bit size far beyond the file ends the box walk instead of reading past the end
+    data = box(b'ftyp', b'isom') + struct.pack('>I4sQ', 1, b'mdat', 1 << 40) + b'\0' * 64
+    assert read_metadata(video(data)) == {}
+
+
+def test_truncated_files_do_not_raise(video):
+    data = mp4()
+    for length in range(len(data)):
+        assert isinstance(read_metadata(video(data[:length])), dict)
+    # Cut inside the moov box: the box no longer fits, so nothing is read from it
+    assert read_metadata(video(data[:len(data) - 4200])) == {}
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'%PDF-1.4\n' + b'x' * 4096,
+    b'RIFF\x00\x10\x00\x00AVI LIST',
+    b'plain text that is not a video at all',
+])
+def test_other_files_have_no_metadata(video, data):
+    assert read_metadata(video(data, name='video.bin')) == {}
+
+
+def test_missing_file_has_no_metadata(tmp_path):
+    assert read_metadata(str(tmp_path / 'missing.mp4')) == {}
+
+
+def test_impossible_dates_do_not_raise(video):
+    far = 1 << 63
+    mvhd_v1 = full_box(b'mvhd', struct.pack('>QQIQ', far, far, 1, far) + b'\0' * 80, version=1)
+    assert read_metadata(video(box(b'ftyp', b'isom') + box(b'moov', mvhd_v1))) == {}
+
+
+def test_zero_timescale_has_no_duration(video):
+    metadata = read_metadata(video(box(b'ftyp', b'isom') + box(b'moov', mvhd(3000000000, 0, 100))))
+    assert 'duration' not in metadata and metadata['created']
+
+
+def test_endlessly_nested_boxes_do_not_raise(video):
+    nested = box(b'mdat')
+    for _ in range(5000):
+        nested = box(b'trak', nested)
+    assert read_metadata(video(box(b'ftyp', b'isom') + box(b'moov', nested))) == {}
+
+
+def test_corrupted_bytes_do_not_raise(video):
+    data = bytearray(mp4())
+    rng = random.Random(1)
+    for _ in range(300):
+        corrupted = bytearray(data)
+        for _ in range(rng.randint(1, 8)):
+            corrupted[rng.randrange(len(corrupted))] = rng.randrange(256)
+        assert isinstance(read_metadata(video(bytes(corrupted))), dict)
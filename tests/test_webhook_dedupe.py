@@ -0,0 +1,48 @@
+import time
+import pytest
+from webhook_dedupe import WebhookDeduplicator
+from config import Config
+
+SENDER = '+15551234567'
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """Two web workers' deduplicators sharing one SQLite store"""
+    monkeypatch.setattr(Config, 'WEBHOOK_DEDUPE_DB', str(tmp_path / 'webhooks.db'))
+    monkeypatch.setattr(Config, 'WEBHOOK_IDEMPOTENCY_TTL', 0.5)
+    monkeypatch.setattr(Config, 'WEBHOOK_DEDUPE_WINDOW', 0.5)
+    return WebhookDeduplicator(shared=True), WebhookDeduplicator(shared=True)
+
+
+def test_a_retried_delivery_is_claimed_by_one_worker_only(workers):
+    first, second = workers
+    assert first.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    # Twilio's retry of the same message lands on the other worker
+    assert not second.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    # The same link pasted again, in another form, under a new MessageSid
+    assert not second.claim('SM2', SENDER, 'https://www.youtube.com/watch?v=abcdefghijk')
+    # A new link from the same sender is not a duplicate
+    assert second.claim('SM3', SENDER, 'https://youtu.be/zyxwvutsrqp')
+
+
+def test_claims_expire_after_their_ttl(workers):
+    first, second = workers
+    assert first.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    assert not second.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    time.sleep(0.6)
+    assert second.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+
+
+def test_released_claims_can_be_taken_by_another_worker(workers):
+    first, second = workers
+    assert first.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    first.release('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    assert second.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+
+
+def test_without_the_shared_store_workers_do_not_see_each_other(workers):
+    first, second = WebhookDeduplicator(shared=False), WebhookDeduplicator(shared=False)
+    assert first.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    assert second.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
+    assert not first.claim('SM1', SENDER, 'https://youtu.be/abcdefghijk')
@@ -0,0 +1,178 @@
+import os
+import shutil
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from video_metadata import read_metadata
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# Candidates are scored on small grayscale copies
+SCORE_WIDTH = 160
+SCORE_HEIGHT = 90
+
+# YouTube recommends 1280x720 thumbnails
+THUMBNAIL_MAX_WIDTH = 1280
+
+def extract_thumbnail(video_path: str, output_path: str, ffmpeg_path: str, candidates: int,
+                      timeout: float) -> str:
+    """
+    Pick the best keyframe of a video and save it as a JPEG
+
+    One ffmpeg process per candidate seeks to a point spread evenly over
+    the video and decodes only the next keyframe (-skip_frame nokey), so no
+    process reads more than a GOP. Each writes a full-size JPEG and a small
+    grayscale copy; the copies are scored together for sharpness (variance
+    of the Laplacian) and exposure, and only the best JPEG is kept. Runs in
+    a worker process.
+
+    Args:
+        video_path (str): Video to take the thumbnail from
+        output_path (str): Where to write the JPEG
+        ffmpeg_path (str): ffmpeg executable
+        candidates (int): Number of keyframes to compare
+        timeout (float): Seconds to wait for ffmpeg
+
+    Returns:
+        str: output_path, or None if no frame could be decoded
+    """
+    duration = read_metadata(video_path).get('duration')
+    if duration:
+        timestamps = [duration * (i + 1) / (candidates + 1) for i in range(candidates)]
+    else:
+        timestamps = [0]
+
+    stem = os.path.splitext(output_path)[0]
+    jobs = []
+    for i, timestamp in enumerate(timestamps):
+        candidate_path = f"{stem}.{i}.jpg"
+        process = subprocess.Popen(
+            [
+                ffmpeg_path, '-y', '-loglevel', 'error',
+                '-skip_frame', 'nokey', '-ss', f"{timestamp:.3f}", '-i', video_path,
+                '-filter_complex',
+                f"[0:v:0]split=2[score][thumb];"
+                f"[score]scale={SCORE_WIDTH}:{SCORE_HEIGHT},format=gray[small];"
+                f"[thumb]scale='min({THUMBNAIL_MAX_WIDTH},iw)':-2[large]",
+                '-map', '[small]', '-frames:v', '1', '-f', 'rawvideo', 'pipe:1',
+                '-map', '[large]', '-frames:v', '1', '-q:v', '2', candidate_path
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        jobs.append((process, candidate_path))
+
+    frames, paths = [], []
+    try:
+        for process, candidate_path in jobs:
+            try:
+                raw, _ = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                continue
+            if len(raw) == SCORE_WIDTH * SCORE_HEIGHT and os.path.exists(candidate_path):
+                frames.append(np.frombuffer(raw, dtype=np.uint8).reshape(SCORE_HEIGHT, SCORE_WIDTH))
+                paths.append(candidate_path)
+
+        if not frames:
+            return None
+        best = int(np.argmax(score_frames(np.stack(frames))))
+        os.replace(paths[best], output_path)
+        return output_path
+    finally:
+        for _, candidate_path in jobs:
+            if os.path.exists(candidate_path):
+                os.remove(candidate_path)
+
+
+def score_frames(frames: np.ndarray) -> np.ndarray:
+    """
+    Score grayscale frames as thumbnails
+
+    Args:
+        frames (np.ndarray): uint8 array of shape (frames, height, width)
+
+    Returns:
+        np.ndarray: One score per frame; higher is better
+    """
+    pixels = frames.astype(np.float32)
+    laplacian = (
+        4 * pixels[:, 1:-1, 1:-1]
+        - pixels[:, :-2, 1:-1] - pixels[:, 2:, 1:-1]
+        - pixels[:, 1:-1, :-2] - pixels[:, 1:-1, 2:]
+    )
+    sharpness = np.log1p(laplacian.var(axis=(1, 2)))
+    brightness = pixels.mean(axis=(1, 2))
+    contrast = pixels.std(axis=(1, 2))
+    # Best at mid-gray, zero for black or white frames
+    exposure = 1 - np.abs(brightness - 128) / 128
+    # Fades and title cards are nearly flat
+    flat = contrast < 12
+    return sharpness * exposure * np.where(flat, 0.1, 1.0)
+
+
+class ThumbnailExtractor:
+    """
+    Extract thumbnails in worker processes while the video uploads
+
+    Decoding and scoring are CPU-bound, so they run in a process pool
+    rather than next to the upload threads. The pool is created on first
+    use in each process; its workers are spawned rather than forked, as
+    the web and Celery processes run threads.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or Config.THUMBNAIL_WORKERS
+        self.ffmpeg_path = shutil.which(Config.FFMPEG_PATH)
+        self.enabled = Config.THUMBNAIL_ENABLED and self.ffmpeg_path is not None
+        if Config.THUMBNAIL_ENABLED and not self.ffmpeg_path:
+            logger.warning(f"{Config.FFMPEG_PATH} not found, videos are uploaded without custom thumbnails")
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, video_path: str):
+        """
+        Start extracting a thumbnail for a video
+
+        Args:
+            video_path (str): Complete video file; it must stay in place until
+                the future is done
+
+        Returns:
+            Future: Resolves to the JPEG path or None, or None if thumbnails
+                are disabled
+        """
+        if not self.enabled:
+            return None
+        output_path = f"{os.path.splitext(video_path)[0]}.thumb.jpg"
+        try:
+            return self._get_pool().submit(
+                extract_thumbnail,
+                video_path,
+                output_path,
+                self.ffmpeg_path,
+                Config.THUMBNAIL_CANDIDATES,
+                Config.THUMBNAIL_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Could not start thumbnail extraction: {str(e)}")
+            # A pool whose worker died stays broken; start a new one next time
+            with self._lock:
+                self._pool = None
+            return None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+            return self._pool
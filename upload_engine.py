@@ -0,0 +1,115 @@
+import time
+import random
+import socket
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+from metrics import metrics
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# Resumable upload chunks must be a multiple of 256KB (except the last one)
+CHUNK_ALIGNMENT = 256 * 1024
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_EXCEPTIONS = (ConnectionError, socket.timeout, httplib2.HttpLib2Error)
+
+class AdaptiveMediaFileUpload(MediaFileUpload):
+    """MediaFileUpload whose chunk size can change between chunk requests"""
+
+    def set_chunksize(self, chunksize: int):
+        self._chunksize = chunksize
+
+
+class ResumableUploadEngine:
+    """
+    Drive a resumable upload request to completion
+
+    Chunk size follows measured throughput so each request takes roughly
+    UPLOAD_TARGET_CHUNK_SECONDS, which keeps high-latency links busy without
+    making a failed chunk expensive. Transient failures are retried with
+    exponential backoff; googleapiclient then asks the server how many bytes
+    it holds and the upload continues from that offset.
+    """
+
+    def __init__(self, min_chunk_size: int = None, max_chunk_size: int = None,
+                 target_chunk_seconds: float = None, max_retries: int = None):
+        self.min_chunk_size = self._align(min_chunk_size or Config.UPLOAD_MIN_CHUNK_SIZE)
+        self.max_chunk_size = self._align(max_chunk_size or Config.UPLOAD_MAX_CHUNK_SIZE)
+        self.target_chunk_seconds = target_chunk_seconds or Config.UPLOAD_TARGET_CHUNK_SECONDS
+        self.max_retries = max_retries if max_retries is not None else Config.UPLOAD_MAX_RETRIES
+
+    def run(self, request, progress_callback=None) -> dict:
+        """
+        Upload every chunk of a resumable request
+
+        Args:
+            request (HttpRequest): Request built with a resumable media body
+            progress_callback (callable, optional): Called as
+                progress_callback(bytes_sent, total_size) after each chunk
+
+        Returns:
+            dict: The API response for the completed upload
+
+        Raises:
+            HttpError: If the server rejects the upload or retries run out
+        """
+        media = request.resumable
+        throughput = None
+        retries = 0
+        response = None
+
+        while response is None:
+            sent_before = request.resumable_progress
+            started = time.monotonic()
+            try:
+                status, response = request.next_chunk()
+            except HttpError as e:
+                if e.resp.status not in RETRYABLE_STATUS_CODES:
+                    raise
+                retries = self._backoff(retries, f"HTTP {e.resp.status}", e)
+                continue
+            except RETRYABLE_EXCEPTIONS as e:
+                retries = self._backoff(retries, type(e).__name__, e)
+                continue
+
+            retries = 0
+            elapsed = time.monotonic() - started
+            sent = request.resumable_progress - sent_before
+            metrics.observe_transfer('upload', sent, elapsed)
+            if status and sent > 0 and elapsed > 0:
+                # Exponentially weighted so one slow chunk does not halve the next
+                sample = sent / elapsed
+                throughput = sample if throughput is None else 0.5 * throughput + 0.5 * sample
+                self._resize(media, throughput)
+
+            if status and progress_callback:
+                progress_callback(status.resumable_progress, status.total_size)
+
+        return response
+
+    def _resize(self, media, throughput: float):
+        """Pick the next chunk size from measured throughput in bytes/second"""
+        if not hasattr(media, 'set_chunksize'):
+            return
+        chunksize = self._align(int(throughput * self.target_chunk_seconds))
+        chunksize = max(self.min_chunk_size, min(self.max_chunk_size, chunksize))
+        if chunksize != media.chunksize():
+            logger.debug(f"Upload chunk size {media.chunksize()} -> {chunksize} bytes")
+            media.set_chunksize(chunksize)
+
+    def _backoff(self, retries: int, reason: str, error: Exception) -> int:
+        """Sleep before the next attempt, re-raising once retries are exhausted"""
+        if retries >= self.max_retries:
+            raise error
+        delay = min(Config.UPLOAD_BACKOFF_MAX, Config.UPLOAD_BACKOFF_BASE * 2 ** retries)
+        delay = delay * (0.5 + random.random() / 2)
+        logger.warning(f"Upload chunk failed ({reason}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        return retries + 1
+
+    @staticmethod
+    def _align(size: int) -> int:
+        return max(CHUNK_ALIGNMENT, size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
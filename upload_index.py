@@ -0,0 +1,81 @@
+import os
+import time
+import sqlite3
+from contextlib import closing
+from download_cache import DownloadCache
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+class UploadIndex:
+    """
+    Persistent record of videos already uploaded to YouTube
+
+    Maps both the canonical source URL and the content hash of each upload
+    to its YouTube video ID, so a repeat submission can be answered without
+    spending API quota on another insert.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or Config.UPLOAD_INDEX_DB
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                'content_hash TEXT NOT NULL, source_url TEXT NOT NULL, '
+                'video_id TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS uploads_hash ON uploads (content_hash)')
+            conn.execute('CREATE INDEX IF NOT EXISTS uploads_url ON uploads (source_url)')
+
+    def find_by_url(self, url: str) -> str:
+        """
+        Look up a previous upload by source URL
+
+        Args:
+            url (str): Source URL of the video
+
+        Returns:
+            str: YouTube video ID, or None if the URL has not been uploaded
+        """
+        return self._find('source_url', DownloadCache.canonical_url(url))
+
+    def find_by_hash(self, content_hash: str) -> str:
+        """
+        Look up a previous upload by content hash
+
+        Args:
+            content_hash (str): Content hash of the downloaded file
+
+        Returns:
+            str: YouTube video ID, or None if the content has not been uploaded
+        """
+        return self._find('content_hash', content_hash)
+
+    def record(self, url: str, content_hash: str, video_id: str):
+        """
+        Record a completed upload
+
+        Args:
+            url (str): Source URL of the video
+            content_hash (str): Content hash of the uploaded file
+            video_id (str): YouTube video ID returned by the upload
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT INTO uploads (content_hash, source_url, video_id, created_at) VALUES (?, ?, ?, ?)',
+                (content_hash, DownloadCache.canonical_url(url), video_id, time.time())
+            )
+        logger.info(f"Recorded upload {video_id} for {url}")
+
+    def _find(self, column: str, value: str) -> str:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f'SELECT video_id FROM uploads WHERE {column} = ? ORDER BY created_at DESC LIMIT 1',
+                (value,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
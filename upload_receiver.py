@@ -0,0 +1,196 @@
+import os
+import time
+import uuid
+import magic
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, NeedData, Epilogue
+from werkzeug.utils import secure_filename
+from content_hash import ContentHasher
+from metrics import metrics
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# Enough of the file for libmagic to recognise the container
+SNIFF_SIZE = 2048
+
+VIDEO_EXTENSIONS = {
+    'video/mp4': 'mp4',
+    'video/quicktime': 'mov',
+    'video/x-msvideo': 'avi',
+    'video/x-matroska': 'mkv',
+    'video/webm': 'webm'
+}
+
+class UnsupportedMediaTypeError(ValueError):
+    """Raised when an upload is not one of the allowed video types"""
+
+
+class UploadReceiver:
+    """
+    Write an uploaded video from the request body straight to UPLOAD_FOLDER
+
+    The body is read in UPLOAD_RECEIVE_CHUNK_SIZE pieces into one reused
+    buffer and written to disk as it arrives, so neither Werkzeug's form
+    parser nor a temporary file ever holds the whole video. Multipart
+    bodies are decoded incrementally and only the first file part is kept.
+    The type is checked from the first bytes, before the rest is read, and
+    the content hash is computed along the way so duplicates can be
+    detected without reading the file back.
+    """
+
+    def __init__(self, upload_folder: str = None, chunk_size: int = None):
+        self.upload_folder = upload_folder or Config.UPLOAD_FOLDER
+        self.chunk_size = chunk_size or Config.UPLOAD_RECEIVE_CHUNK_SIZE
+        os.makedirs(self.upload_folder, exist_ok=True)
+
+    def receive(self, stream, content_type: str, filename: str = None) -> tuple:
+        """
+        Save an uploaded video
+
+        Args:
+            stream: Request body, e.g. flask.request.stream
+            content_type (str): Request Content-Type; multipart/form-data
+                bodies are decoded, anything else is taken as the raw file
+            filename (str, optional): Client file name for raw bodies
+
+        Returns:
+            tuple: (path of the saved video, content hash, client file name or None)
+
+        Raises:
+            UnsupportedMediaTypeError: If the file is not a supported video
+            ValueError: If the body holds no file or is malformed
+        """
+        mimetype, _, params = (content_type or '').partition(';')
+        if mimetype.strip().lower() == 'multipart/form-data':
+            boundary = self._boundary(params)
+            filename, chunks = self._multipart_chunks(stream, boundary)
+        else:
+            chunks = self._raw_chunks(stream)
+
+        part_path = os.path.join(self.upload_folder, f"upload_{uuid.uuid4().hex}.part")
+        hasher = ContentHasher()
+        started = time.monotonic()
+        written = 0
+        try:
+            with open(part_path, 'wb', buffering=0) as f:
+                head = bytearray()
+                ext = None
+                for chunk in chunks:
+                    if ext is None:
+                        # Hold back the start until there is enough to check the type
+                        head += chunk
+                        if len(head) < SNIFF_SIZE:
+                            continue
+                        ext = self._check_type(head, filename)
+                        chunk = head
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    written += len(chunk)
+                if ext is None:
+                    if not head:
+                        raise ValueError("No file was uploaded")
+                    ext = self._check_type(head, filename)
+                    f.write(head)
+                    hasher.update(head)
+                    written += len(head)
+
+            video_path = f"{part_path[:-len('.part')]}.{ext}"
+            os.replace(part_path, video_path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        finally:
+            metrics.observe_transfer('receive', written, time.monotonic() - started)
+
+        logger.info(f"Received upload {filename or ''} ({written} bytes) as {video_path}")
+        return video_path, hasher.hexdigest(), filename
+
+    def _raw_chunks(self, stream):
+        """Yield the body in chunks, reusing one buffer (each chunk is only valid until the next)"""
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = stream.readinto(buffer)
+            if not size:
+                return
+            yield view[:size]
+
+    def _multipart_chunks(self, stream, boundary: bytes) -> tuple:
+        """
+        Decode a multipart body up to its first file part
+
+        Returns:
+            tuple: (file name of the part, iterator over the part's data)
+
+        Raises:
+            ValueError: If the body ends before a file part
+        """
+        # Events are drained after every read, so the decoder never buffers much more than one chunk
+        decoder = MultipartDecoder(boundary, max_form_memory_size=2 * self.chunk_size)
+
+        def events():
+            for data in iter(lambda: stream.read(self.chunk_size), b''):
+                decoder.receive_data(data)
+                event = decoder.next_event()
+                while not isinstance(event, NeedData):
+                    yield event
+                    if isinstance(event, Epilogue):
+                        return
+                    event = decoder.next_event()
+            decoder.receive_data(None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                yield event
+                event = decoder.next_event()
+
+        events = events()
+        filename = None
+        for event in events:
+            if isinstance(event, File) and event.filename:
+                filename = event.filename
+                break
+        else:
+            raise ValueError("No file was uploaded")
+
+        def file_data():
+            for event in events:
+                if not isinstance(event, Data):
+                    return
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+        return filename, file_data()
+
+    @staticmethod
+    def _boundary(params: str) -> bytes:
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'boundary' and value:
+                return value.strip('"').encode('latin-1')
+        raise ValueError("Multipart upload without a boundary")
+
+    @staticmethod
+    def _check_type(head: bytes, filename: str = None) -> str:
+        """
+        Check that an upload is a supported video from its first bytes
+
+        Returns:
+            str: File extension for the detected container
+
+        Raises:
+            UnsupportedMediaTypeError: If the content or the file name is not
+                an allowed video type
+        """
+        mime_type = magic.from_buffer(bytes(head[:SNIFF_SIZE]), mime=True)
+        ext = VIDEO_EXTENSIONS.get(mime_type)
+        if ext not in Config.ALLOWED_VIDEO_EXTENSIONS:
+            allowed = ', '.join(sorted(Config.ALLOWED_VIDEO_EXTENSIONS))
+            raise UnsupportedMediaTypeError(f"Unsupported file type {mime_type}; upload a video ({allowed})")
+        name = secure_filename(filename or '')
+        if '.' in name and name.rsplit('.', 1)[1].lower() not in Config.ALLOWED_VIDEO_EXTENSIONS:
+            raise UnsupportedMediaTypeError(f"Unsupported file extension: {name}")
+        return ext
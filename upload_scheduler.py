@@ -0,0 +1,187 @@
+import os
+import time
+import queue
+import sqlite3
+import contextvars
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import Future
+from contextlib import closing
+from youtube_api import YouTubeUploader, QuotaExceededError
+from metrics import metrics
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+class QuotaBucket:
+    """
+    Model of the YouTube Data API daily quota
+
+    The bucket holds YOUTUBE_DAILY_QUOTA units and is refilled in full when
+    the quota day changes, at midnight in YOUTUBE_QUOTA_TIMEZONE (Pacific
+    time, like the quota itself), not gradually. State lives in SQLite so
+    every worker process draws from the same bucket.
+    """
+
+    def __init__(self, db_path: str = None, capacity: int = None, timezone: str = None):
+        self.db_path = db_path or Config.QUOTA_DB
+        self.capacity = capacity or Config.YOUTUBE_DAILY_QUOTA
+        self.timezone = ZoneInfo(timezone or Config.YOUTUBE_QUOTA_TIMEZONE)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                'id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'INSERT OR IGNORE INTO bucket (id, tokens, updated_at) VALUES (1, ?, ?)',
+                (self.capacity, time.time())
+            )
+
+    def try_acquire(self, units: int) -> float:
+        """
+        Take units from the bucket if enough are available
+
+        Args:
+            units (int): Quota units the request will cost
+
+        Returns:
+            float: 0 if the units were taken, otherwise seconds until the
+                quota resets
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            tokens = self._refill(conn)
+            if tokens >= units:
+                conn.execute('UPDATE bucket SET tokens = ? WHERE id = 1', (tokens - units,))
+                conn.commit()
+                return 0
+            conn.commit()
+            return self.seconds_until_reset()
+
+    def acquire(self, units: int):
+        """Block until units can be taken from the bucket"""
+        while True:
+            wait = self.try_acquire(units)
+            if not wait:
+                return
+            logger.info(f"YouTube quota exhausted, deferring upload for {wait:.0f}s")
+            time.sleep(min(wait, 60))
+
+    def drain(self):
+        """Empty the bucket until the quota resets, after the API reported it as exceeded"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE bucket SET tokens = 0, updated_at = ? WHERE id = 1', (time.time(),))
+
+    def available(self) -> float:
+        """Return the units currently in the bucket"""
+        with closing(self._connect()) as conn, conn:
+            return self._refill(conn)
+
+    def seconds_until_reset(self) -> float:
+        """Return the seconds until the next midnight in the quota's time zone"""
+        now = time.time()
+        tomorrow = datetime.fromtimestamp(now, self.timezone).date() + timedelta(days=1)
+        # Via timestamps, so a DST change today is accounted for
+        return datetime.combine(tomorrow, datetime.min.time(), tzinfo=self.timezone).timestamp() - now
+
+    def _quota_day(self, timestamp: float):
+        return datetime.fromtimestamp(timestamp, self.timezone).date()
+
+    def _refill(self, conn) -> float:
+        tokens, updated_at = conn.execute('SELECT tokens, updated_at FROM bucket WHERE id = 1').fetchone()
+        now = time.time()
+        if self._quota_day(now) != self._quota_day(updated_at):
+            tokens = self.capacity
+        conn.execute('UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1', (tokens, now))
+        return tokens
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+
+class UploadScheduler:
+    """
+    Run YouTube uploads concurrently within the API quota
+
+    Each worker thread owns its own YouTubeUploader, and with it its own
+    authorized HTTP connection, since API clients are not thread-safe. Jobs
+    wait in a queue; a worker only starts one after taking its quota cost
+    from the bucket, and a job rejected with a quota error is requeued
+    instead of failed. The quota bucket is shared by every process, but the
+    UPLOAD_CONCURRENCY limit is per process: N web/Celery processes run up
+    to N times as many uploads at once.
+    """
+
+    def __init__(self, concurrency: int = None, quota_bucket: QuotaBucket = None):
+        self.concurrency = concurrency or Config.UPLOAD_CONCURRENCY
+        self.quota_bucket = quota_bucket or QuotaBucket()
+        self._jobs = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, cost: int = None, **kwargs) -> Future:
+        """
+        Queue an upload job
+
+        Args:
+            func (callable): Called as func(uploader, *args, **kwargs) with the
+                worker's YouTubeUploader, e.g. YouTubeUploader.upload_video
+            cost (int, optional): Quota units the job uses; defaults to one insert
+
+        Returns:
+            Future: Resolves to the return value of func
+        """
+        self._start_workers()
+        future = Future()
+        units = cost if cost is not None else Config.YOUTUBE_UPLOAD_QUOTA_COST
+        # The context carries the caller's log fields (job ID, stage) to the worker
+        context = contextvars.copy_context()
+        self._jobs.put((future, func, args, kwargs, units, time.monotonic(), context))
+        logger.info(f"Queued upload job ({self._jobs.qsize()} waiting)")
+        return future
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(
+                    target=self._work,
+                    name=f"upload-worker-{len(self._workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        """Worker loop: one YouTubeUploader (and HTTP connection) per thread"""
+        uploader = YouTubeUploader()
+        while True:
+            future, func, args, kwargs, units, queued_at, context = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self.quota_bucket.acquire(units)
+            metrics.observe('queue_wait_seconds', time.monotonic() - queued_at, queue='upload_scheduler')
+            try:
+                future.set_result(context.run(func, uploader, *args, **kwargs))
+            except QuotaExceededError:
+                logger.warning("YouTube reported quota exceeded, requeueing upload job")
+                self.quota_bucket.drain()
+                self._requeue(future, func, args, kwargs, units, context)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _requeue(self, future, func, args, kwargs, units, context):
+        # The future is already marked running, so wrap it in a fresh one
+        retry = Future()
+        retry.add_done_callback(lambda done: self._copy_result(done, future))
+        self._jobs.put((retry, func, args, kwargs, units, time.monotonic(), context))
+
+    @staticmethod
+    def _copy_result(source: Future, target: Future):
+        if source.exception():
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
@@ -1,23 +1,82 @@
 import os
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+import functools
+import itertools
+import subprocess
 import requests
 import magic
-from urllib.parse import urlparse, parse_qs
-from pytube import YouTube
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from download_journal import DownloadJournal
+from errors import TransientError
+from download_cache import DownloadCache
+from gdrive_resolver import GoogleDriveResolver
+from youtube_streams import YouTubeStreamResolver
+from metrics import metrics
+from content_hash import BLOCK_SIZE, ContentHasher, hash_file
 from logger import setup_logger
 from config import Config
 
 logger = setup_logger(__name__)
 
+class _SiblingCancel(threading.Event):
+    """
+    Cancel flag shared by downloads that are only useful together
+
+    It is set by the first of them to fail, and reads as set whenever the
+    caller's own cancel event is.
+    """
+
+    def __init__(self, parent: threading.Event = None):
+        super().__init__()
+        self.parent = parent
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self.parent is not None and self.parent.is_set())
+
 class VideoDownloader:
     def __init__(self):
         self.upload_folder = Config.UPLOAD_FOLDER
+        self.chunk_size = Config.DOWNLOAD_CHUNK_SIZE
+        self.buffer_size = Config.DOWNLOAD_BUFFER_SIZE
+        self.connections = max(1, Config.DOWNLOAD_CONNECTIONS)
+        self.min_segment_size = Config.DOWNLOAD_MIN_SEGMENT_SIZE
+        self.journal_interval = Config.DOWNLOAD_JOURNAL_INTERVAL
+        self.cache = DownloadCache() if Config.DOWNLOAD_CACHE_ENABLED else None
+        self._content_hashes = {}
+        self._cached_paths = set()
+        self.timeout = (Config.DOWNLOAD_CONNECT_TIMEOUT, Config.DOWNLOAD_READ_TIMEOUT)
+        # Shared by every download in the process so connections are kept alive and reused
+        self.session = self._create_session()
+        self.twilio_session = self._create_session()
+        self.twilio_session.auth = (Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
+        self.gdrive = GoogleDriveResolver(self.session, self.timeout)
+        self.youtube_streams = YouTubeStreamResolver()
+        self.ffmpeg_path = shutil.which(Config.FFMPEG_PATH)
+        if Config.YOUTUBE_ADAPTIVE_ENABLED and not self.ffmpeg_path:
+            logger.warning(f"{Config.FFMPEG_PATH} not found, YouTube downloads are limited to progressive streams")
+        os.makedirs(self.upload_folder, exist_ok=True)
+        self.cleanup_stale_partials()
 
-    def download_video(self, url: str) -> str:
+    def download_video(self, url: str, progress_callback=None, cancel=None) -> str:
         """
         Download video from various sources and return the local file path
         
         Args:
             url (str): URL of the video to download
+            progress_callback (callable, optional): Called as
+                progress_callback(path, available_bytes, total_size) whenever
+                the contiguous prefix of the file on disk grows. total_size is
+                None when the server did not announce it.
+            cancel (threading.Event, optional): Stops the download, and
+                discards its partial file, once set
             
         Returns:
             str: Local path to the downloaded video file
@@ -31,92 +90,672 @@ class VideoDownloader:
             if not parsed_url.scheme or not parsed_url.netloc:
                 raise ValueError("Invalid URL provided")
 
-            # Create unique filename
-            filename = f"video_{os.urandom(8).hex()}"
+            # Key the partial file by URL so an interrupted download can be resumed;
+            # finished files get a name of their own per download (see _output_path)
+            filename = f"video_{hashlib.sha256(url.encode()).hexdigest()[:16]}"
             
-            # Handle different types of URLs
-            if 'youtube.com' in parsed_url.netloc or 'youtu.be' in parsed_url.netloc:
-                return self._download_youtube(url, filename)
-            elif 'drive.google.com' in parsed_url.netloc:
-                return self._download_gdrive(url, filename)
-            else:
-                return self._download_direct(url, filename)
+            # WhatsApp attachments have one-off URLs, so skip the cache and go straight to Twilio
+            if self.is_twilio_media(url):
+                return self._download_twilio_media(url, filename, progress_callback, cancel)
+            
+            # Only one download per URL writes the partial file and journal at a time;
+            # the others wait and are then usually served from the cache
+            with self._url_lock(filename):
+                # Serve repeat requests from the local cache
+                if self.cache:
+                    cached = self.cache.get(url, self.upload_folder)
+                    if cached:
+                        cached_path, content_hash = cached
+                        self._content_hashes[cached_path] = content_hash
+                        self._cached_paths.add(cached_path)
+                        self._report_complete(cached_path, progress_callback)
+                        return cached_path
+                
+                # Handle different types of URLs
+                if 'youtube.com' in parsed_url.netloc or 'youtu.be' in parsed_url.netloc:
+                    video_path = self._download_youtube(url, filename, cancel)
+                    self._report_complete(video_path, progress_callback)
+                elif GoogleDriveResolver.is_drive_url(url):
+                    video_path = self._download_gdrive(url, filename, progress_callback, cancel)
+                else:
+                    video_path = self._download_direct(url, filename, progress_callback, cancel)
+                
+                if self.cache:
+                    try:
+                        self.cache.put(url, video_path, self.content_hash(video_path))
+                    except Exception as e:
+                        logger.warning(f"Could not add {video_path} to download cache: {str(e)}")
+            
+            return video_path
 
         except Exception as e:
             logger.error(f"Error downloading video from {url}: {str(e)}")
-            raise ValueError(f"Failed to download video: {str(e)}")
+            raise self._download_error(f"Failed to download video: {str(e)}", e)
 
-    def _download_youtube(self, url: str, filename: str) -> str:
-        """Download video from YouTube"""
+    def _download_youtube(self, url: str, filename: str, cancel=None) -> str:
+        """
+        Download video from YouTube
+        
+        With YOUTUBE_ADAPTIVE_ENABLED (and ffmpeg available) the best video
+        and audio streams are fetched at the same time and remuxed without
+        re-encoding; otherwise the best progressive stream (up to 720p) is
+        fetched. Streams go through the same ranged downloader as direct
+        links.
+        """
         try:
-            yt = YouTube(url)
-            stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-            if not stream:
-                raise ValueError("No suitable video stream found")
-            
-            output_path = os.path.join(self.upload_folder, f"{filename}.mp4")
-            stream.download(output_path=self.upload_folder, filename=filename)
-            return output_path
+            adaptive = Config.YOUTUBE_ADAPTIVE_ENABLED and self.ffmpeg_path is not None
+            try:
+                return self._download_youtube_streams(url, filename, adaptive, cancel=cancel)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 403:
+                    raise
+                # Cached stream URLs expired early or are bound to another client
+                logger.info("YouTube rejected the stream URLs, extracting them again")
+                return self._download_youtube_streams(url, filename, adaptive, refresh=True, cancel=cancel)
             
         except Exception as e:
             logger.error(f"YouTube download error: {str(e)}")
-            raise ValueError(f"Failed to download YouTube video: {str(e)}")
+            raise self._download_error(f"Failed to download YouTube video: {str(e)}", e)
 
-    def _download_gdrive(self, url: str, filename: str) -> str:
-        """Download video from Google Drive"""
+    def _download_youtube_streams(self, url: str, filename: str, adaptive: bool,
+                                  refresh: bool = False, cancel=None) -> str:
+        streams = self.youtube_streams.resolve(url, adaptive, refresh)
+        if 'progressive' in streams:
+            logger.info(f"Downloading YouTube {streams['progressive']['description']}")
+            return self._fetch_stream(streams['progressive']['url'], filename, cancel)
+        
+        video, audio = streams['video'], streams['audio']
+        logger.info(f"Downloading YouTube {video['description']} and {audio['description']}")
+        # One stream is useless without the other: the first failure stops the
+        # sibling, which then discards its partial file as a cancelled download
+        sibling_cancel = _SiblingCancel(cancel)
+        errors = []
+        
+        def fetch(stream_url: str, stream_filename: str) -> str:
+            try:
+                return self._fetch_stream(stream_url, stream_filename, sibling_cancel)
+            except Exception as e:
+                errors.append(e)
+                sibling_cancel.set()
+                raise
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [
+                pool.submit(fetch, video['url'], f"{filename}.video"),
+                pool.submit(fetch, audio['url'], f"{filename}.audio")
+            ]
+        # Both downloads have finished once the pool is shut down
+        paths = [future.result() for future in futures if not future.exception()]
+        
         try:
-            # Extract file ID from Google Drive URL
-            file_id = None
-            if 'id=' in url:
-                file_id = parse_qs(parsed_url.query)['id'][0]
+            if errors:
+                # The stream that failed first, not the sibling it cancelled
+                raise errors[0]
+            if video['subtype'] == audio['subtype'] and video['subtype'] in ('mp4', 'webm'):
+                ext = f".{video['subtype']}"
             else:
-                file_id = url.split('/')[-2]
+                ext = '.mkv'
+            return self._mux(paths[0], paths[1], filename, ext)
+        finally:
+            for path in paths:
+                self.cleanup(path)
+
+    def _fetch_stream(self, url: str, filename: str, cancel=None) -> str:
+        """Download a media stream URL, raising HTTPError as is"""
+        response = self.session.get(url, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        return self._download_response(response, filename, cancel=cancel)
+
+    def _mux(self, video_path: str, audio_path: str, filename: str, ext: str) -> str:
+        """
+        Combine separate video and audio files into one container
+        
+        Streams are copied, not re-encoded, so this takes about as long as
+        writing the file once.
+        """
+        output_path = self._output_path(filename, ext)
+        tmp_path = os.path.join(self.upload_folder, f"{filename}.muxing{ext}")
+        result = subprocess.run(
+            [
+                self.ffmpeg_path, '-y', '-loglevel', 'error',
+                '-i', video_path, '-i', audio_path,
+                '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+                tmp_path
+            ],
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise ValueError(f"ffmpeg could not mux the streams: {result.stderr.strip()[-500:]}")
+        os.replace(tmp_path, output_path)
+        return output_path
 
-            download_url = f"https://drive.google.com/uc?id={file_id}"
+    def _download_gdrive(self, url: str, filename: str, progress_callback=None, cancel=None) -> str:
+        """Download video from Google Drive, confirming the large-file interstitial if needed"""
+        try:
+            response = self.gdrive.open(url)
             
-            # Use requests to download the file
-            response = requests.get(download_url, stream=True)
-            response.raise_for_status()
+            return self._download_response(response, filename, progress_callback, cancel)
             
-            # Determine file extension using python-magic
-            content_type = magic.from_buffer(response.content[:1024], mime=True)
-            ext = self._get_extension_from_mime(content_type)
+        except Exception as e:
+            logger.error(f"Google Drive download error: {str(e)}")
+            raise self._download_error(f"Failed to download from Google Drive: {str(e)}", e)
+
+    def _download_direct(self, url: str, filename: str, progress_callback=None, cancel=None) -> str:
+        """Download video from direct URL"""
+        try:
+            response = self.session.get(url, stream=True, timeout=self.timeout)
+            response.raise_for_status()
             
-            output_path = os.path.join(self.upload_folder, f"{filename}{ext}")
+            return self._download_response(response, filename, progress_callback, cancel)
             
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+        except Exception as e:
+            logger.error(f"Direct download error: {str(e)}")
+            raise self._download_error(f"Failed to download video: {str(e)}", e)
+
+    def _download_twilio_media(self, url: str, filename: str, progress_callback=None,
+                               cancel=None) -> str:
+        """
+        Download a WhatsApp attachment hosted by Twilio
+        
+        Media URLs require the account credentials and redirect to a signed
+        storage URL (requests drops the credentials on that redirect).
+        Attachments are at most a few MB, so the body is streamed over one
+        pooled connection rather than probed for ranged download.
+        """
+        try:
+            response = self.twilio_session.get(url, stream=True, timeout=self.timeout)
+            response.raise_for_status()
             
-            return output_path
+            return self._stream_to_file(response, filename, progress_callback, cancel)
             
         except Exception as e:
-            logger.error(f"Google Drive download error: {str(e)}")
-            raise ValueError(f"Failed to download from Google Drive: {str(e)}")
+            logger.error(f"Twilio media download error: {str(e)}")
+            raise self._download_error(f"Failed to download WhatsApp attachment: {str(e)}", e)
 
-    def _download_direct(self, url: str, filename: str) -> str:
-        """Download video from direct URL"""
+    @staticmethod
+    def _download_error(message: str, error: Exception) -> ValueError:
+        """
+        Wrap a download failure for the caller
+        
+        Returns:
+            ValueError: TransientError if retrying later may succeed
+                (connection errors, timeouts, 429 and 5xx responses)
+        """
+        transient = isinstance(error, (
+            TransientError,
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError
+        ))
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            transient = status == 429 or status >= 500
+        return TransientError(message) if transient else ValueError(message)
+
+    @staticmethod
+    def source_type(url: str) -> str:
+        """Classify a URL as youtube, gdrive, whatsapp (Twilio media) or direct, e.g. for metrics"""
+        netloc = urlparse(url).netloc.lower()
+        if 'youtube.com' in netloc or 'youtu.be' in netloc:
+            return 'youtube'
+        if GoogleDriveResolver.is_drive_url(url):
+            return 'gdrive'
+        if VideoDownloader.is_twilio_media(url):
+            return 'whatsapp'
+        return 'direct'
+
+    @staticmethod
+    def is_twilio_media(url: str) -> bool:
+        """Check whether a URL points at media attached to a Twilio message"""
+        parsed_url = urlparse(url)
+        return parsed_url.netloc == 'api.twilio.com' and '/Media/' in parsed_url.path
+
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """
+        Build a keep-alive session for downloads
+        
+        requests.Session is safe to share between the fetch threads: the
+        urllib3 pools behind it are thread-safe, and each host keeps up to
+        DOWNLOAD_POOL_SIZE idle connections for reuse. Connection errors and
+        429/5xx responses are retried with backoff before any body is read,
+        honouring Retry-After.
+        """
+        retry = Retry(
+            total=Config.DOWNLOAD_RETRIES,
+            backoff_factor=Config.DOWNLOAD_RETRY_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=Config.DOWNLOAD_POOL_HOSTS,
+            pool_maxsize=Config.DOWNLOAD_POOL_SIZE,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _download_response(self, response, filename: str, progress_callback=None,
+                           cancel=None) -> str:
+        """
+        Download an open response over one or several connections
+        
+        Servers that advertise byte ranges and a known Content-Length are
+        fetched in parallel segments into a journaled partial file, so an
+        interrupted download resumes where it stopped. Everything else falls
+        back to a single stream.
+        
+        Args:
+            response (requests.Response): Response opened with stream=True
+            filename (str): Base filename without extension
+            progress_callback (callable, optional): See download_video
+            cancel (threading.Event, optional): See download_video
+            
+        Returns:
+            str: Local path to the downloaded video file
+        """
+        total_size = int(response.headers.get('Content-Length') or 0)
+        supports_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        is_encoded = response.headers.get('Content-Encoding', 'identity') != 'identity'
+        
+        if not supports_ranges or is_encoded or total_size <= 0:
+            return self._stream_to_file(response, filename, progress_callback, cancel)
+        
+        part_path = os.path.join(self.upload_folder, f"{filename}.part")
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
+            journal = DownloadJournal.load(f"{part_path}.json")
+            if journal and journal.matches(total_size, etag, last_modified) and os.path.exists(part_path):
+                response.close()
+                return self._resume_ranged(response.url, part_path, journal, progress_callback, cancel)
+            
+            self._remove_partial(part_path)
+            journal = DownloadJournal(f"{part_path}.json", total_size, etag, last_modified)
+            return self._download_ranged(response, part_path, journal, progress_callback, cancel)
+        except Exception:
+            # Keep the partial for a retry to resume, unless the caller gave up on it
+            if cancel is not None and cancel.is_set():
+                self._remove_partial(part_path)
+            raise
+
+    def _download_ranged(self, response, part_path: str, journal: DownloadJournal,
+                         progress_callback=None, cancel=None) -> str:
+        """
+        Fetch byte ranges concurrently into a preallocated file
+        
+        The first segment is read from the already open response; the
+        remaining segments are requested with Range headers from a thread
+        pool. Every segment is written in place with os.pwrite, so no
+        reassembly pass is needed.
+        
+        Args:
+            response (requests.Response): Response opened with stream=True
+            part_path (str): Path of the partial file to write into
+            journal (DownloadJournal): Journal recording completed ranges
+            progress_callback (callable, optional): See download_video
+            cancel (threading.Event, optional): See download_video
+            
+        Returns:
+            str: Local path to the downloaded video file
+        """
+        total_size = journal.total_size
+        segments = self._split_range(0, total_size - 1)
+        url = response.url
+        on_block = functools.partial(progress_callback, part_path) if progress_callback else None
+        
+        with response:
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            first_chunk = next((chunk for chunk in chunks if chunk), b'')
+            if not first_chunk:
+                raise ValueError("Empty response received")
             
-            # Determine file extension using python-magic
-            content_type = magic.from_buffer(response.content[:1024], mime=True)
-            ext = self._get_extension_from_mime(content_type)
+            journal.ext = self._sniff_extension(first_chunk)
+            journal.save()
             
-            output_path = os.path.join(self.upload_folder, f"{filename}{ext}")
+            logger.info(f"Downloading {total_size} bytes in {len(segments)} segments")
             
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            pool = ThreadPoolExecutor(max_workers=max(1, len(segments) - 1))
+            try:
+                self._preallocate(fd, total_size)
+                futures = [
+                    pool.submit(self._fetch_range, url, fd, start, end, journal, on_block, cancel)
+                    for start, end in segments[1:]
+                ]
+                start, end = segments[0]
+                self._write_range(
+                    fd, itertools.chain([first_chunk], chunks), start, end, journal, on_block, cancel
+                )
+                del first_chunk
+                for future in futures:
+                    future.result()
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+                os.close(fd)
+        
+        return self._finalize_partial(part_path, journal)
+
+    def _resume_ranged(self, url: str, part_path: str, journal: DownloadJournal,
+                       progress_callback=None, cancel=None) -> str:
+        """
+        Fetch only the ranges missing from a journaled partial file
+        
+        Range requests carry an If-Range validator, so a server whose copy
+        changed since the journal was written answers 200 and the resume
+        fails instead of mixing two versions of the file.
+        
+        Args:
+            url (str): URL to request the ranges from
+            part_path (str): Path of the partial file to write into
+            journal (DownloadJournal): Journal recording completed ranges
+            progress_callback (callable, optional): See download_video
+            cancel (threading.Event, optional): See download_video
+            
+        Returns:
+            str: Local path to the downloaded video file
+        """
+        segments = [
+            segment
+            for start, end in journal.missing_ranges()
+            for segment in self._split_range(start, end)
+        ]
+        remaining = sum(end + 1 - start for start, end in segments)
+        logger.info(f"Resuming {part_path}: {remaining} of {journal.total_size} bytes left")
+        
+        on_block = functools.partial(progress_callback, part_path) if progress_callback else None
+        if on_block:
+            on_block(journal.contiguous_bytes(), journal.total_size)
+        
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                futures = [
+                    pool.submit(self._fetch_range, url, fd, start, end, journal, on_block, cancel)
+                    for start, end in segments
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+        
+        return self._finalize_partial(part_path, journal)
+
+    def _split_range(self, start: int, end: int) -> list:
+        """Split an inclusive byte range into block-aligned segments, at most one per connection"""
+        length = end + 1 - start
+        count = max(1, min(self.connections, length // self.min_segment_size))
+        segment_size = -(-length // count)
+        segment_size = -(-segment_size // BLOCK_SIZE) * BLOCK_SIZE
+        return [
+            (offset, min(offset + segment_size, end + 1) - 1)
+            for offset in range(start, end + 1, segment_size)
+        ]
+
+    def _fetch_range(self, url: str, fd: int, start: int, end: int, journal: DownloadJournal,
+                     on_block=None, cancel=None):
+        """Download a single byte range and write it at its offset"""
+        headers = {'Range': f'bytes={start}-{end}'}
+        if journal.validator:
+            headers['If-Range'] = journal.validator
+        
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        with response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ValueError(f"Server ignored range request for bytes {start}-{end}")
+            self._write_range(
+                fd, response.iter_content(chunk_size=self.chunk_size), start, end, journal, on_block,
+                cancel
+            )
+
+    def _write_range(self, fd: int, chunks, start: int, end: int, journal: DownloadJournal,
+                     on_block=None, cancel=None):
+        """
+        Write chunks in place between start and end (inclusive)
+        
+        Each content-hash block is hashed as it is written and recorded in
+        the journal once complete, so the finished file's content hash is
+        known without reading it back. start must be block-aligned.
+        on_block, if given, is called as on_block(available_bytes, total_size)
+        after every completed block. Stops with ValueError once cancel is set.
+        """
+        offset = start
+        last_save = start
+        block_start = start
+        block_hash = hashlib.sha256()
+        started = time.monotonic()
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                raise ValueError("Download cancelled")
+            if not chunk:
+                continue
+            view = memoryview(chunk)[:end + 1 - offset]
+            while view:
+                # Never let a single write straddle a block boundary
+                block_end = min(block_start + BLOCK_SIZE, end + 1)
+                written = os.pwrite(fd, view[:block_end - offset], offset)
+                block_hash.update(view[:written])
+                offset += written
+                view = view[written:]
+                if offset == block_end:
+                    journal.add_block(block_start, block_end - 1, block_hash.digest())
+                    if on_block:
+                        on_block(journal.contiguous_bytes(), journal.total_size)
+                    block_start = offset
+                    block_hash = hashlib.sha256()
+            if offset - last_save >= self.journal_interval:
+                journal.save()
+                last_save = offset
+            if offset > end:
+                break
+        
+        journal.save()
+        metrics.observe_transfer('download', offset - start, time.monotonic() - started)
+        if offset != end + 1:
+            raise ValueError(f"Incomplete range {start}-{end}: got {offset - start} bytes")
+
+    def _preallocate(self, fd: int, size: int):
+        """Reserve disk space for the whole file up front"""
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+    def _finalize_partial(self, part_path: str, journal: DownloadJournal) -> str:
+        """Move a fully downloaded partial file to its final name and drop the journal"""
+        if journal.missing_ranges():
+            raise ValueError(f"Download incomplete: {part_path}")
+        
+        output_path = self._output_path(os.path.basename(part_path)[:-len('.part')], journal.ext or '.mp4')
+        os.replace(part_path, output_path)
+        self._content_hashes[output_path] = journal.content_hash()
+        journal.remove()
+        return output_path
+
+    def _output_path(self, filename: str, ext: str) -> str:
+        """
+        Pick the path of a finished download
+        
+        Each download gets its own file, so one job cleaning up its video
+        never removes a file another job fetched from the same URL.
+        """
+        return os.path.join(self.upload_folder, f"{filename}_{os.urandom(4).hex()}{ext}")
+
+    @contextmanager
+    def _url_lock(self, filename: str, blocking: bool = True):
+        """
+        Hold the exclusive download lock of a URL, across processes
+        
+        The lock is an flock on {filename}.lock in the upload folder. The
+        holder deletes the lock file when it is done; a waiter that then gets
+        the lock on the deleted file sees that the path no longer names it
+        and locks the current file instead.
+        
+        Yields:
+            bool: True once the lock is held; False if blocking is off and
+                another download holds it
+        """
+        lock_path = os.path.join(self.upload_folder, f"{filename}.lock")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                os.close(fd)
+                yield False
+                return
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        try:
+            yield True
+        finally:
+            os.remove(lock_path)
+            os.close(fd)
+
+    def _remove_partial(self, part_path: str):
+        """Delete a partial file and its journal"""
+        for path in (part_path, f"{part_path}.json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup_stale_partials(self):
+        """
+        Garbage-collect partial downloads left behind by earlier workers
+        
+        Partials older than DOWNLOAD_PARTIAL_MAX_AGE are removed. If free
+        space in the upload folder is still below DOWNLOAD_MIN_FREE_SPACE,
+        the oldest remaining partials are removed until it is not. Partials
+        written to in the last DOWNLOAD_PARTIAL_ACTIVE_AGE seconds, or whose
+        URL lock is held by a running download, are always kept.
+        """
+        try:
+            now = time.time()
+            partials = []
+            for name in os.listdir(self.upload_folder):
+                path = os.path.join(self.upload_folder, name)
+                if name.endswith('.part.json') and not os.path.exists(path[:-len('.json')]):
+                    self._remove_idle_partial(path[:-len('.json')], "Removing orphaned download journal")
+                elif name.endswith('.part'):
+                    mtime = os.path.getmtime(path)
+                    if now - mtime > Config.DOWNLOAD_PARTIAL_ACTIVE_AGE:
+                        partials.append((mtime, path))
             
-            return output_path
+            partials.sort()
+            while partials and now - partials[0][0] > Config.DOWNLOAD_PARTIAL_MAX_AGE:
+                _, path = partials.pop(0)
+                self._remove_idle_partial(path, "Removing stale partial download")
             
+            while partials and shutil.disk_usage(self.upload_folder).free < Config.DOWNLOAD_MIN_FREE_SPACE:
+                _, path = partials.pop(0)
+                self._remove_idle_partial(path, "Removing partial download to free disk space")
+                
         except Exception as e:
-            logger.error(f"Direct download error: {str(e)}")
-            raise ValueError(f"Failed to download video: {str(e)}")
+            logger.error(f"Error cleaning up partial downloads: {str(e)}")
+
+    def _remove_idle_partial(self, part_path: str, reason: str):
+        """Remove a partial file and its journal unless a download of its URL is running"""
+        # video_<url hash>.part, or .video.part/.audio.part for YouTube adaptive streams
+        filename = os.path.basename(part_path).split('.')[0]
+        with self._url_lock(filename, blocking=False) as locked:
+            if not locked:
+                logger.info(f"Keeping partial download in use: {part_path}")
+                return
+            logger.info(f"{reason}: {part_path}")
+            self._remove_partial(part_path)
+
+    def _stream_to_file(self, response, filename: str, progress_callback=None, cancel=None) -> str:
+        """
+        Stream a response body to disk without holding it in memory
+        
+        The MIME type is sniffed from the first chunk only, so peak memory
+        stays at roughly one chunk plus the write buffer regardless of the
+        size of the file. The content hash is computed as the chunks pass.
+        Progress is reported, and the buffer flushed for readers following
+        the file, once per DOWNLOAD_BUFFER_SIZE written rather than per chunk.
+        
+        Args:
+            response (requests.Response): Response opened with stream=True
+            filename (str): Base filename without extension
+            progress_callback (callable, optional): See download_video
+            cancel (threading.Event, optional): See download_video
+            
+        Returns:
+            str: Local path to the downloaded video file
+        """
+        total_size = int(response.headers.get('Content-Length') or 0) or None
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            total_size = None
+        
+        with response:
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            first_chunk = next((chunk for chunk in chunks if chunk), b'')
+            if not first_chunk:
+                raise ValueError("Empty response received")
+            
+            ext = self._sniff_extension(first_chunk)
+            output_path = self._output_path(filename, ext)
+            
+            hasher = ContentHasher()
+            started = time.monotonic()
+            written = 0
+            reported = 0
+            try:
+                with open(output_path, 'wb', buffering=self.buffer_size) as f:
+                    f.write(first_chunk)
+                    hasher.update(first_chunk)
+                    written = len(first_chunk)
+                    del first_chunk
+                    for chunk in chunks:
+                        if cancel is not None and cancel.is_set():
+                            raise ValueError("Download cancelled")
+                        if chunk:
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            written += len(chunk)
+                            # Report about once per write buffer; readers follow the file,
+                            # so the bytes are flushed first to make them visible
+                            if progress_callback and written - reported >= self.buffer_size:
+                                f.flush()
+                                progress_callback(output_path, written, total_size)
+                                reported = written
+            except Exception:
+                self.cleanup(output_path)
+                raise
+            finally:
+                metrics.observe_transfer('download', written, time.monotonic() - started)
+        
+        self._content_hashes[output_path] = hasher.hexdigest()
+        self._report_complete(output_path, progress_callback)
+        return output_path
+
+    def _sniff_extension(self, first_chunk: bytes) -> str:
+        """
+        Pick the file extension from the first bytes of a download
+        
+        Raises:
+            ValueError: If the content is a web page or other text, which
+                servers return for errors, logins and consent screens
+        """
+        # Determine file extension using python-magic
+        content_type = magic.from_buffer(first_chunk[:2048], mime=True)
+        if content_type.startswith('text/') or content_type in ('application/json', 'application/xml'):
+            raise ValueError(f"Expected a video but the server returned {content_type}")
+        return self._get_extension_from_mime(content_type)
 
     def _get_extension_from_mime(self, mime_type: str) -> str:
         """Get file extension from MIME type"""
@@ -129,8 +768,37 @@ class VideoDownloader:
         }
         return mime_to_ext.get(mime_type, '.mp4')  # Default to .mp4 if unknown
 
+    def _report_complete(self, filepath: str, progress_callback=None):
+        """Report a fully written file to a progress callback"""
+        if progress_callback:
+            size = os.path.getsize(filepath)
+            progress_callback(filepath, size, size)
+
+    def content_hash(self, filepath: str) -> str:
+        """
+        Get the content hash of a downloaded video
+        
+        Streamed and ranged downloads hash their bytes as they are written;
+        only files fetched by other means (e.g. pytube) are read back.
+        
+        Args:
+            filepath (str): Path returned by download_video
+            
+        Returns:
+            str: Hex content hash (see content_hash.py)
+        """
+        if filepath not in self._content_hashes:
+            self._content_hashes[filepath] = hash_file(filepath)
+        return self._content_hashes[filepath]
+
+    def from_cache(self, filepath: str) -> bool:
+        """Whether a path returned by download_video was served from the download cache"""
+        return filepath in self._cached_paths
+
     def cleanup(self, filepath: str):
         """Remove downloaded video file"""
+        self._content_hashes.pop(filepath, None)
+        self._cached_paths.discard(filepath)
         try:
             if os.path.exists(filepath):
                 os.remove(filepath)
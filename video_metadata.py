@@ -0,0 +1,251 @@
+import mmap
+import struct
+from datetime import datetime, timedelta, timezone
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+MATROSKA_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+# MP4 boxes holding the metadata we read; everything else (notably mdat) is skipped by size
+MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'udta', b'meta', b'ilst'}
+
+CODEC_NAMES = {
+    # MP4 sample entry types
+    'avc1': 'H.264', 'avc3': 'H.264', 'hvc1': 'HEVC', 'hev1': 'HEVC', 'av01': 'AV1',
+    'vp09': 'VP9', 'mp4v': 'MPEG-4', 'mp4a': 'AAC', 'ac-3': 'AC-3', 'ec-3': 'E-AC-3',
+    'Opus': 'Opus', '.mp3': 'MP3', 'apcn': 'ProRes', 'apch': 'ProRes',
+    # Matroska codec IDs
+    'V_MPEG4/ISO/AVC': 'H.264', 'V_MPEGH/ISO/HEVC': 'HEVC', 'V_AV1': 'AV1', 'V_VP8': 'VP8',
+    'V_VP9': 'VP9', 'A_AAC': 'AAC', 'A_OPUS': 'Opus', 'A_VORBIS': 'Vorbis', 'A_MPEG/L3': 'MP3',
+    'A_AC3': 'AC-3', 'A_EAC3': 'E-AC-3'
+}
+
+# Matroska element IDs (with their length marker bits)
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TRACKS = 0x1654AE6B
+CLUSTER = 0x1F43B675
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+DATE_UTC = 0x4461
+TITLE = 0x7BA9
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+
+def read_metadata(path: str) -> dict:
+    """
+    Read a video's embedded metadata from its container headers
+
+    MP4/MOV files are read through their moov box and Matroska/WebM files
+    through their Info and Tracks elements. The file is memory-mapped and
+    media data is stepped over by its declared size, so only the pages
+    holding the headers are read, whatever the size of the file.
+
+    Args:
+        path (str): Path to the video file
+
+    Returns:
+        dict: Any of title, created (UTC datetime), duration (seconds),
+            width, height, video_codec and audio_codec that the container
+            declares; empty for other containers or unreadable files
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+                return _read_mp4(data)
+            if len(data) >= 4 and struct.unpack_from('>I', data)[0] == EBML_HEADER:
+                return _read_matroska(data)
+    except (OSError, ValueError, struct.error, IndexError, OverflowError, RecursionError) as e:
+        # Malformed containers (impossible dates, boxes nested without end) only cost the metadata
+        logger.warning(f"Could not read container metadata of {path}: {str(e)}")
+    return {}
+
+
+def _codec_name(code: str) -> str:
+    return CODEC_NAMES.get(code, code.strip() or None)
+
+
+def _mp4_boxes(data, start: int, end: int):
+    """Yield (type, payload start, box end) for the boxes between start and end"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _read_mp4(data) -> dict:
+    metadata = {}
+    for box_type, start, end in _mp4_boxes(data, 0, len(data)):
+        if box_type == b'moov':
+            _read_mp4_container(data, start, end, metadata, {})
+            break
+    return metadata
+
+
+def _read_mp4_container(data, start: int, end: int, metadata: dict, track: dict):
+    for box_type, payload, box_end in _mp4_boxes(data, start, end):
+        if box_type == b'trak':
+            track = {}
+            _read_mp4_container(data, payload, box_end, metadata, track)
+            if track.get('handler') == b'vide':
+                metadata.setdefault('width', track.get('width'))
+                metadata.setdefault('height', track.get('height'))
+                metadata.setdefault('video_codec', track.get('codec'))
+            elif track.get('handler') == b'soun':
+                metadata.setdefault('audio_codec', track.get('codec'))
+        elif box_type == b'meta':
+            # ISO meta is a full box (4 bytes of version and flags); QuickTime's is not
+            if data[payload + 4:payload + 8] != b'hdlr':
+                payload += 4
+            # Its hdlr names the metadata format, not the track's media type
+            _read_mp4_container(data, payload, box_end, metadata, {})
+        elif box_type in MP4_CONTAINERS:
+            _read_mp4_container(data, payload, box_end, metadata, track)
+        elif box_type == b'mvhd':
+            if data[payload] == 1:
+                created, timescale, duration = struct.unpack_from('>Q8xIQ', data, payload + 4)
+            else:
+                created, timescale, duration = struct.unpack_from('>I4xII', data, payload + 4)
+            if created:
+                metadata['created'] = MP4_EPOCH + timedelta(seconds=created)
+            if timescale:
+                metadata['duration'] = duration / timescale
+        elif box_type == b'tkhd':
+            offset = payload + (88 if data[payload] == 1 else 76)
+            width, height = struct.unpack_from('>II', data, offset)
+            track['width'], track['height'] = width >> 16, height >> 16
+        elif box_type == b'hdlr':
+            track['handler'] = data[payload + 8:payload + 12]
+        elif box_type == b'stsd':
+            track['codec'] = _codec_name(data[payload + 12:payload + 16].decode('latin-1'))
+        elif box_type == b'\xa9nam':
+            title = _mp4_text(data, payload, box_end)
+            if title:
+                metadata['title'] = title
+
+
+def _mp4_text(data, start: int, end: int) -> str:
+    """Read an iTunes-style ilst item (a data box) or a QuickTime udta string"""
+    for box_type, payload, box_end in _mp4_boxes(data, start, end):
+        if box_type == b'data':
+            return data[payload + 8:box_end].decode('utf-8', errors='replace').strip()
+    length = struct.unpack_from('>H', data, start)[0]
+    return data[start + 4:min(start + 4 + length, end)].decode('utf-8', errors='replace').strip()
+
+
+def _ebml_vint(data, offset: int, keep_marker: bool) -> tuple:
+    """Read an EBML variable-length integer; returns (value, length), value None if unknown"""
+    first = data[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable-length integer")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, length
+
+
+def _ebml_elements(data, start: int, end: int):
+    """Yield (id, payload start, payload end) for the elements between start and end"""
+    offset = start
+    while offset < end:
+        element_id, id_length = _ebml_vint(data, offset, keep_marker=True)
+        size, size_length = _ebml_vint(data, offset + id_length, keep_marker=False)
+        payload = offset + id_length + size_length
+        payload_end = end if size is None else payload + size
+        if payload_end > end:
+            payload_end = end
+        yield element_id, payload, payload_end
+        if size is None:
+            return
+        offset = payload_end
+
+
+def _ebml_uint(data, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _read_matroska(data) -> dict:
+    metadata = {}
+    for element_id, start, end in _ebml_elements(data, 0, len(data)):
+        if element_id != SEGMENT:
+            continue
+        found = set()
+        for child_id, child_start, child_end in _ebml_elements(data, start, end):
+            if child_id == INFO:
+                _read_matroska_info(data, child_start, child_end, metadata)
+                found.add(child_id)
+            elif child_id == TRACKS:
+                _read_matroska_tracks(data, child_start, child_end, metadata)
+                found.add(child_id)
+            elif child_id == CLUSTER and child_end == end:
+                # A cluster of unknown size runs to the end; nothing after it can be reached by size
+                break
+            if found == {INFO, TRACKS}:
+                break
+        break
+    return metadata
+
+
+def _read_matroska_info(data, start: int, end: int, metadata: dict):
+    timecode_scale = 1000000  # Nanoseconds per tick
+    duration = None
+    for element_id, payload, payload_end in _ebml_elements(data, start, end):
+        if element_id == TIMECODE_SCALE:
+            timecode_scale = _ebml_uint(data, payload, payload_end)
+        elif element_id == DURATION:
+            fmt = '>d' if payload_end - payload == 8 else '>f'
+            duration = struct.unpack_from(fmt, data, payload)[0]
+        elif element_id == DATE_UTC:
+            nanoseconds = int.from_bytes(data[payload:payload_end], 'big', signed=True)
+            metadata['created'] = MATROSKA_EPOCH + timedelta(microseconds=nanoseconds // 1000)
+        elif element_id == TITLE:
+            title = data[payload:payload_end].decode('utf-8', errors='replace').strip('\x00 ')
+            if title:
+                metadata['title'] = title
+    if duration:
+        metadata['duration'] = duration * timecode_scale / 1e9
+
+
+def _read_matroska_tracks(data, start: int, end: int, metadata: dict):
+    for element_id, payload, payload_end in _ebml_elements(data, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+        track = {}
+        for child_id, child_start, child_end in _ebml_elements(data, payload, payload_end):
+            if child_id == TRACK_TYPE:
+                track['type'] = _ebml_uint(data, child_start, child_end)
+            elif child_id == CODEC_ID:
+                track['codec'] = _codec_name(data[child_start:child_end].decode('ascii', errors='replace').strip('\x00'))
+            elif child_id == VIDEO:
+                for video_id, video_start, video_end in _ebml_elements(data, child_start, child_end):
+                    if video_id == PIXEL_WIDTH:
+                        track['width'] = _ebml_uint(data, video_start, video_end)
+                    elif video_id == PIXEL_HEIGHT:
+                        track['height'] = _ebml_uint(data, video_start, video_end)
+        if track.get('type') == 1:
+            metadata.setdefault('width', track.get('width'))
+            metadata.setdefault('height', track.get('height'))
+            metadata.setdefault('video_codec', track.get('codec'))
+        elif track.get('type') == 2:
+            metadata.setdefault('audio_codec', track.get('codec'))
@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from download_cache import DownloadCache
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+class TTLCache:
+    """
+    Thread-safe set of keys that expire after a fixed time
+
+    Every key lives for the same TTL, so insertion order is expiry order and
+    expired keys are dropped from the front of an OrderedDict; lookups and
+    inserts are O(1) amortized.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> expiry
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> bool:
+        """
+        Add a key unless it is already present
+
+        Returns:
+            bool: True if the key was added, False if it was already present
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                return False
+            self._entries[key] = now + self.ttl
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _expire(self, now: float):
+        # Caller holds the lock
+        while self._entries:
+            key, expiry = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            del self._entries[key]
+
+
+class SharedTTLStore:
+    """
+    TTL key store in SQLite, shared by every web worker process
+
+    A claim is a single INSERT into a primary-key table, so only one process
+    can claim a key until it expires.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or Config.WEBHOOK_DEDUPE_DB
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS claims_expiry ON claims (expires_at)')
+
+    def add(self, key: str, ttl: float) -> bool:
+        """
+        Claim a key for ttl seconds
+
+        Returns:
+            bool: True if the key was claimed, False if another claim is live
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM claims WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO claims (key, expires_at) VALUES (?, ?)',
+                (key, now + ttl)
+            )
+            return cursor.rowcount == 1
+
+    def discard(self, key: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+    def purge(self):
+        """Drop expired claims"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM claims WHERE expires_at <= ?', (time.time(),))
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+
+class WebhookDeduplicator:
+    """
+    Drop duplicate webhook deliveries before any work is queued
+
+    Twilio retries a webhook that does not answer quickly with the same
+    MessageSid, so a MessageSid is accepted once per WEBHOOK_IDEMPOTENCY_TTL.
+    A sender pasting the same link again (under a new MessageSid) is dropped
+    for WEBHOOK_DEDUPE_WINDOW, with links compared in canonical form. Keys
+    are checked in an in-process TTL cache first; with
+    WEBHOOK_DEDUPE_SHARED enabled (the default) they are also claimed in a
+    SQLite store so retries landing on another web worker are caught as well.
+    """
+
+    def __init__(self, shared: bool = None):
+        self.idempotency_ttl = Config.WEBHOOK_IDEMPOTENCY_TTL
+        self.dedupe_window = Config.WEBHOOK_DEDUPE_WINDOW
+        self._sids = TTLCache(self.idempotency_ttl)
+        self._links = TTLCache(self.dedupe_window)
+        shared = Config.WEBHOOK_DEDUPE_SHARED if shared is None else shared
+        self._shared = SharedTTLStore() if shared else None
+        if self._shared:
+            self._shared.purge()
+
+    def claim(self, message_sid: str, from_number: str, url: str) -> bool:
+        """
+        Record a webhook delivery
+
+        Args:
+            message_sid (str): Twilio MessageSid, if present
+            from_number (str): Sender's phone number
+            url (str): Video link from the message
+
+        Returns:
+            bool: True if the delivery is new and should be processed,
+                False if it is a duplicate
+        """
+        keys = []
+        if message_sid:
+            keys.append((f"sid:{message_sid}", self._sids, self.idempotency_ttl))
+        if url:
+            link = f"link:{from_number}:{DownloadCache.canonical_url(url)}"
+            keys.append((link, self._links, self.dedupe_window))
+
+        claimed = []
+        for key, cache, ttl in keys:
+            if not self._add(key, cache, ttl):
+                # Give back the keys already taken so they do not outlive this delivery
+                for taken, taken_cache, _ in claimed:
+                    self._discard(taken, taken_cache)
+                logger.info(f"Dropping duplicate webhook delivery ({key})")
+                return False
+            claimed.append((key, cache, ttl))
+        return True
+
+    def release(self, message_sid: str, from_number: str, url: str):
+        """Forget a delivery whose processing could not be queued, so a retry is accepted"""
+        if message_sid:
+            self._discard(f"sid:{message_sid}", self._sids)
+        if url:
+            self._discard(f"link:{from_number}:{DownloadCache.canonical_url(url)}", self._links)
+
+    def _add(self, key: str, cache: TTLCache, ttl: float) -> bool:
+        if not cache.add(key):
+            return False
+        if self._shared and not self._shared.add(key, ttl):
+            return False
+        return True
+
+    def _discard(self, key: str, cache: TTLCache):
+        cache.discard(key)
+        if self._shared:
+            self._shared.discard(key)
@@ -1,31 +1,93 @@
+import re
+import time
+import atexit
+import threading
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
+from outbound_queue import OutboundMessageQueue, MAX_MESSAGE_LENGTH
 from logger import setup_logger
 from config import Config
 
 logger = setup_logger(__name__)
 
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+', re.IGNORECASE)
+
+def extract_urls(text: str) -> list:
+    """
+    Find every http(s) link in a piece of text
+    
+    Args:
+        text (str): Message body or other free text
+        
+    Returns:
+        list: Links in order of appearance, without duplicates or trailing punctuation
+    """
+    urls = []
+    for match in URL_PATTERN.findall(text or ''):
+        url = match.rstrip('.,;:!?)]}')
+        if url not in urls:
+            urls.append(url)
+    return urls
+
 class WhatsAppHandler:
     def __init__(self):
-        self.client = Client(Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
         self.whatsapp_number = Config.TWILIO_PHONE_NUMBER
+        self._clients = threading.local()
+        self.outbox = OutboundMessageQueue(self._deliver)
+        # Celery's prefork children skip atexit; app.py also closes the outbox on worker_process_shutdown
+        atexit.register(self.outbox.close)
 
-    def send_message(self, to_number: str, message: str) -> bool:
+    @property
+    def client(self) -> Client:
+        """This thread's Twilio client; each keeps its own pooled HTTP session"""
+        client = getattr(self._clients, 'client', None)
+        if client is None:
+            client = Client(
+                Config.TWILIO_ACCOUNT_SID,
+                Config.TWILIO_AUTH_TOKEN,
+                http_client=TwilioHttpClient(pool_connections=True, timeout=Config.TWILIO_TIMEOUT)
+            )
+            self._clients.client = client
+        return client
+
+    def send_message(self, to_number: str, message: str, replace_key: str = None) -> bool:
         """
-        Send a WhatsApp message using Twilio
+        Queue a WhatsApp message for delivery through Twilio
+        
+        Delivery happens on a background sender, so this never waits on the
+        Twilio API; failures are retried and logged there, and a True result
+        does not mean the message was delivered.
         
         Args:
             to_number (str): Recipient's phone number (with country code)
             message (str): Message to send
+            replace_key (str, optional): Supersede a queued, not yet sent
+                message with the same key
             
         Returns:
-            bool: True if message was sent successfully, False otherwise
+            bool: True if the message was queued, False if it was not (e.g.
+                during shutdown)
         """
         try:
             # Ensure the number is in WhatsApp format
             if not to_number.startswith('whatsapp:'):
                 to_number = f'whatsapp:{to_number}'
 
+            return self.outbox.put(to_number, message, replace_key=replace_key)
+
+        except Exception as e:
+            logger.error(f"Error queueing WhatsApp message: {str(e)}")
+            return False
+
+    def _deliver(self, to_number: str, message: str):
+        """
+        Send a WhatsApp message using Twilio (called by the outbound queue)
+        
+        Raises:
+            TwilioRestException: If Twilio rejects the message
+        """
+        try:
             # Format the from number
             from_number = f'whatsapp:{self.whatsapp_number}'
 
@@ -37,14 +99,85 @@ class WhatsAppHandler:
             )
 
             logger.info(f"Message sent successfully. SID: {message.sid}")
-            return True
 
         except TwilioRestException as e:
             logger.error(f"Twilio error: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"Error sending WhatsApp message: {str(e)}")
-            return False
+            raise
+
+    def progress_callback(self, to_number: str):
+        """
+        Build a progress_callback(stage, progress) that sends progress updates
+        
+        Stage changes are always sent. Within a stage, an update is sent only
+        once WHATSAPP_PROGRESS_INTERVAL seconds and WHATSAPP_PROGRESS_MIN_DELTA
+        percentage points have passed since the last one, and it replaces an
+        earlier update still waiting in the outbound queue, so the recipient
+        gets a handful of messages per video rather than one per chunk.
+        Updates held back are coalesced into the latest one, which is sent
+        when the interval is over (if it moved by the minimum delta) or when
+        report.flush() is called at the end of the job or stage.
+        
+        Args:
+            to_number (str): Recipient's phone number
+            
+        Returns:
+            callable: report(stage, progress=None), with a flush() method;
+                safe to call from any thread
+        """
+        lock = threading.Lock()
+        last = {}
+        held = {}       # Latest update not sent yet: stage, progress
+        timer = None
+
+        def send(stage: str, progress: int):
+            # Called with the lock held, so updates are queued in the order they were made
+            nonlocal timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            held.clear()
+            last.update(stage=stage, progress=progress, sent_at=time.monotonic())
+            self.send_message(
+                to_number,
+                self.format_progress_message(stage, progress),
+                replace_key='progress'
+            )
+
+        def moved_enough(progress: int) -> bool:
+            return progress - (last['progress'] or 0) >= Config.WHATSAPP_PROGRESS_MIN_DELTA
+
+        def report(stage: str, progress: int = None):
+            nonlocal timer
+            with lock:
+                if stage == last.get('stage'):
+                    if progress is None or progress == last['progress']:
+                        return
+                    wait = last['sent_at'] + Config.WHATSAPP_PROGRESS_INTERVAL - time.monotonic()
+                    if wait > 0 or not moved_enough(progress):
+                        held.update(stage=stage, progress=progress)
+                        if wait > 0 and timer is None:
+                            timer = threading.Timer(wait, reopen)
+                            timer.daemon = True
+                            timer.start()
+                        return
+                send(stage, progress)
+
+        def reopen():
+            nonlocal timer
+            with lock:
+                timer = None
+                if held and moved_enough(held['progress']):
+                    send(held['stage'], held['progress'])
+
+        def flush():
+            with lock:
+                if held:
+                    send(held['stage'], held['progress'])
+                elif timer is not None:
+                    timer.cancel()
+
+        report.flush = flush
+        return report
 
     def parse_incoming_message(self, request_data: dict) -> dict:
         """
@@ -55,21 +188,32 @@ class WhatsAppHandler:
             
         Returns:
             dict: Parsed message data containing:
+                - message_sid (str): Twilio MessageSid, identical across retries
                 - from_number (str): Sender's phone number
                 - message (str): Message content
-                - media_url (str, optional): URL of any attached media
+                - media_url (str, optional): URL of the first attached media
+                - urls (list): Every link in the message followed by the
+                  URL of every attached video
         """
         try:
             result = {
+                'message_sid': request_data.get('MessageSid'),
                 'from_number': request_data.get('From', '').replace('whatsapp:', ''),
                 'message': request_data.get('Body', ''),
-                'media_url': None
+                'media_url': None,
+                'urls': extract_urls(request_data.get('Body', ''))
             }
 
             # Check for media attachments
             num_media = int(request_data.get('NumMedia', 0))
             if num_media > 0:
                 result['media_url'] = request_data.get('MediaUrl0')
+            for index in range(num_media):
+                media_url = request_data.get(f'MediaUrl{index}')
+                content_type = request_data.get(f'MediaContentType{index}', '')
+                # Photos, voice notes and documents are not uploadable
+                if media_url and content_type.startswith('video/') and media_url not in result['urls']:
+                    result['urls'].append(media_url)
 
             return result
 
@@ -134,6 +278,36 @@ class WhatsAppHandler:
         
         return self.send_message(to_number, message)
 
+    def send_batch_summary(self, to_number: str, jobs: list) -> bool:
+        """
+        Send one summary for a batch of videos
+        
+        Args:
+            to_number (str): Recipient's phone number
+            jobs (list): Job dicts with url, status, message and video_url
+            
+        Returns:
+            bool: True if every part of the summary was queued
+        """
+        uploaded = sum(1 for job in jobs if job['status'] == 'success')
+        lines = [f"{'✅' if uploaded == len(jobs) else '⚠️'} {uploaded} of {len(jobs)} videos uploaded", ""]
+        for number, job in enumerate(jobs, 1):
+            if job['status'] == 'success':
+                lines.append(f"{number}. 🎥 {job['video_url']}")
+            else:
+                lines.append(f"{number}. ❌ {job['url']}: {job['message']}")
+
+        # Split on line boundaries to stay under the per-message limit
+        parts = ['']
+        for line in lines:
+            candidate = f"{parts[-1]}\n{line}" if parts[-1] else line
+            if len(candidate) > MAX_MESSAGE_LENGTH and parts[-1]:
+                parts.append(line[:MAX_MESSAGE_LENGTH])
+            else:
+                parts[-1] = candidate[:MAX_MESSAGE_LENGTH]
+
+        return all([self.send_message(to_number, part) for part in parts])
+
     def send_error_message(self, to_number: str, error: str) -> bool:
         """
         Send an error message
@@ -1,58 +1,50 @@
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import mimetypes
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+from credential_store import credential_store
+from streaming_upload import GrowingFile, GrowingFileUpload
+from upload_engine import AdaptiveMediaFileUpload, ResumableUploadEngine, RETRYABLE_STATUS_CODES, RETRYABLE_EXCEPTIONS
+from errors import TransientError
 from logger import setup_logger
 from config import Config
 
 logger = setup_logger(__name__)
 
+# 403 reasons that mean "try again later" rather than "not allowed"
+QUOTA_ERROR_REASONS = ('quotaExceeded', 'dailyLimitExceeded', 'rateLimitExceeded', 'uploadLimitExceeded')
+
+class QuotaExceededError(TransientError):
+    """Raised when YouTube rejects a request because API quota is exhausted"""
+
+
 class YouTubeUploader:
     def __init__(self):
-        self.credentials_dir = Config.YOUTUBE_CREDENTIALS_DIR
-        self.client_secrets_file = Config.YOUTUBE_CLIENT_SECRETS_FILE
-        self.scopes = Config.YOUTUBE_API_SCOPES
         self.credentials = None
         self.youtube = None
+        self.upload_engine = ResumableUploadEngine()
 
     def authenticate(self):
-        """Authenticate with YouTube API using OAuth 2.0"""
+        """
+        Authenticate with YouTube API using OAuth 2.0
+        
+        Credentials and API clients come from the process-wide credential
+        store, so after the first call in a thread this is an in-memory
+        lookup plus, when the token is about to expire, a refresh.
+        
+        Returns:
+            googleapiclient.discovery.Resource: This thread's YouTube API client
+        """
         try:
-            # Token file path
-            token_file = os.path.join(self.credentials_dir, 'token.pickle')
-
-            # Check if we have valid credentials
-            if os.path.exists(token_file):
-                with open(token_file, 'rb') as token:
-                    self.credentials = pickle.load(token)
-
-            # If credentials are invalid or don't exist, get new ones
-            if not self.credentials or not self.credentials.valid:
-                if self.credentials and self.credentials.expired and self.credentials.refresh_token:
-                    logger.info("Refreshing YouTube API credentials")
-                    self.credentials.refresh(Request())
-                else:
-                    logger.info("Getting new YouTube API credentials")
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        self.client_secrets_file, self.scopes)
-                    self.credentials = flow.run_local_server(port=0)
-
-                # Save credentials for future use
-                with open(token_file, 'wb') as token:
-                    pickle.dump(self.credentials, token)
-
-            # Build YouTube API service
-            self.youtube = build('youtube', 'v3', credentials=self.credentials)
-            logger.info("Successfully authenticated with YouTube API")
+            self.credentials = credential_store.get_credentials()
+            self.youtube = credential_store.get_client()
+            return self.youtube
             
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
             raise ValueError(f"Failed to authenticate with YouTube: {str(e)}")
 
-    def upload_video(self, video_path: str, title: str, description: str, tags: list) -> str:
+    def upload_video(self, video_path: str, title: str, description: str, tags: list,
+                     progress_callback=None) -> str:
         """
         Upload video to YouTube
         
@@ -61,6 +53,8 @@ class YouTubeUploader:
             title (str): Video title
             description (str): Video description
             tags (list): List of tags
+            progress_callback (callable, optional): Called as
+                progress_callback(bytes_sent, total_size) after each chunk
             
         Returns:
             str: YouTube video ID
@@ -68,9 +62,47 @@ class YouTubeUploader:
         Raises:
             ValueError: If upload fails
         """
+        # Create MediaFileUpload object; the engine adapts the chunk size as it goes
+        media = AdaptiveMediaFileUpload(
+            video_path,
+            chunksize=Config.UPLOAD_INITIAL_CHUNK_SIZE,
+            resumable=True
+        )
+        return self._upload_media(media, title, description, tags, progress_callback)
+
+    def upload_stream(self, source: GrowingFile, title: str, description: str, tags: list,
+                      progress_callback=None) -> str:
+        """
+        Upload a video to YouTube while it is still being downloaded
+        
+        Args:
+            source (GrowingFile): File being written by the downloader; its
+                total size must be known
+            title (str): Video title
+            description (str): Video description
+            tags (list): List of tags
+            progress_callback (callable, optional): See upload_video
+            
+        Returns:
+            str: YouTube video ID
+            
+        Raises:
+            ValueError: If the download or the upload fails
+        """
+        mimetype = mimetypes.guess_type(source.path)[0] or 'application/octet-stream'
+        media = GrowingFileUpload(
+            source,
+            mimetype,
+            chunksize=Config.UPLOAD_INITIAL_CHUNK_SIZE,
+            min_chunk_size=Config.UPLOAD_MIN_CHUNK_SIZE
+        )
+        return self._upload_media(media, title, description, tags, progress_callback)
+
+    def _upload_media(self, media, title: str, description: str, tags: list,
+                      progress_callback=None) -> str:
+        """Insert a video with the given resumable media body and metadata"""
         try:
-            if not self.youtube:
-                self.authenticate()
+            youtube = self.authenticate()
 
             # Prepare the video upload request
             body = {
@@ -86,28 +118,21 @@ class YouTubeUploader:
                 }
             }
 
-            # Create MediaFileUpload object
-            media = MediaFileUpload(
-                video_path,
-                chunksize=1024*1024,  # 1MB chunks
-                resumable=True
-            )
-
             # Create the video insert request
             logger.info(f"Starting upload for video: {title}")
-            request = self.youtube.videos().insert(
+            request = youtube.videos().insert(
                 part=','.join(body.keys()),
                 body=body,
                 media_body=media
             )
 
             # Upload the video
-            response = None
-            while response is None:
-                status, response = request.next_chunk()
-                if status:
-                    progress = int(status.progress() * 100)
-                    logger.info(f"Upload progress: {progress}%")
+            def report_progress(bytes_sent, total_size):
+                self._log_progress(bytes_sent, total_size)
+                if progress_callback:
+                    progress_callback(bytes_sent, total_size)
+
+            response = self.upload_engine.run(request, progress_callback=report_progress)
 
             logger.info(f"Upload complete! Video ID: {response['id']}")
             return response['id']
@@ -115,12 +140,97 @@ class YouTubeUploader:
         except HttpError as e:
             error_message = f"HTTP error occurred: {e.resp.status} {e.content}"
             logger.error(error_message)
+            if e.resp.status == 403 and any(reason.encode() in e.content for reason in QUOTA_ERROR_REASONS):
+                raise QuotaExceededError(error_message)
+            if e.resp.status in RETRYABLE_STATUS_CODES:
+                raise TransientError(error_message)
             raise ValueError(error_message)
         except Exception as e:
             error_message = f"Error uploading video: {str(e)}"
             logger.error(error_message)
+            if isinstance(e, RETRYABLE_EXCEPTIONS + (TransientError,)):
+                raise TransientError(error_message)
             raise ValueError(error_message)
 
+    def _log_progress(self, bytes_sent: int, total_size: int):
+        """Log upload progress after each chunk"""
+        if total_size:
+            progress = int(bytes_sent * 100 / total_size)
+            logger.info(f"Upload progress: {progress}%", extra={'rate_limit': f"upload_progress:{id(self)}"})
+
+    def set_thumbnail(self, video_id: str, image_path: str):
+        """
+        Set the custom thumbnail of a video
+        
+        Args:
+            video_id (str): YouTube video ID
+            image_path (str): JPEG image, at most 2MB
+            
+        Raises:
+            ValueError: If YouTube rejects the thumbnail, e.g. because the
+                channel is not verified for custom thumbnails
+        """
+        try:
+            youtube = self.authenticate()
+
+            youtube.thumbnails().set(
+                videoId=video_id,
+                media_body=MediaFileUpload(image_path, mimetype='image/jpeg')
+            ).execute()
+            
+            logger.info(f"Set thumbnail of video {video_id}")
+            
+        except HttpError as e:
+            error_message = f"HTTP error setting thumbnail: {e.resp.status} {e.content}"
+            logger.error(error_message)
+            if e.resp.status == 403 and any(reason.encode() in e.content for reason in QUOTA_ERROR_REASONS):
+                raise QuotaExceededError(error_message)
+            raise ValueError(error_message)
+        except Exception as e:
+            logger.error(f"Error setting thumbnail: {str(e)}")
+            raise ValueError(f"Failed to set thumbnail: {str(e)}")
+
+    def update_video_details(self, video_id: str, title: str, description: str, tags: list):
+        """
+        Replace the title, description and tags of an uploaded video
+        
+        Args:
+            video_id (str): YouTube video ID
+            title (str): Video title
+            description (str): Video description
+            tags (list): List of tags
+            
+        Raises:
+            ValueError: If YouTube rejects the update
+        """
+        try:
+            youtube = self.authenticate()
+
+            youtube.videos().update(
+                part='snippet',
+                body={
+                    'id': video_id,
+                    'snippet': {
+                        'title': title,
+                        'description': description,
+                        'tags': tags,
+                        'categoryId': '22'  # Required on snippet updates; same as the insert
+                    }
+                }
+            ).execute()
+            
+            logger.info(f"Updated details of video {video_id}")
+            
+        except HttpError as e:
+            error_message = f"HTTP error updating video details: {e.resp.status} {e.content}"
+            logger.error(error_message)
+            if e.resp.status == 403 and any(reason.encode() in e.content for reason in QUOTA_ERROR_REASONS):
+                raise QuotaExceededError(error_message)
+            raise ValueError(error_message)
+        except Exception as e:
+            logger.error(f"Error updating video details: {str(e)}")
+            raise ValueError(f"Failed to update video details: {str(e)}")
+
     def update_video_privacy(self, video_id: str, privacy_status: str = 'public'):
         """
         Update the privacy status of a video
@@ -130,10 +240,9 @@ class YouTubeUploader:
             privacy_status (str): Privacy status ('private', 'unlisted', or 'public')
         """
         try:
-            if not self.youtube:
-                self.authenticate()
+            youtube = self.authenticate()
 
-            self.youtube.videos().update(
+            youtube.videos().update(
                 part='status',
                 body={
                     'id': video_id,
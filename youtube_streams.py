@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+from contextlib import closing
+from urllib.parse import urlparse, parse_qs
+from pytube import YouTube, extract
+from logger import setup_logger
+from config import Config
+
+logger = setup_logger(__name__)
+
+# Stream URLs stop working at their 'expire' time; stop using them a bit earlier
+EXPIRY_MARGIN = 10 * 60
+
+class YouTubeStreamResolver:
+    """
+    Pick the streams to download for a YouTube video, with a metadata cache
+
+    Extracting stream URLs with pytube fetches and deciphers the watch page,
+    which takes seconds. The selected streams are cached in SQLite by video
+    ID (shared across processes) until shortly before their signed URLs
+    expire, so repeat requests go straight to the download.
+    """
+
+    def __init__(self, db_path: str = None, ttl: int = None):
+        self.db_path = db_path or Config.YOUTUBE_STREAM_DB
+        self.ttl = ttl or Config.YOUTUBE_STREAM_CACHE_TTL
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS streams ('
+                'video_id TEXT NOT NULL, mode TEXT NOT NULL, streams TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, PRIMARY KEY (video_id, mode))'
+            )
+
+    def resolve(self, url: str, adaptive: bool, refresh: bool = False) -> dict:
+        """
+        Get the streams to download for a video
+
+        Args:
+            url (str): YouTube video URL
+            adaptive (bool): Select separate best video and audio streams
+                instead of the best progressive (muxed, max 720p) stream
+            refresh (bool): Ignore cached streams, e.g. after their URLs were rejected
+
+        Returns:
+            dict: {'progressive': stream} or {'video': stream, 'audio': stream},
+                where each stream is a dict with url, subtype and description
+
+        Raises:
+            ValueError: If the video has no suitable streams
+        """
+        video_id = extract.video_id(url)
+        mode = 'adaptive' if adaptive else 'progressive'
+
+        if not refresh:
+            streams = self._get(video_id, mode)
+            if streams:
+                logger.info(f"Using cached {mode} streams for YouTube video {video_id}")
+                return streams
+
+        stream_query = YouTube(url).streams
+        streams = self._select_adaptive(stream_query) if adaptive else None
+        if not streams:
+            streams = self._select_progressive(stream_query)
+        self._put(video_id, mode, streams)
+        return streams
+
+    @staticmethod
+    def _select_progressive(stream_query) -> dict:
+        stream = stream_query.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
+        if not stream:
+            raise ValueError("No suitable video stream found")
+        return {'progressive': YouTubeStreamResolver._describe(stream)}
+
+    @staticmethod
+    def _select_adaptive(stream_query) -> dict:
+        """Best resolution video stream (mp4 on ties) and the best matching audio stream"""
+        videos = stream_query.filter(adaptive=True, only_video=True)
+        video = max(
+            (stream for stream in videos if stream.resolution),
+            key=lambda stream: (int(stream.resolution.rstrip('p')), stream.subtype == 'mp4'),
+            default=None
+        )
+        if not video:
+            return None
+
+        audios = stream_query.filter(adaptive=True, only_audio=True)
+        audio = max(
+            (stream for stream in audios if stream.abr),
+            key=lambda stream: (stream.subtype == video.subtype, int(stream.abr.rstrip('kbps'))),
+            default=None
+        )
+        if not audio:
+            return None
+
+        return {
+            'video': YouTubeStreamResolver._describe(video),
+            'audio': YouTubeStreamResolver._describe(audio)
+        }
+
+    @staticmethod
+    def _describe(stream) -> dict:
+        return {
+            'url': stream.url,
+            'subtype': stream.subtype,
+            'description': f"itag {stream.itag} {stream.mime_type} {stream.resolution or stream.abr}"
+        }
+
+    def _get(self, video_id: str, mode: str) -> dict:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT streams FROM streams WHERE video_id = ? AND mode = ? AND expires_at > ?',
+                (video_id, mode, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, video_id: str, mode: str, streams: dict):
+        now = time.time()
+        expires_at = now + self.ttl
+        for stream in streams.values():
+            expire = parse_qs(urlparse(stream['url']).query).get('expire')
+            if expire and expire[0].isdigit():
+                expires_at = min(expires_at, int(expire[0]) - EXPIRY_MARGIN)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM streams WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'INSERT OR REPLACE INTO streams (video_id, mode, streams, expires_at) VALUES (?, ?, ?, ?)',
+                (video_id, mode, json.dumps(streams), expires_at)
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)